@@ -0,0 +1,117 @@
+from typing import List, Optional
+import numpy as np
+import Snapshot
+
+# Each metric is a handful of whole-array operations over a snapshot: links are expanded with fancy indexing and
+# grouped with bincount, so nothing loops over documents in Python
+
+
+def load(path: Optional[str] = None) -> Snapshot.Snapshot:
+    # A saved snapshot opens instantly; without one the columns are read from the database in bulk
+    return Snapshot.Snapshot.open(path) if path else Snapshot.build()
+
+
+def termMask(snap: Snapshot.Snapshot, semester: Optional[str] = None, year: Optional[int] = None) -> np.ndarray:
+    mask = np.ones(snap.count("section"), dtype=bool)
+    if semester is not None:
+        codes = snap.codes["semester"]
+        mask &= snap["section_semester"] == (codes.index(semester) if semester in codes else -2)
+    if year is not None:
+        mask &= snap["section_year"] == int(year)
+    return mask
+
+
+def sectionUnits(snap: Snapshot.Snapshot) -> np.ndarray:
+    # Sections whose course is missing from the snapshot carry no units
+    courses = snap["section_course"]
+    return np.where(courses >= 0, snap["course_units"][np.maximum(courses, 0)], 0)
+
+
+def sectionDepartments(snap: Snapshot.Snapshot) -> np.ndarray:
+    courses = snap["section_course"]
+    return np.where(courses >= 0, snap["course_department"][np.maximum(courses, 0)], -1)
+
+
+def unitsPerStudent(snap: Snapshot.Snapshot, semester: Optional[str] = None, year: Optional[int] = None) -> dict:
+    indptr, sections = snap["student_sections_indptr"], snap["student_sections_indices"]
+    owners = np.repeat(np.arange(snap.count("student")), np.diff(indptr))
+    in_term = termMask(snap, semester, year)[sections]
+    units = np.bincount(owners[in_term], weights=sectionUnits(snap)[sections[in_term]],
+                        minlength=snap.count("student")).astype(np.int64)
+
+    enrolled = units[np.bincount(owners[in_term], minlength=snap.count("student")) > 0]
+    loads, counts = np.unique(enrolled, return_counts=True)
+    return {"students": int(len(enrolled)), "mean": float(enrolled.mean()) if len(enrolled) else 0.0,
+            "max": int(enrolled.max()) if len(enrolled) else 0,
+            "distribution": {int(load): int(count) for load, count in zip(loads, counts)}}
+
+
+def fillRateByDepartment(snap: Snapshot.Snapshot, semester: Optional[str] = None,
+                         year: Optional[int] = None) -> List[dict]:
+    enrolled = np.diff(snap["section_students_indptr"])
+    capacity = snap["section_capacity"]
+    departments = sectionDepartments(snap)
+    selected = termMask(snap, semester, year) & (departments >= 0)
+    # Unlimited sections count toward enrollment but not toward seats or the fill rate
+    limited = selected & (capacity >= 0)
+
+    size = snap.count("department")
+    sections = np.bincount(departments[selected], minlength=size)
+    students = np.bincount(departments[selected], weights=enrolled[selected], minlength=size)
+    seated = np.bincount(departments[limited], weights=enrolled[limited], minlength=size)
+    seats = np.bincount(departments[limited], weights=capacity[limited], minlength=size)
+
+    rows = []
+    for dept in np.flatnonzero(sections):
+        rows.append({"department": snap.codes["department"][dept], "sections": int(sections[dept]),
+                     "enrolled": int(students[dept]), "capacity": int(seats[dept]),
+                     "fill_rate": float(seated[dept] / seats[dept]) if seats[dept] else None})
+    return rows
+
+
+def instructorLoad(snap: Snapshot.Snapshot, semester: Optional[str] = None, year: Optional[int] = None) -> List[dict]:
+    instructors = snap["section_instructor"]
+    selected = termMask(snap, semester, year) & (instructors >= 0)
+    enrolled = np.diff(snap["section_students_indptr"])
+
+    size = len(snap.codes["instructor"])
+    sections = np.bincount(instructors[selected], minlength=size)
+    students = np.bincount(instructors[selected], weights=enrolled[selected], minlength=size)
+    units = np.bincount(instructors[selected], weights=sectionUnits(snap)[selected], minlength=size)
+
+    order = np.lexsort((np.arange(size), -units))
+    return [{"instructor": snap.codes["instructor"][idx], "sections": int(sections[idx]),
+             "students": int(students[idx]), "units": int(units[idx])} for idx in order if sections[idx]]
+
+
+METRICS = {"units": unitsPerStudent, "fill": fillRateByDepartment, "instructors": instructorLoad}
+
+
+def run(metric: str, semester: Optional[str] = None, year: Optional[int] = None, snapshot: Optional[str] = None):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', use one of {', '.join(METRICS)}")
+    return METRICS[metric](load(snapshot), semester, year)
+
+
+def promptAnalytics(metric: str):
+    path = input("Snapshot file (enter to read from the database) --> ")
+    semester = input("Semester (enter for all) --> ") or None
+    year = input("Year (enter for all) --> ")
+    while year and not year.isdigit():
+        print("Invalid input. Enter a year or nothing.")
+        year = input("Year (enter for all) --> ")
+
+    try:
+        result = run(metric, semester, int(year) if year else None, path or None)
+    except (ValueError, OSError) as e:
+        print(f"Analytics failed: {e}")
+        return
+    if metric == "units":
+        print(f"{result['students']} student(s) enrolled, {result['mean']:.1f} units on average, "
+              f"{result['max']} at most")
+        for load_units, count in result["distribution"].items():
+            print(f"  {load_units:3} units: {count}")
+        return
+    for row in result:
+        print(", ".join(f"{key}: {value:.2%}" if key == "fill_rate" and value is not None else f"{key}: {value}"
+                        for key, value in row.items()))
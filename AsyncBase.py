@@ -0,0 +1,153 @@
+from datetime import datetime
+from typing import List, Tuple, Optional
+from pymongo.errors import CollectionInvalid
+from Base import Base, METADATA_COLLECTION, NAME_REFERENCES
+
+
+class AsyncBase(Base):
+    # Same schemas, attributes and uniqueCombinations as the synchronous classes, with every database call
+    # awaited. Instances register here rather than in CollectionManager so async and sync code can coexist.
+    _collections = {}
+
+    def __init__(self, db):
+        self._db = db
+        self._collectionName = "Invalid"
+        self._collection = None
+        self.cache = None
+        self.schema = {"invalid"}
+        self.attributes = []
+        self.uniqueCombinations = []
+        self.indexes = []
+        self.initCollection()
+        AsyncBase._collections[self.collectionName] = self
+
+    @classmethod
+    async def create(cls, db):
+        instance = cls(db)
+        await instance.setupCollection()
+        return instance
+
+    async def setupCollection(self, force: bool = False) -> bool:
+        fingerprint = self.schemaFingerprint()
+        stored = await AsyncBase.loadFingerprints(self.db)
+        if not force and stored.get(self.collectionName) == fingerprint:
+            return False
+
+        try:
+            await self.db.create_collection(self.collectionName)
+        except CollectionInvalid:
+            print(f'Using existing "{self.collectionName}" collection.')
+
+        await self.db.command("collMod", self.collectionName, validator=self.schema)
+
+        for index_fields, options in self.indexSpecs():
+            await self.collection.create_index(index_fields, **options)
+
+        await self.db[METADATA_COLLECTION].replace_one(
+            {"_id": self.collectionName},
+            {"_id": self.collectionName, "fingerprint": fingerprint, "applied": datetime.now()},
+            upsert=True)
+        stored[self.collectionName] = fingerprint
+        return True
+
+    @staticmethod
+    async def loadFingerprints(db) -> dict:
+        if db.name not in Base._fingerprints:
+            cursor = db[METADATA_COLLECTION].find({})
+            Base._fingerprints[db.name] = {meta["_id"]: meta.get("fingerprint") async for meta in cursor}
+        return Base._fingerprints[db.name]
+
+    async def migrate(self):
+        await self.setupCollection(force=True)
+
+    async def addDoc(self, doc: dict):
+        new_doc = dict(doc)
+        for attr, value in self.uniqueAttrAdds():
+            new_doc.setdefault(attr, value)
+
+        new_doc_id = (await self.collection.insert_one(new_doc)).inserted_id
+        await self.flushEvents([Base.emit(self.collectionName, "insert", new_doc_id, new_doc)])
+        await self.onValidInsert(new_doc_id)
+        return new_doc_id
+
+    async def deleteDoc(self, doc_id) -> bool:
+        doc = await self.collection.find_one({"_id": doc_id})
+        if doc is None or not await self.orphanCleanup(doc):
+            return False
+
+        delete_result = await self.collection.delete_one({"_id": doc_id})
+        self.invalidate(doc_id)
+        if delete_result.deleted_count > 0:
+            await self.flushEvents([Base.emit(self.collectionName, "delete", doc_id, doc)])
+        return delete_result.deleted_count > 0
+
+    async def flushEvents(self, events):
+        writes = {}
+        for event in events:
+            for collection_name, operations in event.sideWrites.items():
+                writes.setdefault(collection_name, []).extend(operations)
+
+        for collection_name, operations in writes.items():
+            await self.db[collection_name].bulk_write(operations, ordered=False)
+            if collection_name in Base._caches:
+                Base._caches[collection_name].invalidate()
+
+    async def listAll(self, batchSize: int = 500, pageToken: str = None):
+        while True:
+            batch, pageToken = await self.listPage(batchSize, pageToken)
+            for doc in batch:
+                yield doc
+            if pageToken is None:
+                return
+
+    async def listPage(self, pageSize: int = 50, pageToken: str = None) -> Tuple[List, Optional[str]]:
+        cursor = await self.collection.aggregate(self.listPipeline(pageToken, pageSize))
+        docs = await cursor.to_list(None)
+        next_token = str(docs[-1]['_id']) if len(docs) == pageSize else None
+        return docs, next_token
+
+    async def resolve(self, doc_filter):
+        cached = self.cachedReferences()
+        cursor = await self.collection.aggregate(
+            [{'$match': doc_filter}, {'$limit': 1}] + self.resolvePipeline(skip=cached))
+        docs = await cursor.to_list(1)
+        if not docs:
+            return None
+
+        doc = docs[0]
+        for field, from_collection, name_fields, missing in NAME_REFERENCES:
+            if from_collection not in cached or field not in doc:
+                continue
+
+            ref_ids = doc[field] if isinstance(doc[field], list) else [doc[field]]
+            refs = await self.referencedCollection(from_collection).findByIds(ref_ids)
+            self.fillNames(doc, field, ref_ids, refs, name_fields, missing)
+        return doc
+
+    def referencedCollection(self, collection_name):
+        return AsyncBase._collections[collection_name]
+
+    async def findById(self, doc_id):
+        doc = self.cache.get(doc_id) if self.cache is not None else None
+        if doc is None:
+            doc = await self.collection.find_one({"_id": doc_id})
+            if doc is not None and self.cache is not None:
+                self.cache.put(doc)
+        return doc
+
+    async def findByIds(self, doc_ids) -> dict:
+        found = {}
+        missing = []
+        for doc_id in doc_ids:
+            doc = self.cache.get(doc_id) if self.cache is not None else None
+            if doc is None:
+                missing.append(doc_id)
+            else:
+                found[doc_id] = doc
+
+        if missing:
+            async for doc in self.collection.find({"_id": {"$in": missing}}):
+                if self.cache is not None:
+                    self.cache.put(doc)
+                found[doc["_id"]] = doc
+        return found
@@ -0,0 +1,171 @@
+from typing import List
+from pymongo.errors import BulkWriteError, PyMongoError
+from Base import Base
+from AsyncBase import AsyncBase
+from Department import Department
+from Course import Course
+from Section import Section
+from Student import Student
+import Timetable
+# Registers the report marks for writes made through this layer, which main.py doesn't wire up
+import Reporting  # noqa: F401
+
+
+class AsyncDepartment(AsyncBase):
+    initCollection = Department.initCollection
+    uniqueAttrAdds = Department.uniqueAttrAdds
+
+    async def orphanCleanup(self, doc) -> bool:
+        return Department.orphanCleanup(self, doc)
+
+    async def onValidInsert(self, doc_id):
+        pass
+
+    async def f_appendCourse(self, dept_id, course_id) -> bool:
+        event = Base.emit(self.collectionName, "update", dept_id, pushed={"courses": [course_id]})
+        result = await self.collection.update_one({"_id": dept_id}, event.apply({"$push": {"courses": course_id}}))
+        self.invalidate(dept_id)
+        if result.modified_count > 0:
+            await self.flushEvents([event])
+        return result.modified_count > 0
+
+    async def f_removeCourse(self, dept_id, course_id) -> bool:
+        event = Base.emit(self.collectionName, "update", dept_id, pulled={"courses": [course_id]})
+        result = await self.collection.update_one({"_id": dept_id, "courses": course_id},
+                                                  event.apply({"$pull": {"courses": course_id}}))
+        self.invalidate(dept_id)
+        if result.modified_count > 0:
+            await self.flushEvents([event])
+        return result.modified_count > 0
+
+
+class AsyncCourse(AsyncBase):
+    initCollection = Course.initCollection
+    uniqueAttrAdds = Course.uniqueAttrAdds
+
+    async def orphanCleanup(self, doc) -> bool:
+        sections = self.referencedCollection("sections")
+        if await sections.collection.count_documents({"course": doc["_id"]}, limit=1) > 0:
+            return False
+        return await self.referencedCollection("departments").f_removeCourse(doc["department"], doc["_id"])
+
+    async def onValidInsert(self, doc_id):
+        dept_id = (await self.findById(doc_id))["department"]
+        if not await self.referencedCollection("departments").f_appendCourse(dept_id, doc_id):
+            await self.collection.delete_one({"_id": doc_id})
+
+
+class AsyncSection(AsyncBase):
+    initCollection = Section.initCollection
+    uniqueAttrAdds = Section.uniqueAttrAdds
+
+    async def orphanCleanup(self, doc) -> bool:
+        return len(doc.get("students", [])) == 0
+
+    async def onValidInsert(self, doc_id):
+        pass
+
+    async def f_appendStudent(self, sect_id, student_id) -> bool:
+        event = Base.emit(self.collectionName, "enroll", sect_id, student_id=student_id)
+        result = await self.collection.update_one(Section.seatFilter(sect_id, student_id),
+                                                  event.apply({"$push": {"students": student_id}}))
+        if result.modified_count > 0:
+            await self.flushEvents([event])
+        return result.modified_count > 0
+
+    async def f_removeStudent(self, sect_id, student_id) -> bool:
+        event = Base.emit(self.collectionName, "unenroll", sect_id, student_id=student_id)
+        result = await self.collection.update_one(Section.removeFilter(sect_id, student_id),
+                                                  event.apply({"$pull": {"students": student_id}}))
+        if result.modified_count > 0:
+            await self.flushEvents([event])
+        return True
+
+
+class AsyncStudent(AsyncBase):
+    initCollection = Student.initCollection
+    uniqueAttrAdds = Student.uniqueAttrAdds
+
+    async def orphanCleanup(self, doc) -> bool:
+        sections = self.referencedCollection("sections")
+        for enr in doc.get("sections", []):
+            await sections.f_removeStudent(enr["section_id"], doc["_id"])
+        return True
+
+    async def onValidInsert(self, doc_id):
+        pass
+
+    async def enroll(self, student_id, section_id, enrollment=None) -> dict:
+        return (await self.enroll_many([(student_id, section_id)], enrollment))[0]
+
+    async def enroll_many(self, pairs, enrollment=None, batch_size: int = 1000) -> List[dict]:
+        if enrollment is None:
+            enrollment = {"type": "LetterGrade", "min_satisfactory": "C"}
+
+        results = []
+        pairs = list(pairs)
+        for start in range(0, len(pairs), batch_size):
+            results.extend(await self._enrollBatch(pairs[start:start + batch_size], enrollment))
+        return results
+
+    async def _enrollBatch(self, pairs, default_enrollment) -> List[dict]:
+        # Same steps as Student._enrollBatch, awaited
+        sections = self.referencedCollection("sections").collection
+        results = Student.enrollmentResults(pairs, default_enrollment)
+
+        students = {stu["_id"]: stu async for stu in self.collection.find(
+            {"_id": {"$in": list({res["student_id"] for res in results})}}, {"sections": 1})}
+        section_docs = {sect["_id"]: sect async for sect in sections.find(
+            {"_id": {"$in": Student.sectionIdsInvolved(results, students)}}, Timetable.SECTION_FIELDS)}
+
+        accepted = Student.checkEnrollments(results, students, section_docs)
+        if not accepted:
+            return results
+
+        claim_events = Student.sectionEvents(accepted, "enroll")
+        try:
+            await sections.bulk_write(Student.seatClaims(accepted, claim_events), ordered=False)
+        except PyMongoError:
+            pass
+        cursor = await sections.aggregate(Student.seatedPipeline(accepted))
+        seated = {sect["_id"]: set(sect["students"]) async for sect in cursor}
+        landed = Student.landedEvents(accepted, claim_events, seated)
+
+        student_groups = Student.studentGroups(Student.markClaimed(accepted, seated))
+        operations = Student.studentPushes(student_groups)
+        failed_from = len(operations)
+        if operations:
+            try:
+                await self.collection.bulk_write(operations, ordered=True)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                failed_from = errors[0]["index"] if errors else 0
+            except PyMongoError:
+                failed_from = 0
+
+        undo = [res for group in student_groups[failed_from:] for res in group]
+        release_events = Student.sectionEvents(undo, "unenroll")
+        if undo:
+            await sections.bulk_write(Student.seatReleases(undo, release_events), ordered=False)
+            for res in undo:
+                res["status"], res["message"] = "error", "Failed to add the section to the student"
+
+        await self.flushEvents(landed + release_events)
+        return results
+
+    async def unenroll(self, student_id, section_id) -> bool:
+        update_result = await self.collection.update_one(
+            {"_id": student_id},
+            {"$pull": {"sections": {"section_id": section_id}}}
+        )
+        if update_result.modified_count == 0:
+            return False
+        return await self.referencedCollection("sections").f_removeStudent(section_id, student_id)
+
+
+async def openCollections(db) -> dict:
+    collections = {}
+    for cls in [AsyncDepartment, AsyncCourse, AsyncSection, AsyncStudent]:
+        instance = await cls.create(db)
+        collections[instance.collectionName] = instance
+    return collections
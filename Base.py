@@ -1,10 +1,15 @@
 from pprint import pprint
+import hashlib
+import json
 import pymongo
 from abc import ABC, abstractmethod
 from enum import Enum
 from datetime import datetime
-from typing import Tuple, Any, List
+from typing import Tuple, Any, List, Iterator, Optional
+from bson import ObjectId, json_util
 from CollectionManager import CollectionManager
+from IdentityCache import IdentityCache
+import WriteBehind
 
 
 class AttrType(Enum):
@@ -16,14 +21,64 @@ class AttrType(Enum):
     FOREIGN_COURSE = "courses"
 
 
+METADATA_COLLECTION = "schema_metadata"
+
+# (field, referenced collection, name fields, fallback) for single references; array references have no fallback
+NAME_REFERENCES = [
+    ('course', 'courses', ['course_name'], 'Unknown Course'),
+    ('department', 'departments', ['name'], 'Unknown Department'),
+    ('students', 'students', ['last_name', 'first_name'], None),
+    ('courses', 'courses', ['course_name'], None),
+]
+
+
+class Event:
+    # Something that happened to one document. Subscribers add update operators to the write that raised the
+    # event (modifiers) and writes of their own against other collections (side writes), so derived data is
+    # kept current in the same batch instead of being recomputed later
+    def __init__(self, name: str, collection_name: str, doc_id, doc=None, **details):
+        self.name = name
+        self.collectionName = collection_name
+        self.docId = doc_id
+        self.doc = doc
+        self.details = details
+        self.modifiers = {}
+        self.sideWrites = {}
+
+    def inc(self, field: str, amount: int = 1):
+        incs = self.modifiers.setdefault("$inc", {})
+        incs[field] = incs.get(field, 0) + amount
+
+    def set(self, field: str, value):
+        self.modifiers.setdefault("$set", {})[field] = value
+
+    def write(self, collection_name: str, operation):
+        self.sideWrites.setdefault(collection_name, []).append(operation)
+
+    def apply(self, update: dict) -> dict:
+        merged = {operator: dict(fields) for operator, fields in update.items()}
+        for operator, fields in self.modifiers.items():
+            merged.setdefault(operator, {}).update(fields)
+        return merged
+
+
 class Base(ABC):
+    _caches = {}
+    _fingerprints = {}
+    # (collection name, event name) -> handlers, shared by the sync and async classes
+    _subscribers = {}
+    # collection name -> search index, for the collections Search covers
+    _searchIndexes = {}
+
     def __init__(self, db):
         self._db = db
         self._collectionName = "Invalid"
         self._collection = None
+        self.cache = None
         self.schema = {"invalid"}
         self.attributes = []
         self.uniqueCombinations = []
+        self.indexes = []
         self.initCollection()
         self.setupCollection()
 
@@ -31,7 +86,12 @@ class Base(ABC):
     def initCollection(self):
         pass
 
-    def setupCollection(self):
+    def setupCollection(self, force: bool = False) -> bool:
+        # DDL only runs when the schema or index spec differs from what was last applied to this database
+        fingerprint = self.schemaFingerprint()
+        if not force and Base.storedFingerprints(self.db).get(self.collectionName) == fingerprint:
+            return False
+
         try:
             self.db.create_collection(self.collectionName)
         except Exception as e:
@@ -39,9 +99,121 @@ class Base(ABC):
 
         self.db.command("collMod", self.collectionName, validator=self.schema)
 
+        for index_fields, options in self.indexSpecs():
+            self.collection.create_index(index_fields, **options)
+
+        self.db[METADATA_COLLECTION].replace_one(
+            {"_id": self.collectionName},
+            {"_id": self.collectionName, "fingerprint": fingerprint, "applied": datetime.now()},
+            upsert=True)
+        Base.storedFingerprints(self.db)[self.collectionName] = fingerprint
+        return True
+
+    def indexSpecs(self) -> List[Tuple[List[Tuple[str, int]], dict]]:
+        specs = []
         for combo in self.uniqueCombinations:
             index_fields = [(self.attributes[index][0], pymongo.ASCENDING) for index in combo]
-            self.collection.create_index(index_fields, unique=True)
+            specs.append((index_fields, {"unique": True}))
+        for index_fields in self.indexes:
+            specs.append((index_fields, {}))
+        return specs
+
+    def schemaFingerprint(self) -> str:
+        spec = {"schema": self.schema, "indexes": self.indexSpecs()}
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def storedFingerprints(db) -> dict:
+        # One read of the metadata collection per database, shared by every collection set up against it
+        if db.name not in Base._fingerprints:
+            Base._fingerprints[db.name] = {meta["_id"]: meta.get("fingerprint")
+                                           for meta in db[METADATA_COLLECTION].find({})}
+        return Base._fingerprints[db.name]
+
+    def migrate(self):
+        applied = self.setupCollection(force=True)
+        self.recountCounters()
+        print(f'Applied schema and indexes to "{self.collectionName}".' if applied
+              else f'"{self.collectionName}" is up to date.')
+
+    def recountCounters(self):
+        # Collections with denormalized counters rebuild them here from the arrays they summarize
+        pass
+
+    @staticmethod
+    def subscribe(collection_name: str, event_name: str, handler):
+        handlers = Base._subscribers.setdefault((collection_name, event_name), [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    @staticmethod
+    def emit(collection_name: str, event_name: str, doc_id, doc=None, **details) -> Event:
+        # Updates are raised before their write so subscribers can add modifiers to it; inserts and deletes
+        # after it. Either way the caller flushes the side writes once its own write has landed.
+        event = Event(event_name, collection_name, doc_id, doc, **details)
+        for handler in Base._subscribers.get((collection_name, event_name), []):
+            handler(event)
+        return event
+
+    @staticmethod
+    def registerSearch(collection_name: str, index):
+        Base._searchIndexes[collection_name] = index
+
+    def searchDoc(self, query: str, resolveNames: bool = True):
+        # Ranked matches from the collection's search index to pick from; None if nothing matched or was picked
+        matches = Base._searchIndexes[self.collectionName].search(query)
+        if not matches:
+            print(f'No {self.collectionName} match "{query}".')
+            return None
+
+        for idx, match in enumerate(matches, start=1):
+            print(f"{idx}. {match['label']}")
+        choice = input("Pick one (enter for none) --> ")
+        while choice and choice not in [str(i) for i in range(1, len(matches) + 1)]:
+            print(f"Invalid input. Enter from 1 to {len(matches)} or nothing.")
+            choice = input("Pick one (enter for none) --> ")
+        if not choice:
+            return None
+
+        doc_filter = {"_id": matches[int(choice) - 1]["_id"]}
+        return self.resolve(doc_filter) if resolveNames else self.collection.find_one(doc_filter)
+
+    def promptSearch(self, resolveNames: bool = True):
+        while True:
+            doc = self.searchDoc(input("Search for --> "), resolveNames)
+            if doc is not None:
+                return doc
+
+            print("Search again? [y/n]")
+            user_inp = input("--> ")
+            while user_inp != 'y' and user_inp != 'n':
+                print("\nInvalid input. Enter 'y' for Yes or 'n' for No.")
+                user_inp = input("--> ")
+            if user_inp == 'n':
+                return None
+
+    def queueUpdate(self, doc_filter: dict, update: dict, event=None, recount: Optional[dict] = None) -> bool:
+        # Hands a follow-up update to the write-behind queue when one is running (outside a synchronous block);
+        # it then counts as done and its events go out with the flush. recount ({counter: array}) has those
+        # counters recomputed from their arrays when the write is sent instead of taking the event's $inc
+        queue = WriteBehind.active()
+        if queue is None:
+            return False
+        queue.add(self.collectionName, doc_filter, update, event, recount)
+        self.invalidate(doc_filter["_id"])
+        return True
+
+    def flushEvents(self, events):
+        # Side writes of a whole batch go out as one unordered bulk_write per target collection
+        writes = {}
+        for event in events:
+            for collection_name, operations in event.sideWrites.items():
+                writes.setdefault(collection_name, []).extend(operations)
+
+        for collection_name, operations in writes.items():
+            self.db[collection_name].bulk_write(operations, ordered=False)
+            if collection_name in Base._caches:
+                Base._caches[collection_name].invalidate()
 
     def addDoc(self):
         success: bool = False
@@ -55,6 +227,12 @@ class Base(ABC):
                         case AttrType.STRING:
                             new_doc[attr] = input(f"{str(self.schema['$jsonSchema']['properties'][attr])}"
                                                   f"\nEnter {attr} --> ")
+                        case AttrType.INTEGER if attr not in self.schema["$jsonSchema"].get("required", []):
+                            # Optional numbers (a section's capacity) are left out on a blank answer
+                            answer = input(f"{str(self.schema['$jsonSchema']['properties'][attr])}"
+                                           f"\nEnter {attr} (blank for none) --> ").strip()
+                            if answer:
+                                new_doc[attr] = int(answer)
                         case AttrType.INTEGER:
                             new_doc[attr] = int(input(f"{str(self.schema['$jsonSchema']['properties'][attr])}"
                                                       f"\nEnter {attr} --> "))
@@ -72,7 +250,8 @@ class Base(ABC):
                                 continue
 
                             print(f"Select {attrType.value}")
-                            new_doc[attr] = CollectionManager.GetCollection(attrType.value).selectDoc()["_id"]
+                            foreign = CollectionManager.GetCollection(attrType.value)
+                            new_doc[attr] = foreign.selectDoc(resolveNames=False)["_id"]
 
                 new_attrs = self.uniqueAttrAdds()
                 if len(new_attrs) > 0:
@@ -97,6 +276,9 @@ class Base(ABC):
                 continue
 
             success = True
+
+        if new_doc_id is not None:
+            self.flushEvents([Base.emit(self.collectionName, "insert", new_doc_id, new_doc)])
         self.onValidInsert(new_doc_id)
 
     @abstractmethod
@@ -107,28 +289,104 @@ class Base(ABC):
     def onValidInsert(self, doc_id):
         pass
 
-    def deleteDoc(self):
-        doc = self.selectDoc()
+    def deleteDoc(self, doc=None) -> bool:
+        if doc is None:
+            doc = self.selectDoc(resolveNames=False)
         if doc is None:
             print("Document selection failed, aborting deletion.")
-            return
+            return False
 
         if self.orphanCleanup(doc):
             delete_result = self.collection.delete_one({"_id": doc["_id"]})
+            self.invalidate(doc["_id"])
+            if delete_result.deleted_count > 0:
+                self.flushEvents([Base.emit(self.collectionName, "delete", doc["_id"], doc)])
             print(f"Deleted {delete_result.deleted_count} document(s).")
+            return delete_result.deleted_count > 0
         else:
             print(f"Orphan CleanUp Failed in {self.collectionName} collection!")
-            return
+            return False
 
     @abstractmethod
     def orphanCleanup(self, doc) -> bool:
         pass
 
-    def listAll(self) -> List:
+    def delete_many(self, doc_filter: dict, dryRun: bool = False, batchSize: int = 1000) -> dict:
+        # Matching documents are read in _id order a batch at a time; each batch is checked against the same rules
+        # as deleteDoc, cleaned up with set-based writes and removed with one delete_many
+        summary = {"matched": 0, "deleted": 0, "refused": {}}
+        last_id = None
+        while True:
+            page_filter = doc_filter if last_id is None else {"$and": [doc_filter, {"_id": {"$gt": last_id}}]}
+            docs = list(self.collection.find(page_filter).sort("_id", pymongo.ASCENDING).limit(batchSize))
+            if not docs:
+                break
+            last_id = docs[-1]["_id"]
+            summary["matched"] += len(docs)
+
+            allowed, refused = self.deletable(docs)
+            for reason in refused.values():
+                summary["refused"][reason] = summary["refused"].get(reason, 0) + 1
+            if dryRun or not allowed:
+                summary["deleted"] += len(allowed) if dryRun else 0
+                continue
+
+            self.orphanCleanupMany(allowed)
+            doc_ids = [doc["_id"] for doc in allowed]
+            summary["deleted"] += self.collection.delete_many({"_id": {"$in": doc_ids}}).deleted_count
+            for doc_id in doc_ids:
+                self.invalidate(doc_id)
+            self.flushEvents([Base.emit(self.collectionName, "delete", doc["_id"], doc) for doc in allowed])
+        return summary
+
+    def deletable(self, docs) -> Tuple[List, dict]:
+        # Splits a batch into the documents that may go and {_id: reason} for the ones orphanCleanup would refuse
+        return docs, {}
+
+    def orphanCleanupMany(self, docs):
+        pass
+
+    @staticmethod
+    def promptDeleteMany():
+        names = ["departments", "students", "courses", "sections"]
+        for idx, name in enumerate(names, start=1):
+            print(f"{idx}. {name}")
+        choice = input("--> ")
+        while choice not in [str(i) for i in range(1, len(names) + 1)]:
+            print(f"Invalid input. Enter from 1 to {len(names)}.")
+            choice = input("--> ")
+        target = CollectionManager.GetCollection(names[int(choice) - 1])
+
+        try:
+            doc_filter = json_util.loads(input('Filter as extended JSON, e.g. {"section_year": 2019} --> '))
+        except ValueError as e:
+            print(f"\nInvalid filter: {str(e)}")
+            return
+
+        summary = target.delete_many(doc_filter, dryRun=True)
+        print(f"{summary['matched']} matched, {summary['deleted']} would be deleted.")
+        for reason, count in summary["refused"].items():
+            print(f"  {count} refused: {reason}")
+        if summary["deleted"] == 0 or input("Delete them? [y/n] --> ").lower() != 'y':
+            return
+
+        summary = target.delete_many(doc_filter)
+        print(f"Deleted {summary['deleted']} document(s).")
+
+    def listPipeline(self, pageToken: str = None, limit: int = None) -> List:
+        # Keyset pagination on _id: a page token is the last _id of the previous page, so every page is an
+        # index range scan no matter how deep into the collection it is
         pipeline = []
+        if pageToken is not None:
+            pipeline.append({'$match': {'_id': {'$gt': ObjectId(pageToken)}}})
+        pipeline.append({'$sort': {'_id': pymongo.ASCENDING}})
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+
         for attr, attr_type in self.attributes:
             if isinstance(attr_type, AttrType) and attr_type in [AttrType.FOREIGN_DEPT, AttrType.FOREIGN_COURSE]:
-                ref_collection = CollectionManager.GetCollection(attr_type.value).collection.name
+                ref_collection = attr_type.value
+                name_field = 'course_name' if attr_type == AttrType.FOREIGN_COURSE else 'name'
                 pipeline.append({
                     '$lookup': {
                         'from': ref_collection,
@@ -145,38 +403,70 @@ class Base(ABC):
                 })
                 pipeline.append({
                     '$addFields': {
-                        attr: f'${attr}_info.name'
+                        attr: f'${attr}_info.{name_field}'
                     }
                 })
 
         projection = {attr: 1 for attr, _ in self.attributes}
         pipeline.append({'$project': projection})
+        return pipeline
 
-        doc_list = list(self.collection.aggregate(pipeline))
-        for doc in doc_list:
-            pprint(doc)
-        return doc_list
+    def listAll(self, batchSize: int = 500, pageToken: str = None) -> Iterator:
+        # Streams the whole collection one keyset page at a time, so only batchSize documents are held at once
+        while True:
+            batch = list(self.collection.aggregate(self.listPipeline(pageToken, batchSize)))
+            yield from batch
+            if len(batch) < batchSize:
+                return
+            pageToken = str(batch[-1]['_id'])
+
+    def listPage(self, pageSize: int = 50, pageToken: str = None) -> Tuple[List, Optional[str]]:
+        docs = list(self.collection.aggregate(self.listPipeline(pageToken, pageSize)))
+        next_token = str(docs[-1]['_id']) if len(docs) == pageSize else None
+        return docs, next_token
+
+    def printAll(self, pageSize: int = 50):
+        page_token = None
+        while True:
+            docs, page_token = self.listPage(pageSize, page_token)
+            for doc in docs:
+                pprint(doc)
+            if page_token is None:
+                return
+
+            print("Show more? [y/n]")
+            user_inp = input("--> ")
+            while user_inp != 'y' and user_inp != 'n':
+                print("\nInvalid input. Enter 'y' for Yes or 'n' for No.")
+                user_inp = input("--> ")
+            if user_inp == 'n':
+                return
 
     def getAll(self) -> List:
         return self.collection.find({})
 
-    def selectDoc(self):
+    def selectDoc(self, resolveNames: bool = True):
         ways = len(self.uniqueCombinations)
         print("Choose a way to select:")
         for idx, combination in enumerate(self.uniqueCombinations, start=1):
             attribute_names = [self.attributes[i][0] for i in combination]
             formatted_attributes = ', '.join(attribute_names)
             print(f"{idx}. [{formatted_attributes}]")
+        searchable = self.collectionName in Base._searchIndexes
+        if searchable:
+            print(f"{ways + 1}. Search")
 
         while True:
             try:
                 user_input = int(input("--> ")) - 1
                 if 0 <= user_input <= (ways - 1):
                     break
+                elif searchable and user_input == ways:
+                    return self.promptSearch(resolveNames)
                 else:
                     print("Invalid input. Try Again")
             except ValueError:
-                print(f"Invalid input. Enter from 1 to {ways}.")
+                print(f"Invalid input. Enter from 1 to {ways + 1 if searchable else ways}.")
 
         combo = self.uniqueCombinations[user_input]
         doc_filter = {}
@@ -198,12 +488,20 @@ class Base(ABC):
                             return
 
                         print(f"\nSelect {attr[1].value}")
-                        doc_filter[attr[0]] = CollectionManager.GetCollection(attr[1].value).selectDoc()["_id"]
+                        foreign = CollectionManager.GetCollection(attr[1].value)
+                        doc_filter[attr[0]] = foreign.selectDoc(resolveNames=False)["_id"]
 
-            if self.collection.count_documents(doc_filter) != 0:
+            doc = self.resolve(doc_filter) if resolveNames else self.collection.find_one(doc_filter)
+            if doc is not None:
                 break
             else:
                 print("Couldn't find a document with attributes: " + str(doc_filter) + "!")
+                if searchable:
+                    # Near misses (a typo, a nickname's prefix) are offered instead of another blind retry
+                    doc = self.searchDoc(" ".join(str(value) for value in doc_filter.values()
+                                                  if isinstance(value, (str, int))), resolveNames)
+                    if doc is not None:
+                        break
 
                 print("Try Again? [y/n]")
                 user_inp = input("--> ")
@@ -214,32 +512,104 @@ class Base(ABC):
 
                 if user_inp == 'n':
                     return None
-        doc = self.collection.find_one(doc_filter)
-        if not doc:
-            print("No document found with the specified attributes. Try again?")
-            user_input = input("--> ")
-            if user_input.lower() != 'y':
-                return None
 
-        if 'course' in doc:
-            course = self.collection.database['courses'].find_one({'_id': doc['course']})
-            doc['course'] = course['course_name'] if course else "Unknown Course"
+        return doc
+
+    def resolve(self, doc_filter):
+        cached = self.cachedReferences()
+        pipeline = [{'$match': doc_filter}, {'$limit': 1}] + self.resolvePipeline(skip=cached)
+        docs = list(self.collection.aggregate(pipeline))
+        if not docs:
+            return None
 
-        if 'students' in doc and isinstance(doc['students'], list):
-            students = self.collection.database['students'].find({'_id': {'$in': doc['students']}})
-            doc['students'] = [f"{student['last_name']}, {student['first_name']}" for student in students]
+        doc = docs[0]
+        for field, from_collection, name_fields, missing in NAME_REFERENCES:
+            if from_collection not in cached or field not in doc:
+                continue
 
-        if 'courses' in doc:
-            course_ids = doc['courses'] if isinstance(doc['courses'], list) else [doc['courses']]
-            courses = self.collection.database['courses'].find({'_id': {'$in': course_ids}})
-            doc['courses'] = [course['course_name'] for course in courses] if courses else []
+            ref_ids = doc[field] if isinstance(doc[field], list) else [doc[field]]
+            refs = self.referencedCollection(from_collection).findByIds(ref_ids)
+            self.fillNames(doc, field, ref_ids, refs, name_fields, missing)
+        return doc
 
-        if 'department' in doc:
-            department = self.collection.database['departments'].find_one({'_id': doc['department']})
-            doc['department'] = department['name'] if department else "Unknown Department"
+    @staticmethod
+    def fillNames(doc, field, ref_ids, refs, name_fields, missing):
+        names = [', '.join(refs[ref_id][name] for name in name_fields) for ref_id in ref_ids if ref_id in refs]
+        doc[field] = names if missing is None else (names[0] if names else missing)
+
+    def referencedCollection(self, collection_name):
+        return CollectionManager.GetCollection(collection_name)
+
+    def cachedReferences(self) -> set:
+        properties = self.schema['$jsonSchema']['properties']
+        cached = set()
+        for field, from_collection, _, _ in NAME_REFERENCES:
+            if field in properties and self.referencedCollection(from_collection).cache is not None:
+                cached.add(from_collection)
+        return cached
+
+    def resolvePipeline(self, skip=()) -> List:
+        # Swaps the ids in course, department, students and courses for readable names inside the same
+        # aggregation, so selecting a document is one round trip however many references it has
+        properties = self.schema['$jsonSchema']['properties']
+        stages = []
+        hidden = {}
+        for field, from_collection, name_fields, missing in NAME_REFERENCES:
+            if field not in properties or from_collection in skip:
+                continue
 
+            info = f'_{field}_info'
+            hidden[info] = 0
+            stages.append({'$lookup': {'from': from_collection, 'localField': field,
+                                       'foreignField': '_id', 'as': info}})
+            name_expr = f'$$ref.{name_fields[0]}'
+            if len(name_fields) > 1:
+                name_expr = {'$concat': [part for name in name_fields for part in (', ', f'$$ref.{name}')][1:]}
+            names = {'$map': {'input': f'${info}', 'as': 'ref', 'in': name_expr}}
+            if missing is not None:
+                names = {'$ifNull': [{'$arrayElemAt': [names, 0]}, missing]}
+            stages.append({'$set': {field: {'$cond': [{'$eq': [{'$type': f'${field}'}, 'missing']},
+                                                      '$$REMOVE', names]}}})
+        if hidden:
+            stages.append({'$project': hidden})
+        return stages
+
+    def enableCache(self, max_size: int = 10000, ttl: float = 300.0):
+        # Shared per collection so every instance of a collection sees the same invalidations
+        self.cache = Base._caches.setdefault(self.collectionName, IdentityCache(max_size, ttl))
+
+    def findById(self, doc_id):
+        if self.cache is None:
+            return self.collection.find_one({"_id": doc_id})
+
+        doc = self.cache.get(doc_id)
+        if doc is None:
+            doc = self.collection.find_one({"_id": doc_id})
+            if doc is not None:
+                self.cache.put(doc)
         return doc
 
+    def findByIds(self, doc_ids) -> dict:
+        found = {}
+        missing = []
+        for doc_id in doc_ids:
+            doc = self.cache.get(doc_id) if self.cache is not None else None
+            if doc is None:
+                missing.append(doc_id)
+            else:
+                found[doc_id] = doc
+
+        if missing:
+            for doc in self.collection.find({"_id": {"$in": missing}}):
+                if self.cache is not None:
+                    self.cache.put(doc)
+                found[doc["_id"]] = doc
+        return found
+
+    def invalidate(self, doc_id=None):
+        if self.cache is not None:
+            self.cache.invalidate(doc_id)
+
     def buildSelectionCriteria(self):
         print("Available search methods:")
         for i, combo in enumerate(self.uniqueCombinations, start=1):
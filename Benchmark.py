@@ -0,0 +1,213 @@
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from Connect import Connect
+from CollectionManager import CollectionManager
+from BulkImport import BulkImporter
+from Department import Department
+from Student import Student
+from Course import Course
+from Section import Section
+
+BUILDINGS = ['CDC', 'DC', 'ECS', 'EN2', 'EN3', 'EN4', 'EN5', 'ET', 'HSCI', 'NUR', 'VEC']
+SCHEDULES = ['MW', 'TuTh', 'MWF', 'F', 'S']
+START_TIMES = [800, 930, 1100, 1230, 1400, 1530, 1700, 1830]
+SEMESTERS = ['Fall', 'Spring']
+
+
+class DataGenerator:
+    def __init__(self, departments: int, courses: int, sections: int, students: int, enrollments: int, seed: int = 7):
+        self.departments = departments
+        self.courses = courses
+        self.sections = sections
+        self.students = students
+        self.enrollments = enrollments
+        self.rng = random.Random(seed)
+
+    def departmentRows(self):
+        for idx in range(self.departments):
+            yield idx + 1, {"name": f"Department of Subject {idx:04d}", "abbreviation": f"D{idx:04d}",
+                            "chair_name": f"Chair {idx}", "building": BUILDINGS[idx % len(BUILDINGS)],
+                            "office": 100 + idx, "description": f"Synthetic department {idx}"}
+
+    def courseRows(self):
+        for idx in range(self.courses):
+            dept = idx % self.departments
+            yield idx + 1, {"department": f"D{dept:04d}", "course_number": 100 + idx // self.departments,
+                            "course_name": f"Course {idx}", "description": f"Synthetic course {idx}",
+                            "units": 1 + idx % 5}
+
+    def sectionRows(self):
+        rooms = 999 * len(BUILDINGS)
+        for idx in range(self.sections):
+            course = idx % self.courses
+            # Every (building, room, schedule, start_time) slot is used once per term before any repeats,
+            # which keeps the section unique indexes satisfied at any scale the slots allow
+            slot = idx // len(SEMESTERS)
+            yield idx + 1, {"department": f"D{course % self.departments:04d}",
+                            "course_number": 100 + course // self.departments,
+                            "section_number": 1 + idx // self.courses, "semester": SEMESTERS[idx % len(SEMESTERS)],
+                            "section_year": 2024, "building": BUILDINGS[(slot // 999) % len(BUILDINGS)],
+                            "room": 1 + slot % 999, "schedule": SCHEDULES[(slot // rooms) % len(SCHEDULES)],
+                            "start_time": START_TIMES[(slot // (rooms * len(SCHEDULES))) % len(START_TIMES)],
+                            "instructor": f"Instructor {slot % rooms}", "capacity": 60}
+
+    def studentRows(self):
+        for idx in range(self.students):
+            yield idx + 1, {"last_name": f"Last{idx}", "first_name": f"First{idx}",
+                            "email": f"student{idx}@example.edu"}
+
+    def enrollmentPairs(self, student_ids, section_ids):
+        for student_id in student_ids:
+            for section_id in self.rng.sample(section_ids, min(self.enrollments, len(section_ids))):
+                yield student_id, section_id
+
+
+class Timer:
+    def __init__(self):
+        self.samples = []
+
+    def time(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"count": 0}
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+        return {"count": len(ordered), "total_s": sum(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": percentile(0.50), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99),
+                "max_ms": ordered[-1] * 1000}
+
+
+def load(db, generator: DataGenerator, batch_size: int) -> dict:
+    for name in ["departments", "students", "courses", "sections"]:
+        db[name].delete_many({})
+
+    importer = BulkImporter(batch_size)
+    timings = {}
+    for name, rows in [("departments", generator.departmentRows()), ("courses", generator.courseRows()),
+                       ("sections", generator.sectionRows()), ("students", generator.studentRows())]:
+        start = time.perf_counter()
+        report = importer.importRows(name, rows)
+        timings[name] = {"seconds": time.perf_counter() - start, "rows": report.rows, "inserted": report.inserted,
+                         "failures": len(report.failures)}
+
+    student_ids = [stu["_id"] for stu in db.students.find({}, {"_id": 1})]
+    section_ids = [sect["_id"] for sect in db.sections.find({}, {"_id": 1})]
+    students = CollectionManager.GetCollection("students")
+    timings["enrollments"] = {"seconds": 0.0, "rows": 0, "inserted": 0, "failures": 0}
+    start = time.perf_counter()
+    for batch in importer.batches(generator.enrollmentPairs(student_ids, section_ids)):
+        for result in students.enroll_many(batch, batch_size=batch_size):
+            timings["enrollments"]["rows"] += 1
+            timings["enrollments"]["inserted" if result["status"] == "enrolled" else "failures"] += 1
+    timings["enrollments"]["seconds"] = time.perf_counter() - start
+    return timings
+
+
+def measure(db, samples: int, rng: random.Random) -> dict:
+    students = CollectionManager.GetCollection("students")
+    sections = CollectionManager.GetCollection("sections")
+    student_ids = [stu["_id"] for stu in db.students.find({}, {"_id": 1})]
+    section_ids = [sect["_id"] for sect in db.sections.find({}, {"_id": 1})]
+    results = {}
+
+    timer = Timer()
+    streamed = timer.time(lambda: sum(1 for _ in sections.listAll()))
+    results["list_all_sections"] = dict(timer.summary(), documents=streamed)
+
+    timer = Timer()
+    for _ in range(samples):
+        timer.time(students.resolve, {"_id": rng.choice(student_ids)})
+    results["resolve_student"] = timer.summary()
+
+    timer = Timer()
+    for _ in range(samples):
+        timer.time(sections.resolve, {"_id": rng.choice(section_ids)})
+    results["resolve_section"] = timer.summary()
+
+    timer = Timer()
+    enrolled = []
+    for _ in range(samples):
+        pair = (rng.choice(student_ids), rng.choice(section_ids))
+        if timer.time(students.enroll_many, [pair])[0]["status"] == "enrolled":
+            enrolled.append(pair)
+    results["enroll"] = dict(timer.summary(), enrolled=len(enrolled))
+
+    timer = Timer()
+    for student_id, section_id in enrolled:
+        timer.time(students.unenroll, student_id, section_id)
+    results["unenroll"] = timer.summary()
+
+    timer = Timer()
+    for student_id in rng.sample(student_ids, min(samples, len(student_ids))):
+        doc = db.students.find_one({"_id": student_id})
+        timer.time(students.deleteDoc, doc)
+    results["delete_student_with_cleanup"] = timer.summary()
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, stats in current["operations"].items():
+        before = baseline.get("operations", {}).get(name, {})
+        for metric in ["mean_ms", "p95_ms"]:
+            if before.get(metric) and stats.get(metric) and stats[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric]:.2f} -> {stats[metric]:.2f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog and time the enrollment operations")
+    parser.add_argument("--departments", type=int, default=50)
+    parser.add_argument("--courses", type=int, default=5000)
+    parser.add_argument("--sections", type=int, default=50000)
+    parser.add_argument("--students", type=int, default=500000)
+    parser.add_argument("--enrollments", type=int, default=4, help="sections per student")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier applied to every count above")
+    parser.add_argument("--samples", type=int, default=200, help="operations timed per benchmark")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in the database")
+    parser.add_argument("--database", default="EnrollmentBench")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    settings = {"mode": "local"}
+    settings.update(Connect.loadSettings())
+    settings["database"] = args.database
+    db = Connect(settings).database()
+
+    CollectionManager.AddCollection("departments", Department(db))
+    CollectionManager.AddCollection("students", Student(db))
+    CollectionManager.AddCollection("courses", Course(db))
+    CollectionManager.AddCollection("sections", Section(db))
+
+    counts = {name: max(1, int(getattr(args, name) * args.scale))
+              for name in ["departments", "courses", "sections", "students"]}
+    run = {"started": datetime.now().isoformat(), "counts": dict(counts, enrollments_per_student=args.enrollments)}
+    if not args.skip_load:
+        run["load"] = load(db, DataGenerator(enrollments=args.enrollments, **counts), args.batch_size)
+    run["operations"] = measure(db, args.samples, random.Random(11))
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(run, file, indent=2)
+    print(json.dumps(run, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(run, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,280 @@
+import csv
+import json
+import os
+from datetime import datetime
+from typing import List, Tuple, Any, Dict, Iterable
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from Base import Base, AttrType
+from CollectionManager import CollectionManager
+
+
+class ImportReport:
+    def __init__(self, collection_name: str):
+        self.collectionName = collection_name
+        self.rows = 0
+        self.inserted = 0
+        self.failures: List[Tuple[int, str]] = []
+
+    def fail(self, row_number: int, reason: str):
+        self.failures.append((row_number, reason))
+
+    def __str__(self):
+        lines = [f"{self.collectionName}: {self.inserted}/{self.rows} row(s) imported, "
+                 f"{len(self.failures)} failure(s)"]
+        for row_number, reason in self.failures:
+            lines.append(f"  row {row_number}: {reason}")
+        return "\n".join(lines)
+
+
+class BulkImporter:
+    ENROLLMENT_KEYS = ["email", "department", "course_number", "section_number", "semester", "section_year", "type"]
+
+    def __init__(self, batch_size: int = 1000):
+        self.batchSize = batch_size
+
+    @staticmethod
+    def readRows(path: str) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, newline='', encoding="utf-8") as file:
+            if extension == ".csv":
+                # Row 1 is the header, so data rows start at 2 to match what a spreadsheet shows
+                for row_number, row in enumerate(csv.DictReader(file), start=2):
+                    yield row_number, row
+            elif extension in (".jsonl", ".ndjson"):
+                for row_number, line in enumerate(file, start=1):
+                    if line.strip():
+                        yield row_number, json.loads(line)
+            else:
+                raise ValueError(f"Unsupported import format '{extension}', use .csv or .jsonl")
+
+    def batches(self, rows: Iterable[Tuple[int, Dict[str, Any]]]):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def importFile(self, collection_name: str, path: str) -> ImportReport:
+        return self.importRows(collection_name, self.readRows(path))
+
+    def importRows(self, collection_name: str, rows: Iterable[Tuple[int, Dict[str, Any]]]) -> ImportReport:
+        if collection_name == "enrollments":
+            report = ImportReport(collection_name)
+            for batch in self.batches(rows):
+                report.rows += len(batch)
+                self.importEnrollmentBatch(batch, report)
+            return report
+
+        target = CollectionManager.GetCollection(collection_name)
+        report = ImportReport(target.collectionName)
+        for batch in self.batches(rows):
+            report.rows += len(batch)
+            self.importDocBatch(target, batch, report)
+        return report
+
+    @staticmethod
+    def coerce(attr_type: AttrType, value):
+        match attr_type:
+            case AttrType.STRING:
+                return str(value)
+            case AttrType.INTEGER:
+                return int(value)
+            case AttrType.TIME:
+                if isinstance(value, datetime):
+                    return value
+                hour, minutes = str(value).split(":")
+                return datetime(2024, 5, 7, int(hour), int(minutes), 0)
+        return value
+
+    def resolveForeignKeys(self, target, batch) -> Dict[Any, ObjectId]:
+        # One query per referenced collection for the whole batch
+        resolved = {}
+        attr_types = {attr_type for _, attr_type in target.attributes}
+
+        if AttrType.FOREIGN_DEPT in attr_types or AttrType.FOREIGN_COURSE in attr_types:
+            abbreviations = {str(row["department"]) for _, row in batch if row.get("department") is not None}
+            departments = CollectionManager.GetCollection("departments").collection.find(
+                {"abbreviation": {"$in": list(abbreviations)}}, {"abbreviation": 1})
+            for dept in departments:
+                resolved[("department", dept["abbreviation"])] = dept["_id"]
+
+        if AttrType.FOREIGN_COURSE in attr_types:
+            dept_ids = {resolved[("department", str(row.get("department")))] for _, row in batch
+                        if ("department", str(row.get("department"))) in resolved}
+            numbers = set()
+            for _, row in batch:
+                try:
+                    numbers.add(int(row["course_number"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            courses = CollectionManager.GetCollection("courses").collection.find(
+                {"department": {"$in": list(dept_ids)}, "course_number": {"$in": list(numbers)}},
+                {"department": 1, "course_number": 1})
+            for course in courses:
+                resolved[("course", course["department"], course["course_number"])] = course["_id"]
+
+        return resolved
+
+    def buildDoc(self, target, row, resolved) -> Dict[str, Any]:
+        new_doc = {"_id": ObjectId()}
+        for attr, attr_type in target.attributes:
+            if attr_type == AttrType.FOREIGN_ARRAY:
+                continue
+
+            if attr_type == AttrType.FOREIGN_DEPT:
+                dept_id = resolved.get(("department", str(row.get("department"))))
+                if dept_id is None:
+                    raise ValueError(f"unknown department '{row.get('department')}'")
+                new_doc[attr] = dept_id
+            elif attr_type == AttrType.FOREIGN_COURSE:
+                dept_id = resolved.get(("department", str(row.get("department"))))
+                course_id = resolved.get(("course", dept_id, int(row["course_number"])))
+                if course_id is None:
+                    raise ValueError(f"unknown course {row.get('department')} {row.get('course_number')}")
+                new_doc[attr] = course_id
+            elif row.get(attr) not in (None, ""):
+                new_doc[attr] = self.coerce(attr_type, row[attr])
+            elif attr in target.schema["$jsonSchema"]["required"]:
+                raise ValueError(f"missing {attr}")
+
+        for attr, value in target.uniqueAttrAdds():
+            new_doc[attr] = value
+        return new_doc
+
+    def importDocBatch(self, target, batch, report: ImportReport):
+        resolved = self.resolveForeignKeys(target, batch)
+
+        docs = []
+        row_numbers = []
+        for row_number, row in batch:
+            try:
+                docs.append(self.buildDoc(target, row, resolved))
+                row_numbers.append(row_number)
+            except (KeyError, TypeError, ValueError) as e:
+                report.fail(row_number, str(e))
+
+        if not docs:
+            return
+
+        failed = self.insertMany(target.collection, docs, row_numbers, report)
+        inserted = [doc for idx, doc in enumerate(docs) if idx not in failed]
+        report.inserted += len(inserted)
+
+        target.flushEvents([Base.emit(target.collectionName, "insert", doc["_id"], doc) for doc in inserted])
+        if target.collectionName == "courses":
+            self.appendCourses(inserted)
+
+    @staticmethod
+    def insertMany(collection, docs, row_numbers, report: ImportReport) -> set:
+        # Unordered so one bad row doesn't stop the rest of the batch
+        failed = set()
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                report.fail(row_numbers[error["index"]], error.get("errmsg", "write error"))
+        return failed
+
+    @staticmethod
+    def appendCourses(courses):
+        by_department = {}
+        for course in courses:
+            by_department.setdefault(course["department"], []).append(course["_id"])
+        if not by_department:
+            return
+
+        departments = CollectionManager.GetCollection("departments")
+        events = {dept_id: Base.emit("departments", "update", dept_id, pushed={"courses": course_ids})
+                  for dept_id, course_ids in by_department.items()}
+        departments.collection.bulk_write(
+            [UpdateOne({"_id": dept_id}, events[dept_id].apply({"$push": {"courses": {"$each": course_ids}}}))
+             for dept_id, course_ids in by_department.items()], ordered=False)
+        for dept_id in by_department:
+            departments.invalidate(dept_id)
+        departments.flushEvents(list(events.values()))
+
+    def importEnrollmentBatch(self, batch, report: ImportReport):
+        students = CollectionManager.GetCollection("students")
+        sections = CollectionManager.GetCollection("sections").collection
+
+        usable = []
+        for row_number, row in batch:
+            missing = [key for key in self.ENROLLMENT_KEYS if row.get(key) in (None, "")]
+            if missing:
+                report.fail(row_number, f"missing {', '.join(missing)}")
+            else:
+                usable.append((row_number, row))
+        if not usable:
+            return
+
+        # Sections are looked up through their course, so resolve departments and courses first
+        resolved = self.resolveForeignKeys(CollectionManager.GetCollection("sections"), usable)
+        course_ids = {course_id for key, course_id in resolved.items() if key[0] == "course"}
+        section_ids = {}
+        for sect in sections.find({"course": {"$in": list(course_ids)}},
+                                  {"course": 1, "section_number": 1, "semester": 1, "section_year": 1}):
+            section_ids[(sect["course"], sect["section_number"], sect["semester"], sect["section_year"])] = sect["_id"]
+
+        emails = {str(row["email"]) for _, row in usable}
+        student_ids = {stu["email"]: stu["_id"] for stu in students.collection.find(
+            {"email": {"$in": list(emails)}}, {"email": 1})}
+
+        pairs = []
+        row_numbers = []
+        for row_number, row in usable:
+            try:
+                student_id = student_ids.get(str(row["email"]))
+                if student_id is None:
+                    raise ValueError(f"unknown student '{row['email']}'")
+
+                dept_id = resolved.get(("department", str(row["department"])))
+                course_id = resolved.get(("course", dept_id, int(row["course_number"])))
+                section_id = section_ids.get((course_id, int(row["section_number"]), str(row["semester"]),
+                                              int(row["section_year"])))
+                if section_id is None:
+                    raise ValueError("unknown section")
+
+                pairs.append((student_id, section_id, self.buildEnrollment(row)))
+                row_numbers.append(row_number)
+            except (KeyError, TypeError, ValueError) as e:
+                report.fail(row_number, str(e))
+
+        for row_number, result in zip(row_numbers, students.enroll_many(pairs, batch_size=self.batchSize)):
+            if result["status"] == "enrolled":
+                report.inserted += 1
+            else:
+                report.fail(row_number, result["message"])
+
+    @staticmethod
+    def buildEnrollment(row) -> Dict[str, Any]:
+        match row["type"]:
+            case "PassFail":
+                return {"type": "PassFail",
+                        "application_date": datetime.strptime(str(row["application_date"]), "%Y-%m-%d")}
+            case "LetterGrade":
+                if row.get("min_satisfactory") not in ["A", "B", "C"]:
+                    raise ValueError("min_satisfactory must be A, B or C")
+                return {"type": "LetterGrade", "min_satisfactory": row["min_satisfactory"]}
+        raise ValueError(f"unknown enrollment type '{row['type']}'")
+
+    def promptImport(self):
+        targets = ["departments", "courses", "sections", "students", "enrollments"]
+        print("Import into which collection?")
+        for idx, name in enumerate(targets, start=1):
+            print(f"{idx}. {name}")
+        choice = input("--> ")
+        while choice not in [str(i) for i in range(1, len(targets) + 1)]:
+            print(f"Invalid input. Enter from 1 to {len(targets)}.")
+            choice = input("--> ")
+
+        path = input("Path to a .csv or .jsonl file --> ")
+        try:
+            print(self.importFile(targets[int(choice) - 1], path))
+        except (OSError, ValueError) as e:
+            print(f"\nImport failed: {str(e)}")
@@ -1,10 +1,47 @@
+import threading
+
+
 class CollectionManager:
     _collections = {}
+    # Collections that are registered but not built yet: name -> factory, and the collections each one needs
+    _factories = {}
+    _dependencies = {}
+    _lock = threading.RLock()
 
     @staticmethod
     def AddCollection(collection_name, collection):
        CollectionManager._collections[collection_name] = collection
 
+    @staticmethod
+    def RegisterCollection(collection_name, factory, depends_on=()):
+        # factory() is only called on the first GetCollection, so a run pays for the schema setup of the
+        # collections it uses and nothing else; whatever it depends on is built first
+        CollectionManager._factories[collection_name] = factory
+        CollectionManager._dependencies[collection_name] = list(depends_on)
+
     @staticmethod
     def GetCollection(collection_name):
-        return CollectionManager._collections[collection_name]
+        collection = CollectionManager._collections.get(collection_name)
+        if collection is None:
+            with CollectionManager._lock:
+                collection = CollectionManager._build(collection_name, [])
+        return collection
+
+    @staticmethod
+    def IsBuilt(collection_name) -> bool:
+        return collection_name in CollectionManager._collections
+
+    @staticmethod
+    def _build(collection_name, building):
+        if collection_name in CollectionManager._collections:
+            return CollectionManager._collections[collection_name]
+        if collection_name in building:
+            raise ValueError(f"Collections depend on each other: {' -> '.join(building + [collection_name])}")
+        if collection_name not in CollectionManager._factories:
+            raise KeyError(collection_name)
+
+        for dependency in CollectionManager._dependencies[collection_name]:
+            CollectionManager._build(dependency, building + [collection_name])
+        collection = CollectionManager._factories[collection_name]()
+        CollectionManager._collections[collection_name] = collection
+        return collection
@@ -0,0 +1,259 @@
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from pprint import pprint
+from typing import Callable, Optional, Iterable, Iterator
+from bson import json_util
+from Base import Base
+from CollectionManager import CollectionManager
+from BulkImport import BulkImporter
+from IndexAdvisor import advise, printAdvice
+import Export
+import Instrumentation
+import IntegrityChecker
+import Reporting
+import Search
+import Timetable
+import WriteBehind
+
+COLLECTIONS = ["departments", "students", "courses", "sections"]
+
+
+class Command:
+    # run takes keyword arguments and never prompts, so it works from a batch file; prompt is the interactive
+    # front end the menus call. A command can have either or both.
+    def __init__(self, name: str, run: Optional[Callable] = None, prompt: Optional[Callable] = None):
+        self.name = name
+        self.run = run
+        self.prompt = prompt
+
+
+COMMANDS = {}
+
+
+def register(name: str, run: Optional[Callable] = None, prompt: Optional[Callable] = None):
+    COMMANDS[name] = Command(name, run, prompt)
+
+
+def collection(name: str):
+    return CollectionManager.GetCollection(name)
+
+
+def findOne(collection_name: str, doc_filter: dict) -> dict:
+    doc = collection(collection_name).collection.find_one(doc_filter)
+    if doc is None:
+        raise LookupError(f"no {collection_name} document matches {json_util.dumps(doc_filter)}")
+    return doc
+
+
+def importRows(collection_name: str, rows) -> dict:
+    report = BulkImporter().importRows(collection_name, enumerate(rows, start=1))
+    if report.failures and not report.inserted:
+        raise ValueError("; ".join(reason for _, reason in report.failures))
+    return vars(report)
+
+
+def listPage(collection_name: str, limit: int = 50, pageToken: str = None) -> dict:
+    docs, next_token = collection(collection_name).listPage(limit, pageToken)
+    return {"docs": docs, "nextPageToken": next_token}
+
+
+def addMajor(department: dict, name: str, description: str) -> bool:
+    departments = collection("departments")
+    if departments.collection.find_one({"majors.name": name}, {"_id": 1}) is not None:
+        raise ValueError(f"major '{name}' already exists")
+    return departments.createMajor(findOne("departments", department)["_id"], name, description)
+
+
+def addStudentMajor(student: dict, major: str, declaration_date) -> bool:
+    if collection("departments").collection.find_one({"majors.name": major}, {"_id": 1}) is None:
+        raise LookupError(f"no major named '{major}'")
+    # The validator wants a date; batch files give YYYY-MM-DD the way BulkImporter reads dates (or {"$date": ...})
+    if not isinstance(declaration_date, datetime):
+        declaration_date = datetime.strptime(str(declaration_date), "%Y-%m-%d")
+    if not collection("students").update_student_major(findOne("students", student)["_id"], major,
+                                                       declaration_date):
+        raise ValueError(f"could not add major '{major}' to the student")
+    return True
+
+
+def unenroll(student: dict, section: dict) -> bool:
+    return collection("students").unenroll(findOne("students", student)["_id"], findOne("sections", section)["_id"])
+
+
+def migrate() -> list:
+    for name in COLLECTIONS:
+        collection(name).migrate()
+    return COLLECTIONS
+
+
+def showReport(report: str, refresh: bool = True) -> list:
+    if report not in Reporting.REPORTS:
+        raise ValueError(f"unknown report '{report}'")
+    if refresh:
+        Reporting.refresh()
+    return list(Reporting.db()[report].find({}, {"refreshed": 0}))
+
+
+# Listed here rather than read from Analytics.METRICS, so numpy is only imported once a snapshot or analytics
+# command actually runs
+ANALYTICS = ["units", "fill", "instructors"]
+
+
+def buildSnapshot(path: str = "enrollment.snap") -> dict:
+    import Snapshot
+    return Snapshot.buildFile(path)
+
+
+def promptSnapshot():
+    import Snapshot
+    Snapshot.promptBuild()
+
+
+def runAnalytics(metric: str, **options):
+    import Analytics
+    return Analytics.run(metric, **options)
+
+
+def promptAnalytics(metric: str):
+    import Analytics
+    Analytics.promptAnalytics(metric)
+
+
+def registerCollection(name: str):
+    # add takes one import row, so references are given the way BulkImporter reads them (abbreviations, numbers)
+    register(f"{name}.add", lambda **row: importRows(name, [row]), lambda: collection(name).addDoc())
+    register(f"{name}.get", lambda filter: collection(name).resolve(filter),
+             lambda: pprint(collection(name).selectDoc()))
+    register(f"{name}.list", lambda **page: listPage(name, **page), lambda: collection(name).printAll())
+    register(f"{name}.delete", lambda filter, **options: collection(name).delete_many(filter, **options),
+             lambda: collection(name).deleteDoc())
+
+
+def registerSearch(name: str):
+    register(f"{name}.search", lambda query, limit=10: Search.search(name, query, limit),
+             lambda: Search.promptSearch(name))
+
+
+for collection_name in COLLECTIONS:
+    registerCollection(collection_name)
+
+for collection_name in Search.INDEXES:
+    registerSearch(collection_name)
+
+register("majors.add", addMajor, lambda: collection("departments").addMajor())
+register("majors.list", lambda: [{"department": dept["name"], "majors": dept["majors"]}
+                                 for dept in collection("departments").getAll()],
+         lambda: collection("departments").listMajors())
+register("majors.delete", lambda name: collection("departments").removeMajor(name),
+         lambda: collection("departments").deleteMajor())
+register("studentMajors.add", addStudentMajor, lambda: collection("students").addMajor())
+register("studentMajors.list", lambda student: findOne("students", student)["majors"],
+         lambda: collection("students").listStudentMajors())
+register("studentMajors.delete",
+         lambda student, major: collection("students").removeMajor(findOne("students", student)["_id"], major),
+         lambda: collection("students").deleteMajor())
+register("enrollments.add", lambda **row: importRows("enrollments", [row]),
+         lambda: collection("students").addEnrollment())
+register("enrollments.list", lambda student: findOne("students", student)["sections"],
+         lambda: collection("students").listEnrollments())
+register("enrollments.delete", unenroll, lambda: collection("students").deleteEnrollment())
+register("import", lambda collection, path: vars(BulkImporter().importFile(collection, path)),
+         lambda: BulkImporter().promptImport())
+register("deleteByFilter", None, Base.promptDeleteMany)
+register("export", lambda export, path, chunkSize=Export.CHUNK_SIZE: Export.exportFile(export, path, chunkSize),
+         Export.promptExport)
+register("timetable.conflicts", Timetable.conflictReport, Timetable.printConflictReport)
+register("reports.refresh", Reporting.refresh)
+register("reports.show", showReport, Reporting.promptReport)
+register("check", lambda repair=False: vars(IntegrityChecker.IntegrityChecker(repair=repair).run()),
+         IntegrityChecker.promptCheck)
+register("advise", advise, printAdvice)
+register("migrate", migrate)
+register("snapshot", buildSnapshot, promptSnapshot)
+for metric in ANALYTICS:
+    register(f"analytics.{metric}", lambda metric=metric, **options: runAnalytics(metric, **options),
+             lambda metric=metric: promptAnalytics(metric))
+register("flush", WriteBehind.flush, lambda: print(WriteBehind.flush() or "Write-behind is off."))
+register("stats", Instrumentation.snapshot, Instrumentation.printStats)
+register("stats.dump", Instrumentation.writeMetrics,
+         lambda: print(f"Metrics written to {Instrumentation.writeMetrics()}"))
+
+
+def prompt(name: str):
+    COMMANDS[name].prompt()
+
+
+def execute(line_number: int, operation: dict) -> dict:
+    started = time.perf_counter()
+    result = {"line": line_number, "id": operation.get("id"), "command": operation.get("command")}
+    try:
+        command = COMMANDS.get(operation.get("command"))
+        if command is None:
+            raise LookupError(f"unknown command '{operation.get('command')}'")
+        if command.run is None:
+            raise LookupError(f"'{command.name}' is interactive only")
+        if operation.get("sync"):
+            # Sees every earlier operation's writes and makes its own immediately
+            with WriteBehind.synchronous():
+                result["result"] = command.run(**operation.get("args", {}))
+        else:
+            result["result"] = command.run(**operation.get("args", {}))
+        result["ok"] = True
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def readOperations(lines: Iterable[str]) -> Iterator[tuple]:
+    # Extended JSON, so filters can name ObjectIds and dates as {"$oid": ...} and {"$date": ...}
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            yield line_number, json_util.loads(line)
+        except ValueError as e:
+            yield line_number, {"command": None, "parse_error": str(e)}
+
+
+def runBatch(lines: Iterable[str], workers: int = 1, out=None) -> bool:
+    # One JSON result per operation on out, in input order. Whatever commands print goes to stderr so the
+    # output stays machine-readable. With several workers at most a few operations per worker are in flight.
+    out = out or sys.stdout
+    started = time.perf_counter()
+    counts = {"ok": 0, "failed": 0}
+
+    def emit(result: dict):
+        counts["ok" if result["ok"] else "failed"] += 1
+        out.write(json_util.dumps(result) + "\n")
+        out.flush()
+
+    def execute_parsed(line_number: int, operation: dict) -> dict:
+        if "parse_error" in operation:
+            return {"line": line_number, "id": None, "command": None, "ok": False, "ms": 0,
+                    "error": f"ValueError: {operation['parse_error']}"}
+        return execute(line_number, operation)
+
+    with redirect_stdout(sys.stderr):
+        if workers <= 1:
+            for line_number, operation in readOperations(lines):
+                emit(execute_parsed(line_number, operation))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                in_flight = deque()
+                for line_number, operation in readOperations(lines):
+                    in_flight.append(pool.submit(execute_parsed, line_number, operation))
+                    if len(in_flight) >= workers * 4:
+                        emit(in_flight.popleft().result())
+                while in_flight:
+                    emit(in_flight.popleft().result())
+
+    elapsed = time.perf_counter() - started
+    print(f"{counts['ok'] + counts['failed']} operation(s) in {elapsed:.2f}s: {counts['ok']} ok, "
+          f"{counts['failed']} failed", file=sys.stderr)
+    return counts["failed"] == 0
@@ -1,22 +1,128 @@
+import configparser
+import os
+import threading
+from urllib.parse import quote_plus
 from pymongo import MongoClient
-import certifi
+import Instrumentation
+import MemoryBackend
+
+# Setting name -> MongoClient keyword for the pool and timeout options we expose
+CLIENT_OPTIONS = {
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "wait_queue_timeout_ms": "waitQueueTimeoutMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+}
 
 
 class Connect:
-    def __init__(self):
+    _clients = {}
+    _lock = threading.Lock()
+
+    def __init__(self, settings: dict = None):
+        self.settings = self.loadSettings() if settings is None else settings
         self.m_client = None
         self.m_cluster = self.generateConnectionString()
 
+    @staticmethod
+    def loadSettings() -> dict:
+        # Settings come from the [mongo] section of the file named by ENROLLMENT_CONFIG (default enrollment.ini),
+        # then ENROLLMENT_<NAME> environment variables, which win over the file
+        settings = {}
+        parser = configparser.ConfigParser()
+        if parser.read(os.environ.get("ENROLLMENT_CONFIG", "enrollment.ini")) and parser.has_section("mongo"):
+            settings.update(parser.items("mongo"))
+
+        for key, value in os.environ.items():
+            if key.startswith("ENROLLMENT_") and key != "ENROLLMENT_CONFIG":
+                settings[key[len("ENROLLMENT_"):].lower()] = value
+        return settings
+
     def generateConnectionString(self):
-        username = input("Username--> ")
-        password = input("Password--> ")
-        project = input("Project--> ")
-        hash_name = input("Hash name--> ")
+        if self.settings.get("uri"):
+            return self.settings["uri"]
+
+        if self.memory:
+            return "memory://"
+
+        if self.settings.get("mode", "atlas") == "local":
+            host = self.settings.get("host", "localhost")
+            port = self.settings.get("port", "27017")
+            return f"mongodb://{host}:{port}/"
+
+        # Anything not configured is still asked for, so the interactive workflow is unchanged
+        username = self.settings.get("username") or input("Username--> ")
+        password = self.settings.get("password") or input("Password--> ")
+        project = self.settings.get("project") or input("Project--> ")
+        hash_name = self.settings.get("hash_name") or input("Hash name--> ")
+
+        return (f"mongodb+srv://{quote_plus(username)}:{quote_plus(password)}@{project}.{hash_name}.mongodb.net/"
+                f"?retryWrites=true&w=majority")
+
+    def clientOptions(self) -> dict:
+        options = {}
+        for setting, option in CLIENT_OPTIONS.items():
+            if self.settings.get(setting):
+                options[option] = int(self.settings[setting])
+        if self.settings.get("compressors"):
+            options["compressors"] = self.settings["compressors"]
+        if self.m_cluster.startswith("mongodb+srv://") or self.settings.get("tls", "").lower() == "true":
+            # Imported here because only TLS connections need the CA bundle, and it is slow to load
+            import certifi
+            options["tlsCAFile"] = certifi.where()
+        return options
 
-        return f"mongodb+srv://{username}:{password}@{project}.{hash_name}.mongodb.net/?retryWrites=true&w=majority"
+    @property
+    def memory(self) -> bool:
+        # mode = memory keeps everything in this process (see MemoryBackend), for tests and local runs
+        return self.settings.get("mode", "atlas") == "memory"
+
+    @property
+    def instrumented(self) -> bool:
+        return self.settings.get("instrument", "true").lower() != "false"
+
+    @property
+    def writeBehind(self) -> bool:
+        return self.settings.get("write_behind", "false").lower() == "true"
+
+    def eventListeners(self) -> list:
+        return [Instrumentation.LISTENER] if self.instrumented else []
 
     def connectClient(self):
-        self.m_client = MongoClient(self.m_cluster, tlsCAFile=certifi.where())
+        # Clients are pooled and thread-safe, so everything pointed at the same cluster shares one
+        options = self.clientOptions()
+        key = (self.m_cluster, tuple(sorted(options.items())), self.instrumented)
+        with Connect._lock:
+            if key not in Connect._clients:
+                Connect._clients[key] = MongoClient(self.m_cluster, event_listeners=self.eventListeners(),
+                                                    **options)
+            self.m_client = Connect._clients[key]
+
+    def database(self):
+        if self.memory:
+            return MemoryBackend.database(self.settings.get("database", "Enrollment"))
+        if self.m_client is None:
+            self.connectClient()
+        return self.m_client[self.settings.get("database", "Enrollment")]
+
+    def asyncDatabase(self):
+        # Async clients belong to the event loop that created them, so they are not pooled with the others.
+        # Imported here because only the async service layer needs a pymongo new enough to have it
+        if self.memory:
+            raise ValueError("The async service layer needs a MongoDB server, it has no memory mode")
+        from pymongo import AsyncMongoClient
+        client = AsyncMongoClient(self.m_cluster, event_listeners=self.eventListeners(), **self.clientOptions())
+        return client[self.settings.get("database", "Enrollment")]
+
+    @staticmethod
+    def closeAll():
+        with Connect._lock:
+            for client in Connect._clients.values():
+                client.close()
+            Connect._clients.clear()
 
     @property
     def client(self):
@@ -1,4 +1,5 @@
 from typing import List, Tuple, Any
+from pymongo import UpdateOne
 from Base import Base, AttrType
 from CollectionManager import CollectionManager
 
@@ -49,25 +50,50 @@ class Course(Base):
                            ("course_name", AttrType.STRING), ("description", AttrType.STRING),
                            ("units", AttrType.INTEGER)]
         self.uniqueCombinations = [[0, 1], [0, 2]]
+        self.enableCache()
 
     def uniqueAttrAdds(self) -> List[Tuple[str, Any]]:
         return []
 
     def orphanCleanup(self, doc) -> bool:
-        success = CollectionManager.GetCollection("departments").f_removeCourse(doc["department"], doc["_id"])
-        if not success:
-            return False
-
+        # Sections are checked first so a refused delete doesn't leave the course unlisted in its department
         sections = CollectionManager.GetCollection("sections")
         sect_count = sections.collection.count_documents({"course": doc["_id"]})
         if sect_count > 0:
             print(f"\n{sect_count} sections are in this course! Delete those first!")
             return False
 
+        success = CollectionManager.GetCollection("departments").f_removeCourse(doc["department"], doc["_id"])
+        if not success:
+            return False
+
         return True
 
+    def deletable(self, docs) -> Tuple[List, dict]:
+        sections = CollectionManager.GetCollection("sections").collection
+        with_sections = set(sections.distinct("course", {"course": {"$in": [doc["_id"] for doc in docs]}}))
+        refused = {course_id: "the course still has sections" for course_id in with_sections}
+        return [doc for doc in docs if doc["_id"] not in refused], refused
+
+    def orphanCleanupMany(self, docs):
+        # One $pull per department, limited to the courses it actually lists so course_count stays exact
+        departments = CollectionManager.GetCollection("departments")
+        course_ids = {doc["_id"] for doc in docs}
+        events = []
+        operations = []
+        for dept in departments.collection.find({"courses": {"$in": list(course_ids)}}, {"courses": 1}):
+            listed = [course_id for course_id in dept["courses"] if course_id in course_ids]
+            event = Base.emit("departments", "update", dept["_id"], pulled={"courses": listed})
+            operations.append(UpdateOne({"_id": dept["_id"]}, event.apply({"$pull": {"courses": {"$in": listed}}})))
+            events.append(event)
+
+        if operations:
+            departments.collection.bulk_write(operations, ordered=False)
+            departments.invalidate()
+            departments.flushEvents(events)
+
     def onValidInsert(self, doc_id):
-        dept_id = self.collection.find_one({"_id": doc_id})["department"]
+        dept_id = self.findById(doc_id)["department"]
 
         success = CollectionManager.GetCollection("departments").f_appendCourse(dept_id, doc_id)
         if not success:
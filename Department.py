@@ -1,6 +1,8 @@
+import pymongo
 from bson import ObjectId
 from typing import List, Tuple, Any
 from Base import Base, AttrType
+from pymongo import UpdateOne
 from CollectionManager import CollectionManager
 
 
@@ -60,6 +62,11 @@ class Department(Base):
                                     "bsonType": "string",
                                     "maxLength": 200,
                                     "description": "Description of the major"
+                                },
+                                "student_count": {
+                                    "bsonType": "number",
+                                    "minimum": 0,
+                                    "description": "The number of students who declared the major"
                                 }
                             }
                         },
@@ -72,6 +79,11 @@ class Department(Base):
                         "items": {
                             "bsonType": "objectId"
                         }
+                    },
+                    "course_count": {
+                        "bsonType": "number",
+                        "minimum": 0,
+                        "description": "The number of courses in the department, kept in step with courses"
                     }
                 }
             }
@@ -81,12 +93,15 @@ class Department(Base):
                            ("building", AttrType.STRING), ("office", AttrType.INTEGER),
                            ("description", AttrType.STRING), ("majors", AttrType.FOREIGN_ARRAY)]
         self.uniqueCombinations = [[0], [1], [2], [3, 4]]
+        # Major lookups in addMajor/deleteMajor and reverse course lookups
+        self.indexes = [[("majors.name", pymongo.ASCENDING)], [("courses", pymongo.ASCENDING)]]
+        self.enableCache()
 
     def uniqueAttrAdds(self) -> List[Tuple[str, Any]]:
-        return [("majors", [])]
+        return [("majors", []), ("courses", []), ("course_count", 0)]
 
     def orphanCleanup(self, doc) -> bool:
-        courses_count = len(doc["courses"])
+        courses_count = doc.get("course_count", len(doc["courses"]))
         if courses_count > 0:
             print(f"{courses_count} course(s) belonging to this department must be deleted first.")
             return False
@@ -96,6 +111,15 @@ class Department(Base):
             return False
         return True
 
+    def deletable(self, docs) -> Tuple[List, dict]:
+        refused = {}
+        for doc in docs:
+            if doc.get("courses"):
+                refused[doc["_id"]] = "department still has courses"
+            elif doc.get("majors"):
+                refused[doc["_id"]] = "department still has majors"
+        return [doc for doc in docs if doc["_id"] not in refused], refused
+
     def onValidInsert(self, doc_id):
         print(f"Department added successfully")
 
@@ -114,14 +138,9 @@ class Department(Base):
                 continue
 
             new_major_description = input("Enter a description for the major --> ")
-            new_major = {'name': new_major_name, 'description': new_major_description}
 
             try:
-                result = self.collection.update_one(
-                    {"_id": department["_id"]},
-                    {'$push': {'majors': new_major}}
-                )
-                if result.modified_count > 0:
+                if self.createMajor(department["_id"], new_major_name, new_major_description):
                     print(f"{new_major_name} added to {department['name']}")
                 else:
                     print("Failed to add major. No changes were made.")
@@ -132,34 +151,106 @@ class Department(Base):
                     print("Operation cancelled.")
                     break
 
+    def createMajor(self, dept_id, name: str, description: str) -> bool:
+        new_major = {'name': name, 'description': description, 'student_count': 0}
+        event = Base.emit(self.collectionName, "update", dept_id, pushed={"majors": [name]})
+        result = self.collection.update_one({"_id": dept_id}, event.apply({'$push': {'majors': new_major}}))
+        self.invalidate(dept_id)
+        if result.modified_count > 0:
+            self.flushEvents([event])
+        return result.modified_count > 0
+
     def deleteMajor(self):
         major_name  = input("Name of the major to delete --> ")
-        result = self.collection.update_one({}, {"$pull": {"majors": {"name": major_name}}})
-        if result.modified_count > 0:
+        if self.removeMajor(major_name):
             print(f"{major_name} deleted.")
         else:
             print("No majors with that name found.")
 
+    def removeMajor(self, name: str) -> bool:
+        department = self.collection.find_one_and_update({"majors.name": name},
+                                                         {"$pull": {"majors": {"name": name}}},
+                                                         projection={"_id": 1})
+        if department is None:
+            return False
+        self.invalidate(department["_id"])
+        self.flushEvents([Base.emit(self.collectionName, "update", department["_id"], pulled={"majors": [name]})])
+        return True
+
     def listMajors(self):
         all_departments = self.getAll()
         for dept in all_departments:
             print(dept["name"])
             for major in dept["majors"]:
-                print(f"  Major: {major['name']}, Description: {major['description']}")
+                print(f"  Major: {major['name']}, Description: {major['description']}, "
+                      f"Students: {major.get('student_count', 0)}")
 
     def f_appendCourse(self, dept_id, course_id) -> bool:
+        event = Base.emit(self.collectionName, "update", dept_id, pushed={"courses": [course_id]})
+        update = event.apply({"$push": {"courses": course_id}})
+        if self.queueUpdate({"_id": dept_id}, update, event):
+            return True
         try:
-            result = self.collection.update_one({"_id": dept_id}, {"$push": {"courses": course_id}})
+            result = self.collection.update_one({"_id": dept_id}, update)
+            self.invalidate(dept_id)
+            if result.modified_count > 0:
+                self.flushEvents([event])
             return result.modified_count > 0
         except Exception as e:
             print(f"Failed to append course: {str(e)}")
             return False
 
     def f_removeCourse(self, dept_id, course_id) -> bool:
+        event = Base.emit(self.collectionName, "update", dept_id, pulled={"courses": [course_id]})
+        update = event.apply({"$pull": {"courses": course_id}})
+        if self.queueUpdate({"_id": dept_id}, update, event, recount={"course_count": "courses"}):
+            return True
         try:
-            result = self.collection.update_one({"_id": dept_id}, {"$pull": {"courses": course_id}})
+            result = self.collection.update_one({"_id": dept_id, "courses": course_id}, update)
+            self.invalidate(dept_id)
+            if result.modified_count > 0:
+                self.flushEvents([event])
             return result.modified_count > 0
         except Exception as e:
             print(f"Failed to delete course: {str(e)}")
             return False
 
+    def recountCounters(self):
+        self.collection.update_many({}, [{"$set": {
+            "course_count": {"$size": {"$ifNull": ["$courses", []]}},
+            "majors": {"$map": {"input": {"$ifNull": ["$majors", []]},
+                                "in": {"$mergeObjects": ["$$this", {"student_count": 0}]}}}}}])
+        students = CollectionManager.GetCollection("students").collection
+        counts = students.aggregate([{"$unwind": "$majors"},
+                                     {"$group": {"_id": "$majors.name", "count": {"$sum": 1}}}])
+        operations = [UpdateOne({"majors.name": major["_id"]}, {"$set": {"majors.$.student_count": major["count"]}})
+                      for major in counts]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self.invalidate()
+
+    @staticmethod
+    def countCourses(event):
+        change = len(event.details.get("pushed", {}).get("courses", [])) - \
+            len(event.details.get("pulled", {}).get("courses", []))
+        if change:
+            event.inc("course_count", change)
+
+    @staticmethod
+    def countMajorStudents(event):
+        # Students per major live on the department's major entry, found through the majors.name index
+        if event.name == "insert":
+            changes = [(major["name"], 1) for major in event.doc.get("majors", [])]
+        elif event.name == "delete":
+            changes = [(major["name"], -1) for major in event.doc.get("majors", [])]
+        else:
+            changes = [(name, 1) for name in event.details.get("pushed", {}).get("majors", [])] + \
+                      [(name, -1) for name in event.details.get("pulled", {}).get("majors", [])]
+        for name, change in changes:
+            event.write("departments", UpdateOne({"majors.name": name}, {"$inc": {"majors.$.student_count": change}}))
+
+
+Base.subscribe("departments", "update", Department.countCourses)
+Base.subscribe("students", "insert", Department.countMajorStudents)
+Base.subscribe("students", "update", Department.countMajorStudents)
+Base.subscribe("students", "delete", Department.countMajorStudents)
@@ -0,0 +1,179 @@
+import csv
+import json
+import os
+from datetime import datetime
+from itertools import islice
+from typing import List, Tuple, Iterator
+from CollectionManager import CollectionManager
+
+# Rows are flattened on the server and pulled a chunk at a time, so an export holds one chunk whatever its size
+CHUNK_SIZE = 5000
+
+# Column name -> type for each export, in output order; Parquet files get these as their schema
+COLUMNS = {
+    "enrollments": [("student_id", "string"), ("email", "string"), ("last_name", "string"),
+                    ("first_name", "string"), ("department", "string"), ("course_number", "int"),
+                    ("course_name", "string"), ("section_id", "string"), ("section_number", "int"),
+                    ("semester", "string"), ("section_year", "int"), ("enrollment_type", "string"),
+                    ("min_satisfactory", "string"), ("application_date", "date")],
+    "majors": [("student_id", "string"), ("email", "string"), ("last_name", "string"), ("first_name", "string"),
+               ("major", "string"), ("department", "string"), ("declaration_date", "date")],
+}
+
+
+def enrollmentPipeline() -> List[dict]:
+    # One row per enrollment; the lookups only bring back the fields a row needs, never a section's roster
+    return [
+        {"$project": {"email": 1, "last_name": 1, "first_name": 1, "sections": 1}},
+        {"$unwind": "$sections"},
+        {"$lookup": {"from": "sections", "localField": "sections.section_id", "foreignField": "_id",
+                     "as": "_section", "pipeline": [{"$project": {"course": 1, "section_number": 1,
+                                                                  "semester": 1, "section_year": 1}}]}},
+        {"$unwind": {"path": "$_section", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {"from": "courses", "localField": "_section.course", "foreignField": "_id", "as": "_course",
+                     "pipeline": [{"$project": {"department": 1, "course_number": 1, "course_name": 1}}]}},
+        {"$unwind": {"path": "$_course", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {"from": "departments", "localField": "_course.department", "foreignField": "_id",
+                     "as": "_department", "pipeline": [{"$project": {"abbreviation": 1}}]}},
+        {"$unwind": {"path": "$_department", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"_id": 0, "student_id": {"$toString": "$_id"}, "email": 1, "last_name": 1, "first_name": 1,
+                      "department": "$_department.abbreviation", "course_number": "$_course.course_number",
+                      "course_name": "$_course.course_name",
+                      "section_id": {"$toString": "$sections.section_id"},
+                      "section_number": "$_section.section_number", "semester": "$_section.semester",
+                      "section_year": "$_section.section_year",
+                      "enrollment_type": "$sections.enrollment.type",
+                      "min_satisfactory": "$sections.enrollment.min_satisfactory",
+                      "application_date": "$sections.enrollment.application_date"}},
+    ]
+
+
+def majorPipeline() -> List[dict]:
+    return [
+        {"$project": {"email": 1, "last_name": 1, "first_name": 1, "majors": 1}},
+        {"$unwind": "$majors"},
+        {"$lookup": {"from": "departments", "localField": "majors.name", "foreignField": "majors.name",
+                     "as": "_department", "pipeline": [{"$project": {"abbreviation": 1}}]}},
+        {"$unwind": {"path": "$_department", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"_id": 0, "student_id": {"$toString": "$_id"}, "email": 1, "last_name": 1, "first_name": 1,
+                      "major": "$majors.name", "department": "$_department.abbreviation",
+                      "declaration_date": "$majors.declaration_date"}},
+    ]
+
+
+PIPELINES = {"enrollments": enrollmentPipeline, "majors": majorPipeline}
+
+
+def rows(export: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    if export not in PIPELINES:
+        raise ValueError(f"Unknown export '{export}', use one of {', '.join(PIPELINES)}")
+    students = CollectionManager.GetCollection("students").collection
+    return students.aggregate(PIPELINES[export](), allowDiskUse=True, batchSize=chunk_size)
+
+
+def chunks(source: Iterator[dict], chunk_size: int) -> Iterator[List[dict]]:
+    source = iter(source)
+    while True:
+        chunk = list(islice(source, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def plain(value):
+    # CSV and JSON have no date type, so dates are written as ISO 8601
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class CsvWriter:
+    def __init__(self, path: str, columns: List[Tuple[str, str]]):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=[name for name, _ in columns], extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, chunk: List[dict]):
+        self.writer.writerows({key: plain(value) for key, value in row.items()} for row in chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path: str, columns: List[Tuple[str, str]]):
+        self.file = open(path, "w", encoding="utf-8")
+        self.columns = [name for name, _ in columns]
+
+    def write(self, chunk: List[dict]):
+        # Every line has every column, missing ones as null, so readers don't have to guess
+        self.file.writelines(json.dumps({name: plain(row.get(name)) for name in self.columns}) + "\n"
+                             for row in chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    # Each chunk becomes one row group; pyarrow is only needed when a Parquet file is asked for
+    def __init__(self, path: str, columns: List[Tuple[str, str]]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+        types = {"string": pyarrow.string(), "int": pyarrow.int64(), "date": pyarrow.timestamp("ms")}
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, chunk: List[dict]):
+        # Numbers come back from the server as int or float depending on how they were written
+        data = {name: [int(row[name]) if kind == "int" and row.get(name) is not None else row.get(name)
+                       for row in chunk] for name, kind in self.columns}
+        self.writer.write_table(self.pyarrow.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {".csv": CsvWriter, ".jsonl": JsonlWriter, ".ndjson": JsonlWriter, ".parquet": ParquetWriter}
+
+
+def exportFile(export: str, path: str, chunk_size: int = CHUNK_SIZE) -> int:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"Unsupported export format '{extension}', use .csv, .jsonl or .parquet")
+
+    source = rows(export, chunk_size)
+    # Written under a temporary name and renamed when complete, so a failed export never looks finished
+    writer = WRITERS[extension](path + ".tmp", COLUMNS[export])
+    count = 0
+    try:
+        for chunk in chunks(source, chunk_size):
+            writer.write(chunk)
+            count += len(chunk)
+    except BaseException:
+        writer.close()
+        os.remove(path + ".tmp")
+        raise
+    writer.close()
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def promptExport():
+    names = list(PIPELINES)
+    for idx, name in enumerate(names, start=1):
+        print(f"{idx}. {name}")
+    choice = input("--> ")
+    while choice not in [str(i) for i in range(1, len(names) + 1)]:
+        print(f"Invalid input. Enter from 1 to {len(names)}.")
+        choice = input("--> ")
+
+    path = input("Path to a .csv, .jsonl or .parquet file --> ")
+    try:
+        print(f"Exported {exportFile(names[int(choice) - 1], path)} row(s) to {path}.")
+    except (ValueError, OSError) as e:
+        print(f"Export failed: {e}")
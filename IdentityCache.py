@@ -0,0 +1,46 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.maxSize = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id):
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[doc_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(doc_id)
+            self.hits += 1
+        # Callers are free to edit what they get back (selectDoc swaps ids for names), so hand out copies
+        return copy.deepcopy(entry[1])
+
+    def put(self, doc):
+        with self._lock:
+            self._entries[doc["_id"]] = (time.monotonic() + self.ttl, copy.deepcopy(doc))
+            self._entries.move_to_end(doc["_id"])
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, doc_id=None):
+        with self._lock:
+            if doc_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(doc_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.maxSize, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,86 @@
+from typing import List
+from CollectionManager import CollectionManager
+
+# The filters the application actually sends, as (collection, where it comes from, fields to fill from a sample
+# document). Field values are taken from a real document so the planner sees realistic selectivity.
+QUERY_SHAPES = [
+    ("sections", "Course.orphanCleanup section count", ["course"]),
+    ("sections", "Section roster lookup by student", ["students"]),
+    ("sections", "term listing for timetables and reports", ["semester", "section_year"]),
+    ("departments", "Department.addMajor duplicate check", ["majors.name"]),
+    ("departments", "bulk import department resolution", ["abbreviation"]),
+    ("departments", "reverse course lookup", ["courses"]),
+    ("courses", "bulk import course resolution", ["department", "course_number"]),
+    ("students", "Student.unenroll / integrity by section", ["sections.section_id"]),
+    ("students", "selectDoc by email", ["email"]),
+    ("students", "selectDoc by name", ["last_name", "first_name"]),
+    ("students", "students per major", ["majors.name"]),
+]
+
+
+def sampleValue(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value
+
+
+def planStages(plan) -> List[str]:
+    # Both the classic and the slot-based explain formats nest their stages, so collect every "stage" key
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(planStages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(planStages(value))
+    return stages
+
+
+def advise() -> List[dict]:
+    findings = []
+    for collection_name, source, fields in QUERY_SHAPES:
+        collection = CollectionManager.GetCollection(collection_name).collection
+        sample = collection.find_one({}) or {}
+        doc_filter = {field: sampleValue(sample, field) for field in fields}
+
+        explain = collection.find(doc_filter).explain()
+        stages = planStages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        stats = explain.get("executionStats", {})
+        returned = stats.get("nReturned", 0)
+        examined = stats.get("totalDocsExamined", 0)
+        findings.append({
+            "collection": collection_name,
+            "source": source,
+            "filter": list(fields),
+            "collscan": "COLLSCAN" in stages,
+            "stages": stages,
+            "docs_examined": examined,
+            "returned": returned,
+            "examined_ratio": examined / max(returned, 1),
+        })
+    return findings
+
+
+def printAdvice():
+    findings = advise()
+    for finding in findings:
+        flag = "COLLSCAN" if finding["collscan"] else "ok"
+        print(f"[{flag:8}] {finding['collection']}.{'+'.join(finding['filter'])} ({finding['source']}): "
+              f"examined {finding['docs_examined']} for {finding['returned']} returned "
+              f"(ratio {finding['examined_ratio']:.1f})")
+
+    scans = [finding for finding in findings if finding["collscan"]]
+    if scans:
+        print(f"\n{len(scans)} query shape(s) fall back to a collection scan; declare an index for them in the "
+              f"collection's indexes list and run 'python main.py migrate'.")
+    else:
+        print("\nEvery query shape is served by an index.")
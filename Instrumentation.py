@@ -0,0 +1,237 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pymongo import monitoring
+
+# Upper bounds in seconds, Prometheus style; the last bucket catches everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# The outermost instrumented operation running in this thread or task; database commands are charged to it
+_operation = ContextVar("operation", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation, which is as precise as fixed buckets get
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+
+class OperationStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.commands = {}
+        self.documents = 0
+
+
+class Metrics:
+    def __init__(self):
+        self.operations = {}
+        self.commands = {}
+        self.commandFailures = {}
+        self._lock = threading.Lock()
+
+    def operation(self, name: str) -> OperationStats:
+        if name not in self.operations:
+            self.operations[name] = OperationStats()
+        return self.operations[name]
+
+    def recordOperation(self, name: str, seconds: float, failed: bool):
+        with self._lock:
+            stats = self.operation(name)
+            stats.latency.observe(seconds)
+            if failed:
+                stats.errors += 1
+
+    def recordCommand(self, command_name: str, seconds: float, documents: int, failed: bool):
+        operation = _operation.get() or "(none)"
+        with self._lock:
+            stats = self.operation(operation)
+            stats.commands[command_name] = stats.commands.get(command_name, 0) + 1
+            stats.documents += documents
+            self.commands.setdefault(command_name, Histogram()).observe(seconds)
+            if failed:
+                self.commandFailures[command_name] = self.commandFailures.get(command_name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.commands.clear()
+            self.commandFailures.clear()
+
+
+METRICS = Metrics()
+
+
+class CommandCounter(monitoring.CommandListener):
+    # Called on the thread (or task) that sent the command, so the context variable still names its operation
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+        batch = cursor.get("firstBatch", cursor.get("nextBatch", ())) if cursor else ()
+        METRICS.recordCommand(event.command_name, event.duration_micros / 1e6, len(batch), False)
+
+    def failed(self, event):
+        METRICS.recordCommand(event.command_name, event.duration_micros / 1e6, 0, True)
+
+
+LISTENER = CommandCounter()
+
+
+def timed(name: str, method):
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            # Generators run in the caller's context, so the operation is set around each step instead of once
+            operation = f"{self.collectionName}.{name}"
+            outermost = _operation.get() is None
+            elapsed = 0.0
+            failed = False
+            iterator = method(self, *args, **kwargs)
+            try:
+                while True:
+                    token = _operation.set(operation) if outermost else None
+                    started = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    except Exception:
+                        failed = True
+                        raise
+                    finally:
+                        elapsed += time.perf_counter() - started
+                        if token is not None:
+                            _operation.reset(token)
+                    yield item
+            finally:
+                if outermost:
+                    METRICS.recordOperation(operation, elapsed, failed)
+        generator_wrapper.instrumented = True
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _operation.get() is not None:
+            # Nested calls (resolve inside selectDoc, findByIds inside resolve) are part of the outer operation
+            return method(self, *args, **kwargs)
+
+        operation = f"{self.collectionName}.{name}"
+        token = _operation.set(operation)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            METRICS.recordOperation(operation, time.perf_counter() - started, failed)
+            _operation.reset(token)
+    wrapper.instrumented = True
+    return wrapper
+
+
+# The operations a user or batch command starts, each timed as one row. Helpers they call (initCollection,
+# flushEvents, findByIds, listPipeline, the enrollment steps) are charged to whichever of these is running.
+OPERATIONS = ["addDoc", "selectDoc", "resolve", "searchDoc", "listAll", "listPage", "printAll", "getAll",
+              "deleteDoc", "delete_many", "migrate", "addEnrollment", "enroll_many", "unenroll", "deleteEnrollment",
+              "listEnrollments", "addMajor", "createMajor", "update_student_major", "deleteMajor", "removeMajor",
+              "listMajors", "listStudentMajors"]
+
+
+def instrument(*classes):
+    # Inherited operations are wrapped on each class, so the label names the collection the call ran against
+    for cls in classes:
+        for name in OPERATIONS:
+            member = getattr(cls, name, None)
+            if member is None or getattr(member, "instrumented", False):
+                continue
+            setattr(cls, name, timed(name, member))
+
+
+def snapshot() -> dict:
+    with METRICS._lock:
+        return {name: {"calls": stats.latency.count, "errors": stats.errors, "seconds": stats.latency.sum,
+                       "p50": stats.latency.quantile(0.5), "p99": stats.latency.quantile(0.99),
+                       "commands": dict(stats.commands), "documents": stats.documents}
+                for name, stats in sorted(METRICS.operations.items())}
+
+
+def printStats():
+    stats = snapshot()
+    if not stats:
+        print("No operations recorded yet.")
+        return
+
+    print(f"{'operation':40} {'calls':>7} {'errors':>6} {'mean ms':>9} {'p99 ms':>8} {'round trips':>11} {'docs':>8}")
+    for name, op in stats.items():
+        calls = max(op["calls"], 1)
+        print(f"{name:40} {op['calls']:7} {op['errors']:6} {op['seconds'] / calls * 1000:9.2f} "
+              f"{op['p99'] * 1000:8.1f} {sum(op['commands'].values()) / calls:11.1f} {op['documents']:8}")
+
+
+def prometheusText() -> str:
+    lines = []
+
+    def histogram(metric: str, labels: str, hist: Histogram):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{labels}}} {hist.sum}")
+        lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+
+    with METRICS._lock:
+        lines.append("# TYPE enrollment_operation_seconds histogram")
+        for name, stats in sorted(METRICS.operations.items()):
+            histogram("enrollment_operation_seconds", f'operation="{name}"', stats.latency)
+        lines.append("# TYPE enrollment_operation_errors_total counter")
+        for name, stats in sorted(METRICS.operations.items()):
+            lines.append(f'enrollment_operation_errors_total{{operation="{name}"}} {stats.errors}')
+        lines.append("# TYPE enrollment_operation_commands_total counter")
+        for name, stats in sorted(METRICS.operations.items()):
+            for command_name, count in sorted(stats.commands.items()):
+                lines.append(f'enrollment_operation_commands_total{{operation="{name}",command="{command_name}"}} '
+                             f'{count}')
+        lines.append("# TYPE enrollment_operation_documents_total counter")
+        for name, stats in sorted(METRICS.operations.items()):
+            lines.append(f'enrollment_operation_documents_total{{operation="{name}"}} {stats.documents}')
+        lines.append("# TYPE enrollment_command_seconds histogram")
+        for command_name, hist in sorted(METRICS.commands.items()):
+            histogram("enrollment_command_seconds", f'command="{command_name}"', hist)
+        lines.append("# TYPE enrollment_command_failures_total counter")
+        for command_name, count in sorted(METRICS.commandFailures.items()):
+            lines.append(f'enrollment_command_failures_total{{command="{command_name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def writeMetrics(path: str = "enrollment_metrics.prom") -> str:
+    # Written to a temporary file and renamed, so a scraper never reads half a dump
+    with open(path + ".tmp", "w", encoding="utf-8") as out:
+        out.write(prometheusText())
+    os.replace(path + ".tmp", path)
+    return path
@@ -0,0 +1,262 @@
+from itertools import groupby
+from typing import List, Tuple, Any, Iterable, Iterator
+from pymongo import UpdateOne
+from Base import Base
+from CollectionManager import CollectionManager
+from Section import Section
+import WriteBehind
+
+# Mismatches of each kind kept for printing; the rest are only counted so memory stays flat however many there are
+SAMPLE_SIZE = 20
+
+
+class IntegrityReport:
+    def __init__(self):
+        self.checked = {}
+        self.mismatches = {}
+        self.samples = {}
+        self.repaired = {}
+
+    def count(self, link: str, amount: int = 1):
+        self.checked[link] = self.checked.get(link, 0) + amount
+
+    def mismatch(self, kind: str, detail: str):
+        self.mismatches[kind] = self.mismatches.get(kind, 0) + 1
+        samples = self.samples.setdefault(kind, [])
+        if len(samples) < SAMPLE_SIZE:
+            samples.append(detail)
+
+    def repair(self, kind: str, amount: int):
+        self.repaired[kind] = self.repaired.get(kind, 0) + amount
+
+    def __str__(self):
+        lines = [f"{link}: {count} checked" for link, count in self.checked.items()]
+        for kind, count in self.mismatches.items():
+            lines.append(f"{kind}: {count} mismatch(es), {self.repaired.get(kind, 0)} repaired")
+            for detail in self.samples[kind]:
+                lines.append(f"  {detail}")
+        if not self.mismatches:
+            lines.append("No mismatches found.")
+        return "\n".join(lines)
+
+
+def mergeJoin(left: Iterable[Tuple[Any, Any]], right: Iterable[Tuple[Any, Any]]) -> Iterator[Tuple[Any, Any, Any]]:
+    # Both inputs are (key, value) sorted by key with unique keys; yields (key, left value, right value) with None
+    # for the side the key is missing from, holding one item of each side at a time
+    left, right = iter(left), iter(right)
+    left_item, right_item = next(left, None), next(right, None)
+    while left_item is not None or right_item is not None:
+        if right_item is None or (left_item is not None and left_item[0] < right_item[0]):
+            yield left_item[0], left_item[1], None
+            left_item = next(left, None)
+        elif left_item is None or right_item[0] < left_item[0]:
+            yield right_item[0], None, right_item[1]
+            right_item = next(right, None)
+        else:
+            yield left_item[0], left_item[1], right_item[1]
+            left_item, right_item = next(left, None), next(right, None)
+
+
+def grouped(links: Iterable[dict], key: str, value: str) -> Iterator[Tuple[Any, List]]:
+    for group_key, group in groupby(links, key=lambda link: link.get(key)):
+        yield group_key, [link[value] for link in group]
+
+
+class IntegrityChecker:
+    # Each bidirectional link is streamed from both collections ordered by the owning id and merge-joined, so a
+    # check holds one group of links (a section's roster, a department's courses) at a time. The side holding the
+    # foreign key is authoritative: students.sections for enrollments, courses.department for course membership.
+    def __init__(self, batch_size: int = 1000, repair: bool = False):
+        self.batchSize = batch_size
+        self.repairs = repair
+        self.report = IntegrityReport()
+        self._pending = {}
+
+    def run(self) -> IntegrityReport:
+        # Queued back-references would otherwise show up as mismatches
+        WriteBehind.flush()
+        self.checkEnrollments()
+        self.checkCourses()
+        self.checkMajorCounts()
+        self.flush()
+        return self.report
+
+    def checkEnrollments(self):
+        students = CollectionManager.GetCollection("students").collection
+        sections = CollectionManager.GetCollection("sections").collection
+
+        # The student side needs a server sort; allowDiskUse lets it spill instead of failing on large cohorts
+        student_links = students.aggregate([
+            {"$project": {"sections.section_id": 1}},
+            {"$unwind": "$sections"},
+            {"$project": {"_id": 0, "section": "$sections.section_id", "student": "$_id"}},
+            {"$sort": {"section": 1, "student": 1}},
+        ], allowDiskUse=True, batchSize=self.batchSize)
+        section_docs = ((sect["_id"], sect) for sect in sections.find(
+            {}, {"students": 1, "enrolled_count": 1}, batch_size=self.batchSize).sort("_id", 1))
+
+        for sect_id, student_side, sect in mergeJoin(grouped(student_links, "section", "student"), section_docs):
+            student_side = set(student_side or [])
+            if sect is None:
+                self.report.count("enrollments", len(student_side))
+                for stu_id in student_side:
+                    self.report.mismatch("enrollment to a missing section", f"student {stu_id} -> section {sect_id}")
+                    self.queue("students", "enrollment to a missing section",
+                               UpdateOne({"_id": stu_id}, {"$pull": {"sections": {"section_id": sect_id}}}))
+                continue
+
+            roster = sect.get("students", [])
+            self.report.count("enrollments", len(student_side | set(roster)))
+            for stu_id in student_side.difference(roster):
+                self.report.mismatch("missing from section roster", f"student {stu_id} -> section {sect_id}")
+                # Claimed like any registration, so a repair never takes a section past its capacity
+                event = Base.emit("sections", "enroll", sect_id, student_id=stu_id)
+                self.queue("sections", "missing from section roster",
+                           UpdateOne(Section.seatFilter(sect_id, stu_id),
+                                     event.apply({"$push": {"students": stu_id}})), event)
+            for stu_id in set(roster).difference(student_side):
+                self.report.mismatch("roster entry without enrollment", f"section {sect_id} -> student {stu_id}")
+                event = Base.emit("sections", "unenroll", sect_id, student_id=stu_id)
+                self.queue("sections", "roster entry without enrollment",
+                           UpdateOne({"_id": sect_id, "students": stu_id},
+                                     event.apply({"$pull": {"students": stu_id}})), event, (stu_id, sect_id))
+
+            if sect.get("enrolled_count") != len(roster):
+                self.report.mismatch("section enrolled_count", f"section {sect_id}: {sect.get('enrolled_count')} "
+                                                               f"for {len(roster)} students")
+                # Recounted on the server at write time, so it is right whatever the roster fixes above do
+                self.queue("sections", "section enrolled_count", UpdateOne(
+                    {"_id": sect_id}, [{"$set": {"enrolled_count": {"$size": {"$ifNull": ["$students", []]}}}}]))
+
+    def checkCourses(self):
+        courses = CollectionManager.GetCollection("courses").collection
+        departments = CollectionManager.GetCollection("departments").collection
+
+        # department is optional in the course schema; courses without one have no membership to join, so they
+        # are reported for a person to assign instead
+        for course in courses.find({"department": None}, {"_id": 1}, batch_size=self.batchSize):
+            self.report.count("course memberships")
+            self.report.mismatch("course without a department", f"course {course['_id']}")
+
+        course_links = courses.aggregate([
+            {"$match": {"department": {"$ne": None}}},
+            {"$project": {"department": 1}},
+            {"$sort": {"department": 1, "_id": 1}},
+        ], allowDiskUse=True, batchSize=self.batchSize)
+        dept_docs = ((dept["_id"], dept) for dept in departments.find(
+            {}, {"courses": 1, "course_count": 1}, batch_size=self.batchSize).sort("_id", 1))
+
+        for dept_id, course_side, dept in mergeJoin(grouped(course_links, "department", "_id"), dept_docs):
+            course_side = set(course_side or [])
+            if dept is None:
+                # A course can't be moved to a department nobody named, so these are reported for a person to fix
+                self.report.count("course memberships", len(course_side))
+                for course_id in course_side:
+                    self.report.mismatch("course in a missing department", f"course {course_id} -> "
+                                                                           f"department {dept_id}")
+                continue
+
+            listed = dept.get("courses", [])
+            self.report.count("course memberships", len(course_side | set(listed)))
+            for course_id in course_side.difference(listed):
+                self.report.mismatch("missing from department courses", f"course {course_id} -> "
+                                                                        f"department {dept_id}")
+                event = Base.emit("departments", "update", dept_id, pushed={"courses": [course_id]})
+                self.queue("departments", "missing from department courses",
+                           UpdateOne({"_id": dept_id, "courses": {"$ne": course_id}},
+                                     event.apply({"$push": {"courses": course_id}})), event)
+            for course_id in set(listed).difference(course_side):
+                self.report.mismatch("department lists a course it doesn't own", f"department {dept_id} -> "
+                                                                                 f"course {course_id}")
+                event = Base.emit("departments", "update", dept_id, pulled={"courses": [course_id]})
+                self.queue("departments", "department lists a course it doesn't own",
+                           UpdateOne({"_id": dept_id, "courses": course_id},
+                                     event.apply({"$pull": {"courses": course_id}})), event)
+
+            if dept.get("course_count") != len(listed):
+                self.report.mismatch("department course_count", f"department {dept_id}: "
+                                                                f"{dept.get('course_count')} for {len(listed)} courses")
+                self.queue("departments", "department course_count", UpdateOne(
+                    {"_id": dept_id}, [{"$set": {"course_count": {"$size": {"$ifNull": ["$courses", []]}}}}]))
+
+    def checkMajorCounts(self):
+        # One row per major, so the counts fit in memory whatever the number of students
+        students = CollectionManager.GetCollection("students").collection
+        departments = CollectionManager.GetCollection("departments").collection
+        actual = {major["_id"]: major["count"] for major in students.aggregate(
+            [{"$unwind": "$majors"}, {"$group": {"_id": "$majors.name", "count": {"$sum": 1}}}], allowDiskUse=True)}
+
+        for dept in departments.find({}, {"majors.name": 1, "majors.student_count": 1}):
+            for major in dept.get("majors", []):
+                self.report.count("major counters")
+                count = actual.get(major["name"], 0)
+                if major.get("student_count") != count:
+                    self.report.mismatch("major student_count", f"{major['name']}: {major.get('student_count')} "
+                                                                f"for {count} students")
+                    self.queue("departments", "major student_count", UpdateOne(
+                        {"_id": dept["_id"], "majors.name": major["name"]},
+                        {"$set": {"majors.$.student_count": count}}))
+
+    def queue(self, collection_name: str, kind: str, operation: UpdateOne, event=None, enrollment=None):
+        # enrollment is the (student, section) a roster removal is based on, confirmed again before it's written
+        if not self.repairs:
+            return
+        pending = self._pending.setdefault(collection_name, [])
+        pending.append((kind, operation, event, enrollment))
+        if len(pending) >= self.batchSize:
+            self.flushCollection(collection_name)
+
+    def flush(self):
+        for collection_name in list(self._pending):
+            self.flushCollection(collection_name)
+
+    def flushCollection(self, collection_name: str):
+        pending = self.confirmed(self._pending.pop(collection_name, []))
+        if not pending:
+            return
+
+        target = CollectionManager.GetCollection(collection_name)
+        target.collection.bulk_write([operation for _, operation, _, _ in pending], ordered=False)
+        target.invalidate()
+        pending = self.landedClaims(pending)
+        target.flushEvents([event for _, _, event, _ in pending if event is not None])
+        for kind, _, _, _ in pending:
+            self.report.repair(kind, 1)
+
+    def landedClaims(self, pending) -> List:
+        # A roster repair only lands while the section has a seat; the ones that didn't are reported instead of
+        # counted, and their events (which would mark the enrollment as made) are dropped
+        claims = [event for kind, _, event, _ in pending if kind == "missing from section roster"]
+        if not claims:
+            return pending
+
+        sections = CollectionManager.GetCollection("sections").collection
+        seated = {(stu_id, sect["_id"]) for sect in sections.find(
+            {"_id": {"$in": list({event.docId for event in claims})}}, {"students": 1})
+            for stu_id in sect.get("students", [])}
+        landed = []
+        for item in pending:
+            kind, _, event, _ = item
+            if kind == "missing from section roster" and (event.details["student_id"], event.docId) not in seated:
+                self.report.mismatch("roster full", f"student {event.details['student_id']} -> "
+                                                    f"section {event.docId}")
+                continue
+            landed.append(item)
+        return landed
+
+    @staticmethod
+    def confirmed(pending) -> List:
+        # Registration claims the seat before it writes the student side, so a roster entry read mid-enrollment
+        # looks orphaned; anything whose student has the enrollment by now is left alone
+        student_ids = list({enrollment[0] for _, _, _, enrollment in pending if enrollment is not None})
+        if not student_ids:
+            return pending
+
+        enrolled = {(stu["_id"], enr["section_id"]) for stu in CollectionManager.GetCollection("students").collection
+                    .find({"_id": {"$in": student_ids}}, {"sections.section_id": 1}) for enr in stu.get("sections", [])}
+        return [item for item in pending if item[3] is None or item[3] not in enrolled]
+
+
+def promptCheck():
+    repair = input("Repair mismatches? [y/n] --> ").lower() == 'y'
+    print(IntegrityChecker(repair=repair).run())
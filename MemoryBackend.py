@@ -0,0 +1,1300 @@
+import functools
+import itertools
+import re
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany, ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# The storage interface the app is written against is the part of pymongo's Database and Collection API it calls:
+# find/find_one (with sort, limit, projection), insert_one/insert_many, update_one/update_many (operators and
+# pipeline updates), replace_one, delete_one/delete_many, find_one_and_update, count_documents, distinct,
+# bulk_write, aggregate, create_index and the collMod command. A MongoDB database is one backend; this module is
+# the other, an in-process engine with the same results and errors, so every rule (orphan cleanup, seat claims,
+# counters, unique combinations) runs without a server. Documents are kept in a dict by _id and every index is a
+# dict from key to ids, used both to enforce uniqueness and to answer equality filters without a scan.
+
+MISSING = object()
+
+# Order MongoDB uses when comparing values of different types
+TYPE_ORDER = {type(None): 1, int: 2, float: 2, str: 3, dict: 4, list: 5, bytes: 6, ObjectId: 7, bool: 8,
+              datetime: 9}
+
+BSON_TYPES = {"string": (str,), "object": (dict,), "array": (list,), "objectId": (ObjectId,), "date": (datetime,),
+              "bool": (bool,), "int": (int,), "long": (int,), "double": (float,), "number": (int, float),
+              "null": (type(None),)}
+
+
+def clone(value):
+    # Documents only hold dicts, lists and immutable scalars, so this is all a deep copy needs to do
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+    return value
+
+
+def typeRank(value) -> int:
+    return 1 if value is MISSING else TYPE_ORDER.get(type(value), 10)
+
+
+def compare(left, right) -> int:
+    left_rank, right_rank = typeRank(left), typeRank(right)
+    if left_rank != right_rank:
+        return -1 if left_rank < right_rank else 1
+    if isinstance(left, dict):
+        left, right = list(left.items()), list(right.items())
+    if isinstance(left, list):
+        for left_item, right_item in zip(left, right):
+            result = compare(left_item, right_item) if not isinstance(left_item, tuple) else \
+                compare(list(left_item), list(right_item))
+            if result:
+                return result
+        return (len(left) > len(right)) - (len(left) < len(right))
+    if left is None or left is MISSING:
+        return 0
+    return (left > right) - (left < right)
+
+
+def equal(left, right) -> bool:
+    # Missing and null are the same to a query; booleans are not numbers
+    if type(left) is type(right) and not isinstance(left, (dict, list)):
+        return left == right
+    if left is MISSING or right is MISSING:
+        return (left is MISSING or left is None) and (right is MISSING or right is None)
+    if isinstance(left, bool) != isinstance(right, bool):
+        return False
+    return typeRank(left) == typeRank(right) and compare(left, right) == 0
+
+
+def hashable(value):
+    if isinstance(value, dict):
+        return tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    return None if value is MISSING else value
+
+
+def typeName(value) -> str:
+    if value is MISSING:
+        return "missing"
+    if isinstance(value, bool):
+        return "bool"
+    for name in ["null", "string", "object", "array", "objectId", "date", "int", "double"]:
+        if isinstance(value, BSON_TYPES[name]):
+            return name
+    return "unknown"
+
+
+# --- Paths ---
+
+def fieldValue(value, parts: List[str]):
+    # A path the way expressions read it: through arrays of subdocuments, collecting each one's value
+    for idx, part in enumerate(parts):
+        if isinstance(value, list):
+            found = [fieldValue(item, parts[idx:]) for item in value if isinstance(item, dict)]
+            return [item for item in found if item is not MISSING]
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def queryValues(value, parts: List[str]) -> list:
+    # Every value a query condition on the path is tested against: an array counts as itself and as each of its
+    # elements, so {"students": id} matches a roster holding id
+    if not parts:
+        return [value] + value if isinstance(value, list) else [value]
+    if isinstance(value, dict):
+        return queryValues(value[parts[0]], parts[1:]) if parts[0] in value else [MISSING]
+    if isinstance(value, list):
+        if parts[0].isdigit():
+            idx = int(parts[0])
+            return queryValues(value[idx], parts[1:]) if idx < len(value) else [MISSING]
+        found = [item for element in value if isinstance(element, dict)
+                 for item in queryValues(element, parts) if item is not MISSING]
+        return found or [MISSING]
+    return [MISSING]
+
+
+def setPath(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        if isinstance(doc, list):
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, {})
+    if isinstance(doc, list):
+        doc[int(parts[-1])] = value
+    elif value is MISSING:
+        doc.pop(parts[-1], None)
+    else:
+        doc[parts[-1]] = value
+
+
+def removePath(doc, parts: List[str]):
+    if isinstance(doc, list):
+        for item in doc:
+            removePath(item, parts)
+    elif isinstance(doc, dict) and parts[0] in doc:
+        if len(parts) == 1:
+            del doc[parts[0]]
+        else:
+            removePath(doc[parts[0]], parts[1:])
+
+
+def getPath(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list) and part.isdigit():
+            value = value[int(part)] if int(part) < len(value) else MISSING
+        elif isinstance(value, dict):
+            value = value.get(part, MISSING)
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+# --- Queries ---
+
+def matchOperator(values: list, operator: str, argument) -> bool:
+    present = [value for value in values if value is not MISSING]
+    match operator:
+        case "$eq":
+            return any(equal(value, argument) for value in values)
+        case "$ne":
+            return not any(equal(value, argument) for value in values)
+        case "$in" | "$nin":
+            options = argument if isinstance(argument, Options) else Options(argument)
+            return any(value in options for value in values) == (operator == "$in")
+        case "$gt" | "$gte" | "$lt" | "$lte":
+            wanted = {"$gt": (1,), "$gte": (0, 1), "$lt": (-1,), "$lte": (-1, 0)}[operator]
+            return any(typeRank(value) == typeRank(argument) and compare(value, argument) in wanted
+                       for value in present)
+        case "$exists":
+            return bool(present) == bool(argument)
+        case "$size":
+            return any(isinstance(value, list) and len(value) == argument for value in present)
+        case "$elemMatch":
+            return any(isinstance(value, list) and any(
+                matches(item, argument) if isinstance(item, dict) and not isOperatorDict(argument)
+                else matchCondition([item], argument) for item in value) for value in present)
+        case "$not":
+            return not matchCondition(values, argument)
+        case "$regex":
+            pattern = re.compile(argument) if isinstance(argument, str) else argument
+            return any(isinstance(value, str) and pattern.search(value) for value in present)
+        case "$type":
+            names = argument if isinstance(argument, list) else [argument]
+            return any(typeName(value) in names or (typeName(value) in ["int", "double"] and "number" in names)
+                       for value in present)
+    raise OperationFailure(f"unknown operator: {operator}")
+
+
+class Options:
+    # The values of an $in, with the plain scalars in a set so membership is one probe
+    def __init__(self, values: Iterable):
+        self.values = list(values)
+        self.hashed = set()
+        self.rest = []
+        for value in self.values:
+            if value is None or isinstance(value, (dict, list, bool, re.Pattern)):
+                self.rest.append(value)
+            else:
+                self.hashed.add(value)
+
+    def __contains__(self, value) -> bool:
+        if value is MISSING or value is None or isinstance(value, (dict, list, bool)):
+            return any(equal(value, option) for option in self.values)
+        return value in self.hashed or any(equal(value, option) for option in self.rest)
+
+
+def prepare(query: dict) -> dict:
+    # Done once per query rather than once per document it is tested against
+    prepared = {}
+    for key, condition in query.items():
+        if key in ["$and", "$or", "$nor"]:
+            prepared[key] = [prepare(part) for part in condition]
+        elif key == "$expr":
+            prepared[key] = prepareExpression(condition)
+        elif isOperatorDict(condition):
+            prepared[key] = {operator: Options(argument) if operator in ["$in", "$nin"] else argument
+                             for operator, argument in condition.items()}
+        else:
+            prepared[key] = condition
+    return prepared
+
+
+def prepareExpression(expression):
+    # The same for expressions: a literal $in array is turned into Options once per stage
+    if isinstance(expression, dict):
+        prepared = {key: prepareExpression(value) for key, value in expression.items()}
+        argument = prepared.get("$in")
+        if len(prepared) == 1 and isinstance(argument, list) and len(argument) == 2 and \
+                isinstance(argument[1], list) and not any(isinstance(item, (dict, list)) or (
+                isinstance(item, str) and item.startswith("$")) for item in argument[1]):
+            prepared["$in"] = [argument[0], Options(argument[1])]
+        return prepared
+    if isinstance(expression, list):
+        return [prepareExpression(item) for item in expression]
+    return expression
+
+
+def isOperatorDict(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def matchCondition(values: list, condition) -> bool:
+    if isOperatorDict(condition):
+        if "$regex" in condition and "$options" in condition:
+            flags = re.IGNORECASE if "i" in condition["$options"] else 0
+            condition = dict(condition, **{"$regex": re.compile(condition["$regex"], flags)})
+            del condition["$options"]
+        return all(matchOperator(values, operator, argument) for operator, argument in condition.items())
+    if isinstance(condition, re.Pattern):
+        return matchOperator(values, "$regex", condition)
+    return any(equal(value, condition) for value in values)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        match key:
+            case "$and":
+                if not all(matches(doc, part) for part in condition):
+                    return False
+            case "$or":
+                if not any(matches(doc, part) for part in condition):
+                    return False
+            case "$nor":
+                if any(matches(doc, part) for part in condition):
+                    return False
+            case "$expr":
+                if not truthy(evaluate(condition, doc)):
+                    return False
+            case _:
+                if not matchCondition(queryValues(doc, key.split(".")), condition):
+                    return False
+    return True
+
+
+# --- Expressions ---
+
+def truthy(value) -> bool:
+    return not (value is MISSING or value is None or value is False or
+                (isinstance(value, (int, float)) and not isinstance(value, bool) and value == 0))
+
+
+def evaluate(expression, root: dict, variables: Optional[dict] = None):
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, rest = expression[2:].partition(".")
+        if name == "REMOVE":
+            return MISSING
+        base = root if name in ["ROOT", "CURRENT"] else variables.get(name, MISSING)
+        return fieldValue(base, rest.split(".")) if rest else base
+    if isinstance(expression, str) and expression.startswith("$"):
+        return fieldValue(root, expression[1:].split("."))
+    if isinstance(expression, list):
+        return [evaluate(item, root, variables) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1 and next(iter(expression)).startswith("$"):
+            operator, argument = next(iter(expression.items()))
+            return evaluateOperator(operator, argument, root, variables)
+        result = {}
+        for key, item in expression.items():
+            value = evaluate(item, root, variables)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    return expression
+
+
+def number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def evaluateOperator(operator: str, argument, root: dict, variables: dict):
+    def arg(expression):
+        return evaluate(expression, root, variables)
+
+    def args():
+        return [arg(item) for item in (argument if isinstance(argument, list) else [argument])]
+
+    match operator:
+        case "$literal":
+            return argument
+        case "$size":
+            value = arg(argument[0] if isinstance(argument, list) else argument)
+            if not isinstance(value, list):
+                raise OperationFailure(f"The argument to $size must be an array. Type of argument: "
+                                       f"{typeName(value)}")
+            return len(value)
+        case "$ifNull":
+            values = args()
+            for value in values[:-1]:
+                if value is not MISSING and value is not None:
+                    return value
+            return values[-1]
+        case "$cond":
+            if isinstance(argument, dict):
+                condition, then, otherwise = argument["if"], argument["then"], argument["else"]
+            else:
+                condition, then, otherwise = argument
+            return arg(then) if truthy(arg(condition)) else arg(otherwise)
+        case "$eq" | "$ne" | "$gt" | "$gte" | "$lt" | "$lte" | "$cmp":
+            left, right = args()
+            left, right = (None if left is MISSING else left), (None if right is MISSING else right)
+            result = compare(left, right)
+            return {"$eq": result == 0, "$ne": result != 0, "$gt": result > 0, "$gte": result >= 0,
+                    "$lt": result < 0, "$lte": result <= 0, "$cmp": result}[operator]
+        case "$in":
+            value, options = args()
+            return value in (options if isinstance(options, Options) else Options(options))
+        case "$and":
+            return all(truthy(value) for value in args())
+        case "$or":
+            return any(truthy(value) for value in args())
+        case "$not":
+            return not truthy(args()[0])
+        case "$map" | "$filter":
+            items = arg(argument["input"])
+            if items is MISSING or items is None:
+                return None
+            name = argument.get("as", "this")
+            if operator == "$map":
+                return [evaluate(argument["in"], root, dict(variables, **{name: item})) for item in items]
+            return [item for item in items if truthy(evaluate(argument["cond"], root, dict(variables, **{name: item})))]
+        case "$mergeObjects":
+            merged = {}
+            for value in args():
+                if isinstance(value, dict):
+                    merged.update(value)
+            return merged
+        case "$concat":
+            values = args()
+            if any(value is None or value is MISSING for value in values):
+                return None
+            return "".join(values)
+        case "$arrayElemAt":
+            items, idx = args()
+            if not isinstance(items, list):
+                return None
+            return items[idx] if -len(items) <= idx < len(items) else MISSING
+        case "$type":
+            return typeName(args()[0])
+        case "$toString":
+            value = args()[0]
+            if value is MISSING or value is None:
+                return None
+            return value.isoformat() if isinstance(value, datetime) else str(value)
+        case "$add":
+            return sum(value for value in args() if number(value))
+        case "$subtract":
+            left, right = args()
+            return left - right
+        case "$multiply":
+            return functools.reduce(lambda left, right: left * right, args(), 1)
+        case "$divide":
+            left, right = args()
+            if right == 0:
+                raise OperationFailure("can't $divide by zero")
+            return left / right
+        case "$sum" | "$max" | "$min" | "$avg":
+            values = args()
+            if len(values) == 1 and isinstance(values[0], list):
+                values = values[0]
+            return accumulate(operator, [value for value in values if value is not MISSING])
+    raise OperationFailure(f"Unrecognized expression '{operator}'")
+
+
+def accumulate(operator: str, values: list):
+    numbers = [value for value in values if number(value)]
+    match operator:
+        case "$sum":
+            return sum(numbers)
+        case "$avg":
+            return sum(numbers) / len(numbers) if numbers else None
+        case "$max" | "$min":
+            present = [value for value in values if value is not None]
+            if not present:
+                return None
+            key = functools.cmp_to_key(compare)
+            return max(present, key=key) if operator == "$max" else min(present, key=key)
+    raise OperationFailure(f"unknown group operator '{operator}'")
+
+
+# --- Projections ---
+
+def projectionTree(paths: Iterable[str]) -> dict:
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def include(value, tree: dict):
+    if isinstance(value, list):
+        return [include(item, tree) for item in value if isinstance(item, (dict, list))]
+    if not isinstance(value, dict):
+        return MISSING
+    result = {}
+    for key, item in value.items():
+        if key in tree:
+            kept = clone(item) if tree[key] is True else include(item, tree[key])
+            if kept is not MISSING:
+                result[key] = kept
+    return result
+
+
+def project(doc: dict, spec: Optional[dict], variables: Optional[dict] = None) -> dict:
+    if not spec:
+        return clone(doc)
+    fields = {key: value for key, value in spec.items() if key != "_id"}
+    exclusion = bool(fields) and all(value in (0, False) for value in fields.values())
+    if not fields:
+        exclusion = spec.get("_id") in (0, False)
+    if exclusion:
+        result = clone(doc)
+        for path in spec:
+            if spec[path] in (0, False):
+                removePath(result, path.split("."))
+        return result
+
+    included = [key for key, value in fields.items() if value in (1, True)]
+    result = include(doc, projectionTree(included))
+    id_spec = spec.get("_id", 1)
+    if id_spec in (1, True) and "_id" in doc:
+        result = dict({"_id": doc["_id"]}, **result)
+    elif id_spec not in (0, False, 1, True):
+        result = dict({"_id": evaluate(id_spec, doc, variables)}, **result)
+    for key, value in fields.items():
+        if value not in (0, 1, True, False):
+            computed = evaluate(value, doc, variables)
+            if computed is not MISSING:
+                setPath(result, key, computed)
+    return result
+
+
+# --- Updates ---
+
+def positionalIndex(doc: dict, array_path: str, query: dict) -> int:
+    # The element the query matched in the array, which "$" in an update path stands for
+    array = getPath(doc, array_path)
+    conditions = [(key[len(array_path) + 1:], condition) for key, condition in query.items()
+                  if key.startswith(array_path + ".")]
+    conditions += [("", condition) for key, condition in query.items() if key == array_path]
+    if isinstance(array, list):
+        for idx, item in enumerate(array):
+            if conditions and all(matchCondition(queryValues(item, sub.split(".")) if sub else [item], condition)
+                                  for sub, condition in conditions):
+                return idx
+    raise WriteError("The positional operator did not find the match needed from the query.", 2)
+
+
+def resolvePath(doc: dict, path: str, query: dict) -> str:
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    array_path, _, rest = path.partition(".$")
+    resolved = f"{array_path}.{positionalIndex(doc, array_path, query)}"
+    return resolved + rest
+
+
+def eachValues(value) -> list:
+    return list(value["$each"]) if isinstance(value, dict) and "$each" in value else [value]
+
+
+def pullMatches(item, condition) -> bool:
+    if isOperatorDict(condition):
+        return matchCondition([item], condition)
+    if isinstance(condition, dict) and isinstance(item, dict):
+        return matches(item, condition)
+    return equal(item, condition)
+
+
+def applyUpdate(doc: dict, update, query: dict, inserting: bool = False) -> dict:
+    if isinstance(update, list):
+        result = clone(doc)
+        for stage in update:
+            result = runStage(stage, [result], None)[0]
+        result["_id"] = doc["_id"]
+        return result
+    if not any(key.startswith("$") for key in update):
+        return dict(clone(update), _id=doc["_id"])
+
+    result = clone(doc)
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            path = resolvePath(result, path, query)
+            current = getPath(result, path)
+            match operator:
+                case "$set" | "$setOnInsert":
+                    setPath(result, path, clone(value))
+                case "$unset":
+                    removePath(result, path.split("."))
+                case "$inc":
+                    setPath(result, path, (0 if current is MISSING else current) + value)
+                case "$min" | "$max":
+                    if current is MISSING or (compare(value, current) < 0) == (operator == "$min") and \
+                            compare(value, current) != 0:
+                        setPath(result, path, clone(value))
+                case "$push" | "$addToSet":
+                    if current is MISSING:
+                        current = []
+                        setPath(result, path, current)
+                    if not isinstance(current, list):
+                        raise WriteError(f"The field '{path}' must be an array", 2)
+                    for item in eachValues(value):
+                        if operator == "$push" or not any(equal(item, existing) for existing in current):
+                            current.append(clone(item))
+                case "$pull":
+                    if isinstance(current, list):
+                        current[:] = [item for item in current if not pullMatches(item, value)]
+                case "$pullAll":
+                    if isinstance(current, list):
+                        current[:] = [item for item in current if not any(equal(item, gone) for gone in value)]
+                case _:
+                    raise WriteError(f"Unknown modifier: {operator}", 9)
+    return result
+
+
+def upsertDoc(query: dict) -> dict:
+    # The equality parts of the filter become the new document, as the server does
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isOperatorDict(condition):
+            if "$eq" in condition:
+                setPath(doc, key, clone(condition["$eq"]))
+            continue
+        setPath(doc, key, clone(condition))
+    return doc
+
+
+# --- Validation ---
+
+def conforms(value, schema: dict) -> bool:
+    if "bsonType" in schema:
+        types = schema["bsonType"] if isinstance(schema["bsonType"], list) else [schema["bsonType"]]
+        if isinstance(value, bool) and "bool" not in types:
+            return False
+        if not any(isinstance(value, BSON_TYPES[name]) for name in types):
+            return False
+    if "enum" in schema and not any(equal(value, option) for option in schema["enum"]):
+        return False
+    if "oneOf" in schema and sum(conforms(value, option) for option in schema["oneOf"]) != 1:
+        return False
+    if "anyOf" in schema and not any(conforms(value, option) for option in schema["anyOf"]):
+        return False
+    if "allOf" in schema and not all(conforms(value, option) for option in schema["allOf"]):
+        return False
+    if "not" in schema and conforms(value, schema["not"]):
+        return False
+    if number(value):
+        if "minimum" in schema and value < schema["minimum"]:
+            return False
+        if "maximum" in schema and value > schema["maximum"]:
+            return False
+    if isinstance(value, str):
+        if "minLength" in schema and len(value) < schema["minLength"]:
+            return False
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            return False
+    if isinstance(value, list) and "items" in schema:
+        if not all(conforms(item, schema["items"]) for item in value):
+            return False
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        if any(name not in value for name in schema.get("required", [])):
+            return False
+        if schema.get("additionalProperties") is False and any(name not in properties for name in value):
+            return False
+        if not all(conforms(item, properties[name]) for name, item in value.items() if name in properties):
+            return False
+    return True
+
+
+# --- Cursors ---
+
+class MemoryCursor:
+    # Lazily runs its query on first iteration, so sort and limit can still be chained onto find()
+    def __init__(self, produce, plan=None):
+        self._produce = produce
+        self._plan = plan
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def explain(self) -> dict:
+        # Which lookup the query would use: _id, an index, or a full scan
+        if self._plan is None:
+            raise OperationFailure("explain is only supported on find() cursors")
+        return self._plan()
+
+    def _run(self):
+        if self._results is None:
+            docs = self._produce()
+            if self._sort:
+                docs = sortDocs(docs, self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._results = iter(docs)
+        return self._results
+
+    def __iter__(self):
+        return self._run()
+
+    def __next__(self):
+        return next(self._run())
+
+    def close(self):
+        self._results = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sortDocs(docs: list, keys: list) -> list:
+    def order(left, right):
+        for path, direction in keys:
+            result = compare(fieldValue(left, path.split(".")), fieldValue(right, path.split(".")))
+            if result:
+                return result * (1 if direction in (1, "asc", "ascending") else -1)
+        return 0
+    return sorted(docs, key=functools.cmp_to_key(order))
+
+
+# --- Aggregation ---
+
+def runStage(stage: dict, docs: list, database: Optional["MemoryDatabase"]) -> list:
+    name, spec = next(iter(stage.items()))
+    if name in ["$project", "$set", "$addFields", "$group", "$replaceRoot", "$replaceWith"]:
+        spec = prepareExpression(spec)
+    match name:
+        case "$match":
+            spec = prepare(spec)
+            return [doc for doc in docs if matches(doc, spec)]
+        case "$project":
+            return [project(doc, spec) for doc in docs]
+        case "$set" | "$addFields":
+            results = []
+            for doc in docs:
+                result = clone(doc)
+                for path, expression in spec.items():
+                    setPath(result, path, evaluate(expression, doc))
+                results.append(result)
+            return results
+        case "$unset":
+            paths = [spec] if isinstance(spec, str) else spec
+            return [project(doc, {path: 0 for path in paths}) for doc in docs]
+        case "$unwind":
+            return unwind(docs, spec)
+        case "$lookup":
+            return lookup(docs, spec, database)
+        case "$group":
+            return group(docs, spec)
+        case "$sort":
+            return sortDocs(docs, list(spec.items()))
+        case "$limit":
+            return docs[:spec]
+        case "$skip":
+            return docs[spec:]
+        case "$count":
+            return [{spec: len(docs)}] if docs else []
+        case "$replaceRoot" | "$replaceWith":
+            expression = spec["newRoot"] if name == "$replaceRoot" else spec
+            return [evaluate(expression, doc) for doc in docs]
+        case "$merge":
+            database.mergeInto(docs, spec)
+            return []
+    raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'")
+
+
+def unwind(docs: list, spec) -> list:
+    spec = {"path": spec} if isinstance(spec, str) else spec
+    path = spec["path"][1:]
+    preserve = spec.get("preserveNullAndEmptyArrays", False)
+    results = []
+    for doc in docs:
+        value = getPath(doc, path)
+        if isinstance(value, list) and value:
+            for idx, item in enumerate(value):
+                result = clone(doc)
+                setPath(result, path, clone(item))
+                if "includeArrayIndex" in spec:
+                    result[spec["includeArrayIndex"]] = idx
+                results.append(result)
+        elif value is not MISSING and value is not None and not isinstance(value, list):
+            results.append(clone(doc))
+        elif preserve:
+            result = clone(doc)
+            if isinstance(value, list):
+                removePath(result, path.split("."))
+            results.append(result)
+    return results
+
+
+def lookup(docs: list, spec: dict, database: "MemoryDatabase") -> list:
+    foreign = database[spec["from"]]
+    local_field, foreign_field = spec.get("localField"), spec.get("foreignField")
+    if local_field is not None:
+        joined_by = foreign.joiner(foreign_field)
+
+    results = []
+    for doc in docs:
+        if local_field is not None:
+            local = fieldValue(doc, local_field.split("."))
+            keys = local if isinstance(local, list) else [local]
+            joined, seen = [], set()
+            for key in keys:
+                for seq, foreign_doc in joined_by(hashable(None if key is MISSING else key)):
+                    if seq not in seen:
+                        seen.add(seq)
+                        joined.append((seq, foreign_doc))
+            joined = [clone(foreign_doc) for _, foreign_doc in sorted(joined, key=lambda item: item[0])]
+        else:
+            joined = foreign.allDocs()
+        if "pipeline" in spec:
+            variables = {name: evaluate(expression, doc) for name, expression in spec.get("let", {}).items()}
+            joined = runPipeline(spec["pipeline"], joined, database, variables)
+        result = clone(doc)
+        setPath(result, spec["as"], joined)
+        results.append(result)
+    return results
+
+
+def runPipeline(pipeline: list, docs: list, database, variables: Optional[dict] = None) -> list:
+    for stage in pipeline:
+        if variables and "$match" in stage and "$expr" in stage["$match"]:
+            docs = [doc for doc in docs if truthy(evaluate(stage["$match"]["$expr"], doc, variables))
+                    and matches(doc, {key: value for key, value in stage["$match"].items() if key != "$expr"})]
+            continue
+        docs = runStage(stage, docs, database)
+    return docs
+
+
+def group(docs: list, spec: dict) -> list:
+    groups = {}
+    for doc in docs:
+        key = evaluate(spec["_id"], doc)
+        key = None if key is MISSING else key
+        entry = groups.setdefault(hashable(key), {"_id": key, "rows": []})
+        entry["rows"].append(doc)
+
+    results = []
+    for entry in groups.values():
+        result = {"_id": entry["_id"]}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            operator, expression = next(iter(accumulator.items()))
+            values = [evaluate(expression, row) for row in entry["rows"]] if operator != "$count" else []
+            match operator:
+                case "$sum" | "$avg" | "$max" | "$min":
+                    result[field] = accumulate(operator, [value for value in values if value is not MISSING])
+                case "$push":
+                    result[field] = [value for value in values if value is not MISSING]
+                case "$addToSet":
+                    unique = []
+                    for value in values:
+                        if value is not MISSING and not any(equal(value, kept) for kept in unique):
+                            unique.append(value)
+                    result[field] = unique
+                case "$first":
+                    result[field] = values[0] if values else None
+                case "$last":
+                    result[field] = values[-1] if values else None
+                case "$count":
+                    result[field] = len(entry["rows"])
+                case _:
+                    raise OperationFailure(f"unknown group operator '{operator}'")
+        results.append(result)
+    return results
+
+
+# --- Indexes and collections ---
+
+def equalities(condition) -> Optional[list]:
+    # The values a filter condition can only be equal to, or None when it is anything else
+    if condition is MISSING or isinstance(condition, (list, re.Pattern)):
+        return None
+    if isOperatorDict(condition):
+        if list(condition) == ["$eq"]:
+            return equalities(condition["$eq"])
+        if list(condition) == ["$in"] and not any(isinstance(value, (list, re.Pattern)) for value in condition["$in"]):
+            return list(condition["$in"])
+        return None
+    return [condition]
+
+
+class MemoryIndex:
+    def __init__(self, name: str, fields: List[str], unique: bool):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.entries = {}
+
+    def keys(self, doc: dict) -> set:
+        # An array field adds one key per element, so a roster index finds a section by any of its students
+        per_field = []
+        for field in self.fields:
+            # Read the way queries read paths, through arrays of subdocuments too ("majors.name")
+            values = [value for value in queryValues(doc, field.split(".")) if not isinstance(value, list)]
+            per_field.append({hashable(value) for value in values} or {None})
+        return set(itertools.product(*per_field))
+
+    def add(self, doc_id, keys: set):
+        for key in keys:
+            self.entries.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id, keys: set):
+        for key in keys:
+            ids = self.entries.get(key)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.entries[key]
+
+    def conflict(self, doc_id, keys: set):
+        if self.unique:
+            for key in keys:
+                if self.entries.get(key, set()) - {doc_id}:
+                    return key
+        return None
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._clear()
+
+    def _clear(self):
+        # As on a server, a collection only exists once it is created or written to
+        self.created = False
+        self.validator = None
+        self._docs = {}
+        self._order = {}
+        self._sequence = itertools.count()
+        self._indexes = {}
+
+    @property
+    def _lock(self):
+        return self.database.lock
+
+    # Reads
+
+    def _plan(self, query: dict) -> Tuple[Optional[str], list]:
+        # Equality on _id or on every field of an index is a dict lookup; anything else is a scan. Returns the
+        # index used ("_id_", an index name, or None for a scan) and the candidate ids in insertion order
+        ids = equalities(query.get("_id", MISSING))
+        if ids is not None:
+            return "_id_", sorted((doc_id for doc_id in set(map(hashable, ids)) if doc_id in self._docs),
+                                  key=self._order.get)
+        for index in self._indexes.values():
+            options = [equalities(query.get(field, MISSING)) for field in index.fields]
+            if all(values is not None for values in options):
+                found = set()
+                for key in itertools.product(*[[hashable(value) for value in values] for values in options]):
+                    found.update(index.entries.get(key, ()))
+                return index.name, sorted(found, key=self._order.get)
+        return None, list(self._docs)
+
+    def _candidates(self, query: dict) -> list:
+        return self._plan(query)[1]
+
+    def _explain(self, query: Optional[dict]) -> dict:
+        # The parts of a server's explain("executionStats") that IndexAdvisor reads
+        query = query or {}
+        with self._lock:
+            index_name, candidates = self._plan(query)
+            prepared = prepare(query)
+            returned = sum(1 for doc_id in candidates if matches(self._docs[doc_id], prepared))
+        if index_name is None:
+            plan = {"stage": "COLLSCAN", "filter": query}
+        elif index_name == "_id_":
+            plan = {"stage": "IDHACK"}
+        else:
+            plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": index_name}}
+        return {"queryPlanner": {"namespace": self.full_name, "winningPlan": plan},
+                "executionStats": {"nReturned": returned, "totalDocsExamined": len(candidates)}}
+
+    def _matching(self, query: Optional[dict]) -> list:
+        query = query or {}
+        prepared = prepare(query)
+        return [self._docs[doc_id] for doc_id in self._candidates(query) if matches(self._docs[doc_id], prepared)]
+
+    def find(self, filter: Optional[dict] = None, projection=None, sort=None, limit: int = 0, skip: int = 0,
+             batch_size: int = 0, **kwargs) -> MemoryCursor:
+        if isinstance(projection, list):
+            projection = {field: 1 for field in projection}
+
+        def produce():
+            with self._lock:
+                return [project(doc, projection) for doc in self._matching(filter)]
+        cursor = MemoryCursor(produce, lambda: self._explain(filter)).skip(skip).limit(limit)
+        return cursor.sort(sort) if sort else cursor
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, projection, limit=1, **kwargs)), None)
+
+    def count_documents(self, filter: dict, limit: int = 0, skip: int = 0, **kwargs) -> int:
+        with self._lock:
+            count = max(0, len(self._matching(filter)) - skip)
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> list:
+        values = []
+        with self._lock:
+            for doc in self._matching(filter):
+                for value in queryValues(doc, key.split(".")):
+                    if value is MISSING or isinstance(value, list):
+                        continue
+                    if not any(equal(value, seen) for seen in values):
+                        values.append(clone(value))
+        return values
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> MemoryCursor:
+        # A leading $match goes through the indexes, so only the documents it keeps are copied
+        with self._lock:
+            if pipeline and "$match" in pipeline[0]:
+                docs = [clone(doc) for doc in self._matching(pipeline[0]["$match"])]
+                pipeline = pipeline[1:]
+            else:
+                docs = self.allDocs()
+            return MemoryCursor(lambda docs=runPipeline(pipeline, docs, self.database): docs)
+
+    def allDocs(self) -> list:
+        return [clone(doc) for doc in self._docs.values()]
+
+    def joiner(self, path: str):
+        # key -> [(insertion order, doc)] for a $lookup: through _id or an index on the field when there is one,
+        # otherwise through a hash of the collection built once per stage
+        if path == "_id":
+            return lambda key: [(self._order[key], self._docs[key])] if key in self._docs else []
+        for index in self._indexes.values():
+            if index.fields == [path]:
+                return lambda key: [(self._order[doc_id], self._docs[doc_id])
+                                    for doc_id in index.entries.get((key,), ())]
+        by_key = self.keyMap(path)
+        return lambda key: by_key.get(key, [])
+
+    def keyMap(self, path: str) -> Dict[Any, list]:
+        # hashable value -> [(insertion order, doc)], every value an array path holds included
+        by_key = {}
+        for doc_id, doc in self._docs.items():
+            values = queryValues(doc, path.split("."))
+            keys = {hashable(None if value is MISSING else value) for value in values if not isinstance(value, list)}
+            for key in keys:
+                by_key.setdefault(key, []).append((self._order[doc_id], doc))
+        return by_key
+
+    # Writes
+
+    def _validate(self, doc: dict):
+        if self.validator and "$jsonSchema" in self.validator and not conforms(doc, self.validator["$jsonSchema"]):
+            raise WriteError("Document failed validation", 121, {"failingDocumentId": doc.get("_id")})
+
+    def _store(self, doc: dict, previous: Optional[dict] = None):
+        # Checked against every unique index before anything changes, so a rejected write leaves no trace
+        self._validate(doc)
+        # Stored under a hashable form of _id, since ids may be documents themselves
+        doc_id = hashable(doc["_id"])
+        if previous is None and doc_id in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: "
+                                    f"{{ _id: {doc['_id']!r} }}", 11000, {"keyValue": {"_id": doc["_id"]}})
+        new_keys = {name: index.keys(doc) for name, index in self._indexes.items()}
+        for name, index in self._indexes.items():
+            key = index.conflict(doc_id, new_keys[name])
+            if key is not None:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: {name} "
+                                        f"dup key: {dict(zip(index.fields, key))}", 11000,
+                                        {"keyValue": dict(zip(index.fields, key))})
+        for name, index in self._indexes.items():
+            old_keys = index.keys(previous) if previous is not None else set()
+            index.remove(doc_id, old_keys - new_keys[name])
+            index.add(doc_id, new_keys[name] - old_keys)
+        if doc_id not in self._order:
+            self._order[doc_id] = next(self._sequence)
+        self._docs[doc_id] = doc
+        self.created = True
+
+    def _delete(self, doc_id):
+        doc_id = hashable(doc_id)
+        doc = self._docs.pop(doc_id)
+        del self._order[doc_id]
+        for index in self._indexes.values():
+            index.remove(doc_id, index.keys(doc))
+
+    def _insert(self, document: dict):
+        # Like pymongo, the caller's document gets the generated _id
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        self._store(clone(document))
+        return document["_id"]
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        requests = [InsertOne(document) for document in documents]
+        self.bulk_write(requests, ordered=ordered)
+        return InsertManyResult([request._doc["_id"] for request in requests], True)
+
+    def _update(self, filter: dict, update, upsert: bool, multi: bool) -> dict:
+        if isinstance(update, dict) and not update:
+            raise ValueError("update cannot be empty")
+        matched = self._matching(filter)
+        if not multi:
+            matched = matched[:1]
+        modified = 0
+        for doc in matched:
+            updated = applyUpdate(doc, update, filter)
+            if updated != doc:
+                self._store(updated, doc)
+                modified += 1
+        raw = {"n": len(matched), "nModified": modified, "updatedExisting": bool(matched)}
+        if not matched and upsert:
+            seed = upsertDoc(filter)
+            seed.setdefault("_id", ObjectId())
+            doc = applyUpdate(seed, update, filter, inserting=True)
+            self._store(doc)
+            raw.update(n=1, upserted=doc["_id"])
+        return raw
+
+    def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, False), True)
+
+    def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, True), True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        if any(key.startswith("$") for key in replacement):
+            raise ValueError("replacement can not include $ operators")
+        with self._lock:
+            return UpdateResult(self._update(filter, replacement, upsert, False), True)
+
+    def find_one_and_update(self, filter: dict, update, projection=None, sort=None, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._lock:
+            matched = self._matching(filter)
+            if sort:
+                matched = sortDocs(matched, [(sort, 1)] if isinstance(sort, str) else list(sort))
+            if not matched:
+                if not upsert:
+                    return None
+                raw = self._update(filter, update, True, False)
+                return project(self._docs[hashable(raw["upserted"])], projection) \
+                    if return_document == ReturnDocument.AFTER else None
+            before = matched[0]
+            self._update({"_id": before["_id"]}, update, False, False)
+            after = self._docs[hashable(before["_id"])]
+            return project(after if return_document == ReturnDocument.AFTER else before, projection)
+
+    def _remove(self, filter: dict, multi: bool) -> int:
+        matched = self._matching(filter)
+        if not multi:
+            matched = matched[:1]
+        for doc in matched:
+            self._delete(doc["_id"])
+        return len(matched)
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            return DeleteResult({"n": self._remove(filter, False)}, True)
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            return DeleteResult({"n": self._remove(filter, True)}, True)
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+                  "writeErrors": [], "writeConcernErrors": []}
+        with self._lock:
+            for idx, request in enumerate(requests):
+                try:
+                    self._apply(request, idx, counts)
+                except (DuplicateKeyError, WriteError) as e:
+                    counts["writeErrors"].append({"index": idx, "code": e.code, "errmsg": str(e),
+                                                  "keyValue": (e.details or {}).get("keyValue")})
+                    if ordered:
+                        break
+        if counts["writeErrors"]:
+            raise BulkWriteError(counts)
+        return BulkWriteResult(counts, True)
+
+    def _apply(self, request, idx: int, counts: dict):
+        if isinstance(request, InsertOne):
+            self._insert(request._doc)
+            counts["nInserted"] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+            raw = self._update(request._filter, request._doc, bool(request._upsert), isinstance(request, UpdateMany))
+            if "upserted" in raw:
+                counts["nUpserted"] += 1
+                counts["upserted"].append({"index": idx, "_id": raw["upserted"]})
+            else:
+                counts["nMatched"] += raw["n"]
+                counts["nModified"] += raw["nModified"]
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            counts["nRemoved"] += self._remove(request._filter, isinstance(request, DeleteMany))
+        else:
+            raise TypeError(f"{request!r} is not a valid request")
+
+    # Indexes
+
+    def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = MemoryIndex(name, [field for field, _ in keys], unique)
+            for doc_id, doc in self._docs.items():
+                doc_keys = index.keys(doc)
+                key = index.conflict(doc_id, doc_keys)
+                if key is not None:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: "
+                                            f"{name} dup key: {dict(zip(index.fields, key))}", 11000)
+                index.add(doc_id, doc_keys)
+            self._indexes[name] = index
+            self.created = True
+        return name
+
+    def index_information(self) -> dict:
+        info = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            info[name] = {"key": [(field, 1) for field in index.fields], "unique": index.unique}
+        return info
+
+    def drop_index(self, name: str):
+        with self._lock:
+            if self._indexes.pop(name, None) is None:
+                raise OperationFailure(f"index not found with name [{name}]")
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self.client = None
+        # One lock for the whole database: lookups and merges read and write several collections at once
+        self.lock = threading.RLock()
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        with self.lock:
+            collection = self[name]
+            if collection.created:
+                raise CollectionInvalid(f"collection {name} already exists")
+            collection.created = True
+            return collection
+
+    def list_collection_names(self, **kwargs) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection.created]
+
+    def drop_collection(self, name, **kwargs):
+        # Emptied in place, so collection objects handed out earlier see the dropped state like pymongo's do
+        with self.lock:
+            self[name if isinstance(name, str) else name.name]._clear()
+
+    def command(self, command, value=None, **kwargs) -> dict:
+        if command == "collMod":
+            if not self[value].created:
+                raise OperationFailure(f"ns does not exist: {self.name}.{value}")
+            self[value].validator = kwargs.get("validator")
+            return {"ok": 1.0}
+        if command == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{command}'")
+
+    def mergeInto(self, docs: list, spec: dict):
+        target = self[spec["into"] if isinstance(spec["into"], str) else spec["into"]["coll"]]
+        on = spec.get("on", "_id")
+        on = [on] if isinstance(on, str) else on
+        when_matched, when_not_matched = spec.get("whenMatched", "merge"), spec.get("whenNotMatched", "insert")
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            existing = target._matching({field: doc.get(field) for field in on})
+            if existing:
+                current = existing[0]
+                if when_matched == "fail":
+                    raise DuplicateKeyError(f"$merge found a match for {doc['_id']!r}", 11000)
+                if when_matched == "keepExisting":
+                    continue
+                merged = dict(current, **doc) if when_matched == "merge" else dict(doc, _id=current["_id"])
+                target._store(merged, current)
+            elif when_not_matched == "insert":
+                target._store(clone(doc))
+            elif when_not_matched == "fail":
+                raise OperationFailure(f"$merge could not find a matching document for {doc['_id']!r}")
+
+
+# Databases live as long as the process, so every Connect pointed at the memory backend sees the same data
+_databases = {}
+_lock = threading.Lock()
+
+
+def database(name: str) -> MemoryDatabase:
+    with _lock:
+        if name not in _databases:
+            _databases[name] = MemoryDatabase(name)
+        return _databases[name]
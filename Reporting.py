@@ -0,0 +1,235 @@
+from datetime import datetime
+from pprint import pprint
+from typing import List
+from pymongo import UpdateOne
+from Base import Base
+from CollectionManager import CollectionManager
+import Timetable
+import WriteBehind
+
+DIRTY_COLLECTION = "report_dirty"
+# Set on a section whose roster changed since the last refresh
+SECTION_MARK = "report_marked"
+
+# Report collection -> the scope its groups are keyed by
+REPORTS = {
+    "report_section_fill": "term",
+    "report_department_fill": "term",
+    "report_instructor_load": "term",
+    "report_building_usage": "term",
+    "report_department_size": "department",
+}
+
+
+def db():
+    return CollectionManager.GetCollection("sections").db
+
+
+def markDirty(event, mark: dict):
+    # Events record what they touched with whatever ids they already hold, as a side write of the same batch;
+    # refresh() maps sections, courses and majors to the terms and departments they belong to and recomputes
+    # only those groups
+    event.write(DIRTY_COLLECTION, UpdateOne({"_id": mark}, {"$set": {"marked": datetime.now()}}, upsert=True))
+
+
+def markSection(event):
+    if event.name in ["insert", "delete"]:
+        semester, year = Timetable.term(event.doc)
+        markDirty(event, {"scope": "term", "semester": semester, "section_year": year})
+        markDirty(event, {"scope": "course", "id": event.doc["course"]})
+    else:
+        # Roster changes are the bulk of the writes, so the mark rides in the section's own update instead of
+        # costing a report_dirty write each; refresh() finds the sections by it
+        event.set(SECTION_MARK, datetime.now())
+
+
+def markDepartment(event):
+    markDirty(event, {"scope": "department", "id": event.docId})
+
+
+def markMajors(event):
+    if event.name == "update":
+        names = event.details.get("pushed", {}).get("majors", []) + event.details.get("pulled", {}).get("majors", [])
+    else:
+        names = [major["name"] for major in event.doc.get("majors", [])]
+    for name in set(names):
+        markDirty(event, {"scope": "major", "id": name})
+
+
+def enrolledExpr():
+    # Sections written before enrolled_count existed fall back to their roster
+    return {"$ifNull": ["$enrolled_count", {"$size": {"$ifNull": ["$students", []]}}]}
+
+
+def sectionRows(term_match: dict) -> List[dict]:
+    # Sections of the refreshed terms joined to their course, shared by every term-scoped report
+    return [
+        {"$match": term_match},
+        {"$lookup": {"from": "courses", "localField": "course", "foreignField": "_id", "as": "_course"}},
+        {"$unwind": {"path": "$_course", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"semester": 1, "section_year": 1, "building": 1, "room": 1, "instructor": 1,
+                      "schedule": 1, "start_time": 1, "course": 1, "department": "$_course.department",
+                      "units": {"$ifNull": ["$_course.units", 0]}, "capacity": 1, "enrolled": enrolledExpr()}},
+    ]
+
+
+def fillRate(enrolled: str) -> dict:
+    return {"$cond": [{"$gt": ["$capacity", 0]}, {"$divide": [enrolled, "$capacity"]}, None]}
+
+
+def seatedExpr():
+    # Unlimited sections count toward enrollment but not toward seats, so the fill rate only counts the students
+    # of sections that have a capacity (the same rule as Analytics.fillRateByDepartment)
+    return {"$cond": [{"$eq": [{"$ifNull": ["$capacity", None]}, None]}, 0, "$enrolled"]}
+
+
+def termPipelines(term_match: dict) -> dict:
+    return {
+        "report_section_fill": sectionRows(term_match) + [
+            {"$set": {"fill_rate": fillRate("$enrolled")}},
+        ],
+        "report_department_fill": sectionRows(term_match) + [
+            {"$group": {"_id": {"department": "$department", "semester": "$semester",
+                                "section_year": "$section_year"},
+                        "sections": {"$sum": 1}, "enrolled": {"$sum": "$enrolled"}, "seated": {"$sum": seatedExpr()},
+                        "capacity": {"$sum": {"$ifNull": ["$capacity", 0]}}}},
+            {"$set": {"semester": "$_id.semester", "section_year": "$_id.section_year",
+                      "fill_rate": fillRate("$seated")}},
+        ],
+        "report_instructor_load": sectionRows(term_match) + [
+            {"$group": {"_id": {"instructor": "$instructor", "semester": "$semester",
+                                "section_year": "$section_year"},
+                        "sections": {"$sum": 1}, "students": {"$sum": "$enrolled"}, "units": {"$sum": "$units"}}},
+            {"$set": {"semester": "$_id.semester", "section_year": "$_id.section_year"}},
+        ],
+        "report_building_usage": sectionRows(term_match) + [
+            {"$group": {"_id": {"building": "$building", "semester": "$semester", "section_year": "$section_year"},
+                        "sections": {"$sum": 1}, "rooms": {"$addToSet": "$room"},
+                        "seats": {"$sum": {"$ifNull": ["$capacity", 0]}}, "enrolled": {"$sum": "$enrolled"},
+                        "seated": {"$sum": seatedExpr()}}},
+            {"$set": {"semester": "$_id.semester", "section_year": "$_id.section_year",
+                      "rooms": {"$size": "$rooms"}}},
+        ],
+    }
+
+
+def departmentPipeline(dept_match: dict) -> List[dict]:
+    return [
+        {"$match": dept_match},
+        {"$lookup": {"from": "sections", "localField": "courses", "foreignField": "course", "as": "_sections",
+                     "pipeline": [{"$project": {"_id": 1}}]}},
+        {"$project": {"name": 1, "abbreviation": 1,
+                      "courses": {"$ifNull": ["$course_count", {"$size": {"$ifNull": ["$courses", []]}}]},
+                      "majors": {"$size": {"$ifNull": ["$majors", []]}},
+                      "sections": {"$size": "$_sections"},
+                      "students_majoring": {"$sum": "$majors.student_count"}}},
+    ]
+
+
+def mergeInto(source, pipeline: List[dict], report: str, stamp):
+    source.aggregate(pipeline + [
+        {"$set": {"refreshed": stamp}},
+        {"$merge": {"into": report, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ])
+
+
+def refreshTerms(terms, stamp):
+    match = {"$or": [{"semester": semester, "section_year": year} for semester, year in terms]}
+    sections = CollectionManager.GetCollection("sections").collection
+    for report, pipeline in termPipelines(match).items():
+        mergeInto(sections, pipeline, report, stamp)
+        # Rows of these terms that weren't rewritten belong to sections or groups that no longer exist
+        db()[report].delete_many({"$and": [match, {"refreshed": {"$ne": stamp}}]})
+
+
+def refreshDepartments(dept_ids, stamp):
+    departments = CollectionManager.GetCollection("departments").collection
+    match = {"_id": {"$in": list(dept_ids)}}
+    mergeInto(departments, departmentPipeline(match), "report_department_size", stamp)
+    # Departments that weren't rewritten have been deleted, so their rows go from every report keyed by them
+    db()["report_department_size"].delete_many({"$and": [match, {"refreshed": {"$ne": stamp}}]})
+    gone = set(dept_ids) - set(departments.distinct("_id", match))
+    if gone:
+        db()["report_department_fill"].delete_many({"_id.department": {"$in": list(gone)}})
+
+
+def refresh(full: bool = False) -> dict:
+    # Queued writes carry dirty marks of their own
+    WriteBehind.flush()
+    stamp = datetime.now()
+    dirty = db()[DIRTY_COLLECTION]
+
+    if full:
+        sections = CollectionManager.GetCollection("sections").collection
+        terms = {(group["_id"]["semester"], group["_id"]["section_year"]) for group in sections.aggregate(
+            [{"$group": {"_id": {"semester": "$semester", "section_year": "$section_year"}}}])}
+        departments = set(CollectionManager.GetCollection("departments").collection.distinct("_id"))
+        majors = set()
+    else:
+        marks = [mark["_id"] for mark in dirty.find({"marked": {"$lte": stamp}})]
+        scoped = {}
+        for mark in marks:
+            scoped.setdefault(mark["scope"], set()).add(mark.get("id"))
+        terms = {(mark["semester"], mark["section_year"]) for mark in marks if mark["scope"] == "term"}
+        departments = scoped.get("department", set())
+        majors = scoped.get("major", set())
+
+        # Sections map to their term and, through their course, to a department. Marks written before sections
+        # carried their own may still name some
+        courses = scoped.get("course", set())
+        stale = {SECTION_MARK: {"$lte": stamp}}
+        if scoped.get("section"):
+            stale = {"$or": [stale, {"_id": {"$in": list(scoped["section"])}}]}
+        for sect in CollectionManager.GetCollection("sections").collection.find(
+                stale, {"semester": 1, "section_year": 1, "course": 1}):
+            terms.add((sect["semester"], sect["section_year"]))
+            courses.add(sect["course"])
+        if courses:
+            departments.update(course["department"] for course in CollectionManager.GetCollection(
+                "courses").findByIds(list(courses)).values() if "department" in course)
+
+    if majors:
+        departments.update(dept["_id"] for dept in CollectionManager.GetCollection("departments").collection.find(
+            {"majors.name": {"$in": list(majors)}}, {"_id": 1}))
+
+    if terms:
+        refreshTerms(terms, stamp)
+    if departments:
+        refreshDepartments(departments, stamp)
+    if full:
+        for report in REPORTS:
+            db()[report].delete_many({"refreshed": {"$ne": stamp}})
+
+    # Only marks that existed when the refresh started are cleared; anything marked since waits for the next run
+    dirty.delete_many({"marked": {"$lte": stamp}})
+    CollectionManager.GetCollection("sections").collection.update_many(
+        {SECTION_MARK: {"$lte": stamp}}, {"$unset": {SECTION_MARK: ""}})
+    return {"terms": len(terms), "departments": len(departments)}
+
+
+def promptReport():
+    counts = refresh()
+    print(f"Refreshed {counts['terms']} term(s) and {counts['departments']} department(s).\n")
+
+    names = list(REPORTS)
+    for idx, name in enumerate(names, start=1):
+        print(f"{idx}. {name}")
+    choice = input("--> ")
+    while choice not in [str(i) for i in range(1, len(names) + 1)]:
+        print(f"Invalid input. Enter from 1 to {len(names)}.")
+        choice = input("--> ")
+
+    for row in db()[names[int(choice) - 1]].find({}, {"refreshed": 0}):
+        pprint(row)
+
+
+Base.subscribe("sections", "insert", markSection)
+Base.subscribe("sections", "delete", markSection)
+Base.subscribe("sections", "enroll", markSection)
+Base.subscribe("sections", "unenroll", markSection)
+Base.subscribe("departments", "insert", markDepartment)
+Base.subscribe("departments", "update", markDepartment)
+Base.subscribe("departments", "delete", markDepartment)
+Base.subscribe("students", "insert", markMajors)
+Base.subscribe("students", "update", markMajors)
+Base.subscribe("students", "delete", markMajors)
@@ -0,0 +1,282 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from pprint import pprint
+from typing import List, Dict, Tuple, Callable
+from Base import Base
+from CollectionManager import CollectionManager
+
+BATCH_SIZE = 10000
+# A one or two letter prefix matches a large part of the index; only this many of its terms are ranked
+MAX_PREFIX_TERMS = 2000
+# Shorter tokens are within one edit of too many terms to be worth a fuzzy lookup
+MIN_FUZZY_LENGTH = 4
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokens(text) -> List[str]:
+    return TOKEN.findall(str(text).lower())
+
+
+def deletions(term: str) -> set:
+    # The term and every way of dropping one character from it. Two words one typo apart (a wrong, missing, extra
+    # or swapped character) always have a variant in common, so fuzzy lookups are a few dictionary probes.
+    return {term} | {term[:idx] + term[idx + 1:] for idx in range(len(term))}
+
+
+def oneEdit(left: str, right: str) -> bool:
+    # Sharing a variant is necessary but not sufficient ("xab" and "abx" share "ab"), so candidates are checked
+    if left == right or abs(len(left) - len(right)) > 1:
+        return left == right
+    if len(left) > len(right):
+        left, right = right, left
+    idx = 0
+    while idx < len(left) and left[idx] == right[idx]:
+        idx += 1
+    if len(left) < len(right):
+        return left[idx:] == right[idx + 1:]
+    return left[idx + 1:] == right[idx + 1:] or (idx + 1 < len(left) and left[idx] == right[idx + 1]
+                                                  and left[idx + 1] == right[idx] and left[idx + 2:] == right[idx + 2:])
+
+
+class SearchIndex:
+    # In-process index over a few text fields of one collection: a sorted term list for prefix lookups and a
+    # one-deletion neighbourhood of the fuzzy fields' terms for typo-tolerant ones. It is built from one projected read on first
+    # use, kept current by this process's insert and delete events, and rebuilt after ttl seconds to pick up
+    # writes made by other processes. Rebuilds read into a fresh index without holding the lock and swap it in,
+    # so searches and event handlers only wait for the swap.
+    def __init__(self, collection_name: str, prefix_fields: List[str], fuzzy_fields: List[str],
+                 label: Callable[[dict], str], ttl: float = 600.0):
+        self.collectionName = collection_name
+        self.prefixFields = prefix_fields
+        self.fuzzyFields = fuzzy_fields
+        self.label = label
+        self.ttl = ttl
+        self._builtAt = None
+        self._generation = 0
+        # Events seen while a build is reading, replayed onto the new index before it is swapped in
+        self._changes = None
+        self._lock = threading.Lock()
+        # Held by whichever thread is building, so there is only ever one build
+        self._buildLock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._sorted = []
+        self._postings = {}
+        self._variants = {}
+        self._fuzzy = set()
+        self._docs = {}
+
+    def _terms(self, doc) -> Dict[str, bool]:
+        # term -> whether it comes from a fuzzy field
+        terms = {}
+        for field in self.prefixFields + self.fuzzyFields:
+            for term in tokens(doc.get(field, "")):
+                terms[term] = terms.get(term, False) or field in self.fuzzyFields
+        return terms
+
+    def _add(self, doc, keep_sorted: bool = True):
+        terms = self._terms(doc)
+        self._docs[doc["_id"]] = (self.label(doc), list(terms))
+        for term, fuzzy in terms.items():
+            if term not in self._postings:
+                self._postings[term] = set()
+                if keep_sorted:
+                    insort(self._sorted, term)
+            self._postings[term].add(doc["_id"])
+            if fuzzy and term not in self._fuzzy:
+                self._fuzzy.add(term)
+                for variant in deletions(term):
+                    self._variants.setdefault(variant, set()).add(term)
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for term in entry[1]:
+            postings = self._postings[term]
+            postings.discard(doc_id)
+            if postings:
+                continue
+            del self._postings[term]
+            del self._sorted[bisect_left(self._sorted, term)]
+            if term in self._fuzzy:
+                self._fuzzy.discard(term)
+                for variant in deletions(term):
+                    self._variants[variant].discard(term)
+
+    def _build(self):
+        # Runs without the lock; the caller holds _buildLock
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+        fresh = SearchIndex(self.collectionName, self.prefixFields, self.fuzzyFields, self.label, self.ttl)
+        try:
+            projection = {field: 1 for field in self.prefixFields + self.fuzzyFields}
+            collection = CollectionManager.GetCollection(self.collectionName).collection
+            for doc in collection.find({}, projection, batch_size=BATCH_SIZE):
+                fresh._add(doc, keep_sorted=False)
+            # Sorted once at the end; inserting each new term in place would make the build quadratic
+            fresh._sorted = sorted(fresh._postings)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            for change in self._changes:
+                change(fresh)
+            self._changes = None
+            self._sorted, self._postings, self._variants = fresh._sorted, fresh._postings, fresh._variants
+            self._fuzzy, self._docs = fresh._fuzzy, fresh._docs
+            # An invalidate() during the read leaves the index to be read again on the next search
+            if generation == self._generation:
+                self._builtAt = time.monotonic()
+
+    def _buildInBackground(self):
+        try:
+            self._build()
+        except Exception as e:
+            print(f"Rebuilding the {self.collectionName} search index failed: {e}")
+        finally:
+            self._buildLock.release()
+
+    def _ensureBuilt(self):
+        with self._lock:
+            built = self._builtAt is not None
+            if built and time.monotonic() - self._builtAt < self.ttl:
+                return
+        if built:
+            # Stale but usable: searches keep answering from it while a fresh one is read
+            if self._buildLock.acquire(blocking=False):
+                threading.Thread(target=self._buildInBackground, name=f"search-{self.collectionName}",
+                                 daemon=True).start()
+            return
+        # Nothing to answer from yet, so the first search waits for the build (or for the one already running)
+        with self._buildLock:
+            with self._lock:
+                built = self._builtAt is not None
+            if not built:
+                self._build()
+
+    def onInsert(self, event):
+        if event.doc is None:
+            return
+        doc = dict(event.doc, _id=event.docId)
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(lambda index: index._add(doc))
+            if self._builtAt is not None:
+                self._add(doc)
+
+    def onDelete(self, event):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(lambda index: index._remove(event.docId))
+            if self._builtAt is not None:
+                self._remove(event.docId)
+
+    def invalidate(self):
+        with self._lock:
+            self._builtAt = None
+            self._generation += 1
+
+    def _prefixMatches(self, token: str) -> Dict[str, int]:
+        # term -> edits; a prefix costs nothing, whatever is left of the term
+        matches = {}
+        start = bisect_left(self._sorted, token)
+        for idx in range(start, min(start + MAX_PREFIX_TERMS, len(self._sorted))):
+            term = self._sorted[idx]
+            if not term.startswith(token):
+                break
+            matches[term] = 0
+        return matches
+
+    def _fuzzyMatches(self, token: str) -> set:
+        # Terms exactly one typo away from the token
+        candidates = set()
+        for variant in deletions(token):
+            candidates.update(self._variants.get(variant, ()))
+        return {term for term in candidates if term != token and oneEdit(token, term)}
+
+    def _matches(self, token: str) -> Dict[str, Tuple[int, int]]:
+        # term -> (cost, length): an exact term costs 0, a prefix 1 and a typo 3; shorter terms are closer
+        matches = {term: (3, len(term)) for term in self._fuzzyMatches(token)} if len(token) >= MIN_FUZZY_LENGTH else {}
+        for term in self._prefixMatches(token):
+            matches[term] = (0 if term == token else 1, len(term))
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        # Every token of the query has to match some term of a document; documents rank by their summed costs
+        query_tokens = tokens(query)
+        if not query_tokens:
+            return []
+
+        self._ensureBuilt()
+        with self._lock:
+            token_matches = [self._matches(token) for token in query_tokens]
+            # Documents are drawn from the token matching the fewest of them, its best terms first, and scored
+            # against the other tokens through their own terms; once the best `limit` are known, the remaining
+            # terms can't beat them and are skipped
+            driver = min(range(len(token_matches)), key=lambda idx: sum(
+                len(self._postings[term]) for term in token_matches[idx]))
+            others = token_matches[:driver] + token_matches[driver + 1:]
+
+            best, seen = [], set()
+            for term, (cost, length) in sorted(token_matches[driver].items(), key=lambda item: item[1]):
+                # Other tokens only add to a document's cost and length, so (cost, length) is the best key it can
+                # reach; once that is no better than the worst kept result, nothing from here on gets in
+                if len(best) == limit and (cost, length) >= (-best[0][0], -best[0][1]):
+                    break
+                for doc_id in self._postings[term]:
+                    if len(best) == limit and (cost, length) >= (-best[0][0], -best[0][1]):
+                        break
+                    if doc_id in seen:
+                        continue
+                    seen.add(doc_id)
+                    total, total_length = cost, length
+                    for matches in others:
+                        keys = [matches[doc_term] for doc_term in self._docs[doc_id][1] if doc_term in matches]
+                        if not keys:
+                            break
+                        total, total_length = total + min(keys)[0], total_length + min(keys)[1]
+                    else:
+                        # Earlier documents win ties, so a full heap only changes for a strictly better one
+                        entry = (-total, -total_length, -len(seen), doc_id)
+                        if len(best) < limit:
+                            heapq.heappush(best, entry)
+                        elif entry > best[0]:
+                            heapq.heapreplace(best, entry)
+
+            return [{"_id": doc_id, "label": self._docs[doc_id][0], "cost": -total}
+                    for total, _, _, doc_id in sorted(best, reverse=True)]
+
+
+INDEXES = {
+    "students": SearchIndex("students", ["email"], ["last_name", "first_name"],
+                            lambda doc: f"{doc.get('last_name')}, {doc.get('first_name')} <{doc.get('email')}>"),
+    "courses": SearchIndex("courses", ["course_number"], ["course_name"],
+                           lambda doc: f"{doc.get('course_number')} {doc.get('course_name')}"),
+}
+
+
+def search(collection_name: str, query: str, limit: int = 10) -> List[dict]:
+    if collection_name not in INDEXES:
+        raise ValueError(f"'{collection_name}' has no search index, use one of {', '.join(INDEXES)}")
+    return INDEXES[collection_name].search(query, limit)
+
+
+def promptSearch(collection_name: str):
+    doc = CollectionManager.GetCollection(collection_name).promptSearch()
+    if doc is not None:
+        pprint(doc)
+
+
+for collection_name, index in INDEXES.items():
+    Base.registerSearch(collection_name, index)
+    Base.subscribe(collection_name, "insert", index.onInsert)
+    Base.subscribe(collection_name, "delete", index.onDelete)
@@ -1,3 +1,4 @@
+import pymongo
 from typing import List, Tuple, Any
 from Base import Base, AttrType
 
@@ -58,11 +59,25 @@ class Section(Base):
                         "maxLength": 80,
                         "description": "The name of the instructor teaching the section"
                     },
+                    "capacity": {
+                        "bsonType": "number",
+                        "minimum": 1,
+                        "description": "The number of seats in the section; sections without it are unlimited"
+                    },
                     "students": {
                         "bsonType": "array",
                         "items": {
                             "bsonType": "objectId"
                         }
+                    },
+                    "enrolled_count": {
+                        "bsonType": "number",
+                        "minimum": 0,
+                        "description": "The number of students in the section, kept in step with students"
+                    },
+                    "report_marked": {
+                        "bsonType": "date",
+                        "description": "When a roster change last made the reports stale, cleared by a refresh"
                     }
                 }
             }
@@ -72,39 +87,91 @@ class Section(Base):
                            ("semester", AttrType.STRING), ("section_year", AttrType.INTEGER),
                            ("building", AttrType.STRING), ("room", AttrType.INTEGER),
                            ("schedule", AttrType.STRING), ("start_time", AttrType.INTEGER),
-                           ("instructor", AttrType.STRING)]
+                           ("instructor", AttrType.STRING), ("capacity", AttrType.INTEGER)]
         self.uniqueCombinations = [[0, 1, 2, 3], [2, 3, 4, 5, 6, 7], [2, 3, 6, 7, 8]]
+        # Sections by course are covered by the first unique index; these find a student's sections and the
+        # sections a report refresh has to pick up
+        self.indexes = [[("students", pymongo.ASCENDING)], [("report_marked", pymongo.ASCENDING)]]
 
     def uniqueAttrAdds(self) -> List[Tuple[str, Any]]:
-        return [("students", [])]
+        return [("students", []), ("enrolled_count", 0)]
 
     def orphanCleanup(self, doc) -> bool:
-        students_count = len(doc["students"])
+        students_count = doc.get("enrolled_count", len(doc["students"]))
         if students_count > 0:
             print(f"{students_count} student(s) are enrolled in this section! Remove them from this section first!")
             return False
 
         return True
 
+    def deletable(self, docs) -> Tuple[List, dict]:
+        refused = {doc["_id"]: "students are enrolled in the section" for doc in docs if doc.get("students")}
+        return [doc for doc in docs if doc["_id"] not in refused], refused
+
     def onValidInsert(self, doc_id):
         print(f"Section added successfully")
 
+    def recountCounters(self):
+        self.collection.update_many({}, [{"$set": {"enrolled_count": {"$size": {"$ifNull": ["$students", []]}}}}])
+
+    @staticmethod
+    def countEnrollment(event):
+        # Set-based writes carry every student they move in student_ids, single ones just student_id
+        count = len(event.details["student_ids"]) if "student_ids" in event.details else 1
+        event.inc("enrolled_count", count if event.name == "enroll" else -count)
+
+    @staticmethod
+    def removeFilter(sect_id, student_id) -> dict:
+        # Only matches while the student is on the roster, so the counter isn't decremented for a no-op $pull
+        return {"_id": sect_id, "students": student_id}
+
+    @staticmethod
+    def seatFilter(sect_id, student_id) -> dict:
+        # Matches the section only while it has a free seat and doesn't already hold the student, which makes
+        # the $push that goes with it an atomic check-and-claim
+        return {
+            "_id": sect_id,
+            "students": {"$ne": student_id},
+            "$or": [
+                {"capacity": {"$exists": False}},
+                {"$expr": {"$lt": [{"$size": {"$ifNull": ["$students", []]}}, "$capacity"]}}
+            ]
+        }
+
     def f_appendStudent(self, sect_id, student_id) -> bool:
+        # Never queued: the filter is the seat check, and the caller needs its answer
+        event = Base.emit(self.collectionName, "enroll", sect_id, student_id=student_id)
         try:
-            self.collection.update_one({"_id": sect_id}, {"$push": {"students": student_id}})
+            result = self.collection.update_one(self.seatFilter(sect_id, student_id),
+                                                event.apply({"$push": {"students": student_id}}))
         except Exception as e:
             print(f"\nError in {self.collectionName}: {str(e)}")
             print("\n\nFailed to append student to section!\n")
             return False
 
+        if result.modified_count == 0:
+            print("\n\nThis section has no seats left!\n")
+            return False
+        self.flushEvents([event])
         return True
 
     def f_removeStudent(self, sect_id, student_id) -> bool:
+        event = Base.emit(self.collectionName, "unenroll", sect_id, student_id=student_id)
+        update = event.apply({"$pull": {"students": student_id}})
+        # Queued removals from one section merge into a single $pull, with enrolled_count recounted on the server
+        if self.queueUpdate({"_id": sect_id}, update, event, recount={"enrolled_count": "students"}):
+            return True
         try:
-            self.collection.update_one({"_id": sect_id}, {"$pull": {"students": student_id}})
+            result = self.collection.update_one(self.removeFilter(sect_id, student_id), update)
         except Exception as e:
             print(f"\nError in {self.collectionName}: {str(e)}")
             print("\n\nFailed to delete student from section!\n")
             return False
 
+        if result.modified_count > 0:
+            self.flushEvents([event])
         return True
+
+
+Base.subscribe("sections", "enroll", Section.countEnrollment)
+Base.subscribe("sections", "unenroll", Section.countEnrollment)
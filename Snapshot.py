@@ -0,0 +1,210 @@
+import json
+import os
+import struct
+from array import array
+from datetime import datetime
+from typing import Dict, List
+import numpy as np
+from bson import ObjectId
+from CollectionManager import CollectionManager
+
+MAGIC = b"ENRSNAP1"
+# Every array starts on a cache-line boundary so memory-mapped views are aligned for any dtype
+ALIGNMENT = 64
+BATCH_SIZE = 10000
+
+# Per-array dtypes; ids are the raw 12 ObjectId bytes, which sort the same way the server sorts _id
+DTYPES = {
+    "department_ids": "S12",
+    "course_ids": "S12", "course_department": np.int32, "course_number": np.int32, "course_units": np.int16,
+    "section_ids": "S12", "section_course": np.int32, "section_semester": np.int16, "section_year": np.int16,
+    "section_capacity": np.int32, "section_instructor": np.int32, "section_building": np.int16,
+    "section_schedule": np.int16, "section_start_time": np.int16,
+    "student_ids": "S12", "student_sections_indptr": np.int64, "student_sections_indices": np.int32,
+    "section_students_indptr": np.int64, "section_students_indices": np.int32,
+}
+
+
+class Codes:
+    # Repeated strings (terms, instructors, buildings) are stored once and referenced by a small integer
+    def __init__(self, values: List = None):
+        self.values = list(values or [])
+        self._index = {value: idx for idx, value in enumerate(self.values)}
+
+    def code(self, value) -> int:
+        if value is None:
+            return -1
+        if value not in self._index:
+            self._index[value] = len(self.values)
+            self.values.append(value)
+        return self._index[value]
+
+
+class Snapshot:
+    # Read-only, array-backed copy of the enrollment graph. Each collection's documents are numbered in _id order;
+    # references are those numbers, and the student <-> section links are CSR adjacency (indptr, indices) in both
+    # directions, so a student's sections are indices[indptr[i]:indptr[i + 1]].
+    def __init__(self, arrays: Dict[str, np.ndarray], codes: Dict[str, List], built: str, dangling: int = 0):
+        self.arrays = arrays
+        self.codes = codes
+        self.built = built
+        self.dangling = dangling
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def count(self, kind: str) -> int:
+        return len(self.arrays[f"{kind}_ids"])
+
+    def index(self, kind: str, doc_id: ObjectId) -> int:
+        ids = self.arrays[f"{kind}_ids"]
+        idx = int(np.searchsorted(ids, doc_id.binary))
+        return idx if idx < len(ids) and self.objectId(kind, idx) == doc_id else -1
+
+    def objectId(self, kind: str, idx: int) -> ObjectId:
+        # NumPy drops trailing zero bytes from fixed-width strings, so they are put back
+        return ObjectId(bytes(self.arrays[f"{kind}_ids"][idx]).ljust(12, b"\0"))
+
+    def sectionsOf(self, student_idx: int) -> np.ndarray:
+        indptr = self.arrays["student_sections_indptr"]
+        return self.arrays["student_sections_indices"][indptr[student_idx]:indptr[student_idx + 1]]
+
+    def studentsOf(self, section_idx: int) -> np.ndarray:
+        indptr = self.arrays["section_students_indptr"]
+        return self.arrays["section_students_indices"][indptr[section_idx]:indptr[section_idx + 1]]
+
+    def summary(self) -> dict:
+        return {"built": self.built, "departments": self.count("department"), "courses": self.count("course"),
+                "sections": self.count("section"), "students": self.count("student"),
+                "enrollments": len(self.arrays["student_sections_indices"]), "dangling": self.dangling,
+                "bytes": sum(arr.nbytes for arr in self.arrays.values())}
+
+    def save(self, path: str) -> str:
+        # Header (array dtypes, shapes and offsets plus the code tables) as JSON, then each array's raw bytes.
+        # Written under a temporary name and renamed, so readers never map a half-written file.
+        layout, offset = {}, 0
+        for name, arr in self.arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+            offset += arr.nbytes
+        header = json.dumps({"built": self.built, "dangling": self.dangling, "codes": self.codes,
+                             "arrays": layout}).encode("utf-8")
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        with open(path + ".tmp", "wb") as out:
+            out.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, arr in self.arrays.items():
+                out.seek(data_start + layout[name]["offset"])
+                out.write(np.ascontiguousarray(arr).tobytes())
+            out.truncate(data_start + offset)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @staticmethod
+    def open(path: str) -> "Snapshot":
+        # Arrays are views of one read-only memory map: opening is instant, pages are read on first touch, and
+        # every process that opens the file shares the same page cache instead of its own copy
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an enrollment snapshot")
+            header_length, = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(header_length))
+        data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {name: np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=mapped,
+                                   offset=data_start + spec["offset"])
+                  for name, spec in header["arrays"].items()}
+        return Snapshot(arrays, header["codes"], header["built"], header.get("dangling", 0))
+
+
+def loadIds(collection, projection: dict):
+    # One pass in _id order with only the needed fields, in large batches
+    return collection.find({}, projection, batch_size=BATCH_SIZE).sort("_id", 1)
+
+
+def build() -> Snapshot:
+    departments = CollectionManager.GetCollection("departments").collection
+    courses = CollectionManager.GetCollection("courses").collection
+    sections = CollectionManager.GetCollection("sections").collection
+    students = CollectionManager.GetCollection("students").collection
+    codes = {name: Codes() for name in ["semester", "instructor", "building", "schedule"]}
+    dangling = 0
+
+    dept_index, dept_ids, abbreviations = {}, [], []
+    for dept in loadIds(departments, {"abbreviation": 1}):
+        dept_index[dept["_id"]] = len(dept_ids)
+        dept_ids.append(dept["_id"].binary)
+        abbreviations.append(dept.get("abbreviation"))
+
+    course_index, course_ids = {}, []
+    course_cols = {name: array("i") for name in ["course_department", "course_number", "course_units"]}
+    for course in loadIds(courses, {"department": 1, "course_number": 1, "units": 1}):
+        course_index[course["_id"]] = len(course_ids)
+        course_ids.append(course["_id"].binary)
+        course_cols["course_department"].append(dept_index.get(course.get("department"), -1))
+        course_cols["course_number"].append(int(course.get("course_number", 0)))
+        course_cols["course_units"].append(int(course.get("units", 0)))
+
+    section_index, section_ids = {}, []
+    section_cols = {name: array("i") for name in ["section_course", "section_semester", "section_year",
+                                                  "section_capacity", "section_instructor", "section_building",
+                                                  "section_schedule", "section_start_time"]}
+    for sect in loadIds(sections, {"course": 1, "semester": 1, "section_year": 1, "capacity": 1, "instructor": 1,
+                                   "building": 1, "schedule": 1, "start_time": 1}):
+        section_index[sect["_id"]] = len(section_ids)
+        section_ids.append(sect["_id"].binary)
+        section_cols["section_course"].append(course_index.get(sect.get("course"), -1))
+        section_cols["section_semester"].append(codes["semester"].code(sect.get("semester")))
+        section_cols["section_year"].append(int(sect.get("section_year", 0)))
+        # -1 marks a section without a capacity, which is unlimited
+        section_cols["section_capacity"].append(int(sect.get("capacity", -1)))
+        section_cols["section_instructor"].append(codes["instructor"].code(sect.get("instructor")))
+        section_cols["section_building"].append(codes["building"].code(sect.get("building")))
+        section_cols["section_schedule"].append(codes["schedule"].code(sect.get("schedule")))
+        section_cols["section_start_time"].append(int(sect.get("start_time", 0)))
+
+    # Students are the big collection, so their links go straight into compact typed arrays
+    student_ids, indptr, indices = [], array("q", [0]), array("i")
+    for stu in loadIds(students, {"sections.section_id": 1}):
+        student_ids.append(stu["_id"].binary)
+        for enr in stu.get("sections", []):
+            sect_idx = section_index.get(enr["section_id"])
+            if sect_idx is None:
+                dangling += 1
+            else:
+                indices.append(sect_idx)
+        indptr.append(len(indices))
+
+    arrays = {"department_ids": np.array(dept_ids, dtype="S12"), "course_ids": np.array(course_ids, dtype="S12"),
+              "section_ids": np.array(section_ids, dtype="S12"), "student_ids": np.array(student_ids, dtype="S12"),
+              "student_sections_indptr": np.frombuffer(indptr, dtype=np.int64),
+              "student_sections_indices": np.frombuffer(indices, dtype=np.int32)}
+    for name, column in list(course_cols.items()) + list(section_cols.items()):
+        arrays[name] = np.frombuffer(column, dtype=np.int32)
+    arrays = {name: arrays[name].astype(dtype, copy=False) for name, dtype in DTYPES.items() if name in arrays}
+
+    # The section -> student direction is the same links sorted by section
+    per_student = np.diff(arrays["student_sections_indptr"])
+    owners = np.repeat(np.arange(len(student_ids), dtype=np.int32), per_student)
+    order = np.argsort(arrays["student_sections_indices"], kind="stable")
+    arrays["section_students_indices"] = owners[order]
+    arrays["section_students_indptr"] = np.concatenate(([0], np.cumsum(np.bincount(
+        arrays["student_sections_indices"], minlength=len(section_ids))))).astype(np.int64)
+
+    code_tables = {name: table.values for name, table in codes.items()}
+    code_tables["department"] = abbreviations
+    return Snapshot({name: arrays[name] for name in DTYPES}, code_tables, datetime.now().isoformat(), dangling)
+
+
+def buildFile(path: str = "enrollment.snap") -> dict:
+    snapshot = build()
+    snapshot.save(path)
+    return snapshot.summary()
+
+
+def promptBuild():
+    path = input("Snapshot file (enter for enrollment.snap) --> ") or "enrollment.snap"
+    summary = buildFile(path)
+    print(f"Wrote {path}: {summary['students']} students, {summary['sections']} sections and "
+          f"{summary['enrollments']} enrollments in {summary['bytes'] / 1e6:.1f} MB.")
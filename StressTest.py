@@ -0,0 +1,103 @@
+import argparse
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Connect import Connect
+from CollectionManager import CollectionManager
+from Department import Department
+from Student import Student
+from Course import Course
+from Section import Section
+
+
+# Registration rush: many workers enroll students into a handful of small sections at once, then both sides
+# of every enrollment are checked for overbooking and for links that only exist on one side.
+def seed(db, n_sections: int, capacity: int, n_students: int):
+    for name in ["departments", "students", "courses", "sections"]:
+        db[name].delete_many({})
+
+    dept_id = db.departments.insert_one({"name": "Stress Test Department", "abbreviation": "STRS",
+                                         "chair_name": "Chair", "building": "ECS", "office": 1,
+                                         "description": "Registration stress test", "majors": [],
+                                         "courses": []}).inserted_id
+    section_ids = []
+    for idx in range(n_sections):
+        course_id = db.courses.insert_one({"department": dept_id, "course_number": 100 + idx,
+                                           "course_name": f"Stress Course {idx}", "description": "stress",
+                                           "units": 3}).inserted_id
+        section_ids.append(db.sections.insert_one({
+            "course": course_id, "section_number": 1, "semester": "Fall", "section_year": 2024,
+            "building": "ECS", "room": idx + 1, "schedule": "MW", "start_time": 800, "instructor": f"I{idx}",
+            "capacity": capacity, "students": [], "enrolled_count": 0}).inserted_id)
+
+    student_ids = db.students.insert_many([{"last_name": f"Student{idx}", "first_name": "Stress",
+                                            "email": f"stress{idx}@example.edu", "majors": [], "sections": []}
+                                           for idx in range(n_students)]).inserted_ids
+    return section_ids, student_ids
+
+
+def run(db, workers: int, n_sections: int, capacity: int, n_students: int, attempts: int) -> bool:
+    section_ids, student_ids = seed(db, n_sections, capacity, n_students)
+    students = CollectionManager.GetCollection("students")
+    rng = random.Random(42)
+    requests = [(rng.choice(student_ids), rng.choice(section_ids)) for _ in range(attempts)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda pair: students.enroll_many([pair])[0], requests))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+
+    ok = True
+    section_side = set()
+    for sect in db.sections.find({"_id": {"$in": section_ids}}, {"students": 1, "capacity": 1, "enrolled_count": 1}):
+        if len(sect["students"]) > sect["capacity"]:
+            print(f"OVERBOOKED: section {sect['_id']} has {len(sect['students'])}/{sect['capacity']} students")
+            ok = False
+        if sect["enrolled_count"] != len(sect["students"]):
+            print(f"MISCOUNTED: section {sect['_id']} counts {sect['enrolled_count']} for "
+                  f"{len(sect['students'])} students")
+            ok = False
+        section_side.update((stu_id, sect["_id"]) for stu_id in sect["students"])
+
+    student_side = {(stu["_id"], enr["section_id"]) for stu in db.students.find({}, {"sections": 1})
+                    for enr in stu["sections"]}
+    if student_side != section_side:
+        print(f"INCONSISTENT: {len(student_side - section_side)} link(s) only on students, "
+              f"{len(section_side - student_side)} only on sections")
+        ok = False
+
+    print(f"{attempts} enrollment attempt(s) by {workers} worker(s) in {elapsed:.2f}s "
+          f"({attempts / elapsed:.0f} attempts/s)")
+    print(f"Results: {statuses}")
+    print(f"Seats filled: {len(section_side)}/{n_sections * capacity}")
+    print("PASS: no overbooking, both sides agree and counters match" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent registration stress test against a local mongod")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--capacity", type=int, default=25)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=5000)
+    parser.add_argument("--database", default="EnrollmentStress")
+    args = parser.parse_args()
+
+    # Defaults to a local server; ENROLLMENT_* settings (e.g. ENROLLMENT_URI) still override it
+    settings = {"mode": "local", "max_pool_size": str(args.workers)}
+    settings.update(Connect.loadSettings())
+    settings["database"] = args.database
+    db = Connect(settings).database()
+
+    CollectionManager.AddCollection("departments", Department(db))
+    CollectionManager.AddCollection("students", Student(db))
+    CollectionManager.AddCollection("courses", Course(db))
+    CollectionManager.AddCollection("sections", Section(db))
+
+    sys.exit(0 if run(db, args.workers, args.sections, args.capacity, args.students, args.attempts) else 1)
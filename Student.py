@@ -1,9 +1,14 @@
-from pprint import pprint
+import pymongo
 from typing import List, Tuple, Any
-from Base import Base, AttrType
+from Base import Base, AttrType, Event
 from Section import Section
+import Timetable
+import Export
+import WriteBehind
 from CollectionManager import CollectionManager
 from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 
 
 class Student(Base):
@@ -104,6 +109,8 @@ class Student(Base):
         self.attributes = [("last_name", AttrType.STRING), ("first_name", AttrType.STRING), ("email", AttrType.STRING),
                            ("majors", AttrType.FOREIGN_ARRAY), ("sections", AttrType.FOREIGN_ARRAY)]
         self.uniqueCombinations = [[0, 1], [2]]
+        # Enrollment pulls and section rosters by section_id, and students per major
+        self.indexes = [[("sections.section_id", pymongo.ASCENDING)], [("majors.name", pymongo.ASCENDING)]]
 
     def uniqueAttrAdds(self) -> List[Tuple[str, Any]]:
         return [("majors", []), ("sections", [])]
@@ -116,6 +123,31 @@ class Student(Base):
 
         return True
 
+    def orphanCleanupMany(self, docs):
+        # Every roster the batch appears on is updated once, removing all of its students from that section
+        sections = CollectionManager.GetCollection("sections")
+        by_section = {}
+        for doc in docs:
+            for enr in doc.get("sections", []):
+                by_section.setdefault(enr["section_id"], set()).add(doc["_id"])
+        if not by_section:
+            return
+
+        events = []
+        operations = []
+        student_ids = list({stu_id for stu_ids in by_section.values() for stu_id in stu_ids})
+        for sect in sections.collection.find({"_id": {"$in": list(by_section)}, "students": {"$in": student_ids}},
+                                             {"students": 1}):
+            on_roster = [stu_id for stu_id in sect["students"] if stu_id in by_section[sect["_id"]]]
+            event = Base.emit("sections", "unenroll", sect["_id"], student_ids=on_roster)
+            operations.append(UpdateOne({"_id": sect["_id"]},
+                                        event.apply({"$pull": {"students": {"$in": on_roster}}})))
+            events.append(event)
+
+        if operations:
+            sections.collection.bulk_write(operations, ordered=False)
+            sections.flushEvents(events)
+
     def onValidInsert(self, doc_id):
         print(f"Student added successfully")
 
@@ -176,12 +208,15 @@ class Student(Base):
                 print("Invalid date format. Please use YYYY-MM-DD.")
 
     def update_student_major(self, student_id, major_name, declaration_date):
-        try:
-            self.collection.update_one(
-                {"_id": student_id},
-                {'$push': {'majors': {"name": major_name, "declaration_date": declaration_date}}}
-            )
+        event = Base.emit(self.collectionName, "update", student_id, pushed={"majors": [major_name]})
+        update = event.apply({'$push': {'majors': {"name": major_name, "declaration_date": declaration_date}}})
+        if self.queueUpdate({"_id": student_id}, update, event):
             return True
+        try:
+            result = self.collection.update_one({"_id": student_id}, update)
+            if result.modified_count > 0:
+                self.flushEvents([event])
+            return result.modified_count > 0
         except Exception as e:
             print(f"Error updating student record: {e}")
             return False
@@ -204,16 +239,23 @@ class Student(Base):
             maj_name = input("Major Name --> ")
 
         try:
-            self.collection.update_one({}, {"$pull": {"majors": {"name": {"$in": [maj_name]}}}})
+            self.removeMajor(student["_id"], maj_name)
         except Exception as e:
             print(f"\nError in {self.collectionName}: {str(e)}")
             print("Failed to remove major from student")
 
+    def removeMajor(self, student_id, major_name) -> bool:
+        event = Base.emit(self.collectionName, "update", student_id, pulled={"majors": [major_name]})
+        result = self.collection.update_one({"_id": student_id, "majors.name": major_name},
+                                            event.apply({"$pull": {"majors": {"name": {"$in": [major_name]}}}}))
+        if result.modified_count > 0:
+            self.flushEvents([event])
+        return result.modified_count > 0
+
     def listStudentMajors(self):
-        for student in self.collection.find({}):
-            print("Student:", student["first_name"], student["last_name"], "has major(s):")
-            for major in student["majors"]:
-                pprint(major)
+        for row in Export.rows("majors"):
+            print(f"{row['first_name']} {row['last_name']}: {row['major']} ({row.get('department')}), "
+                  f"declared {row['declaration_date']:%Y-%m-%d}")
 
     def addEnrollment(self):
         while True:
@@ -229,19 +271,6 @@ class Student(Base):
                 print("No section selected. Aborting Enrollment.")
                 return
 
-            course_id = section["course"]
-            semester = section["semester"]
-            year = section["section_year"]
-            for section_obj in student["sections"]:
-                sect = CollectionManager.GetCollection("sections").collection.find_one(
-                    {"_id": section_obj["section_id"]})
-                if course_id == sect["course"] and semester == sect["semester"] and year == sect["section_year"]:
-                    print("You cannot enroll in multiple sections of the same course during the same semester!")
-                    return
-
-            enrollment = None
-            prop_type = ""
-            prop_name = ""
             print("\nEnroll with PassFail or LetterGrade?"
                   "\n1. PassFail"
                   "\n2. LetterGrade")
@@ -249,35 +278,28 @@ class Student(Base):
             while user_inp != "1" and user_inp != "2":
                 user_inp = input("Invalid input. Try Again.")
             if user_inp == "1":
-                prop_type = "PassFail"
-                prop_name = "application_date"
                 while True:
                     try:
                         date_input = input("Enter the application date (YYYY-MM-DD) --> ")
-                        date = datetime.strptime(date_input, "%Y-%m-%d")
-                        return date
+                        enrollment = {"type": "PassFail",
+                                      "application_date": datetime.strptime(date_input, "%Y-%m-%d")}
+                        break
                     except ValueError:
                         print("Invalid date format. Please use YYYY-MM-DD.")
             else:
-                prop_type = "LetterGrade"
-                prop_name = "min_satisfactory"
                 valid_letters = ['A', 'B', 'C']
                 print("Select A Minimum Satisfactory Grade: ", valid_letters)
                 grade = input("--> ")
                 while grade not in valid_letters:
                     print("Invalid grade. Please choose from " + ", ".join(valid_letters))
                     grade = input("--> ")
-                enrollment = grade
+                enrollment = {"type": "LetterGrade", "min_satisfactory": grade}
 
-            try:
-                self.collection.update_one({"_id": student["_id"]}, {'$push': {'sections': {"section_id": section["_id"]
-                    , "enrollment": {"type": prop_type, prop_name: enrollment}}}})
-                success = CollectionManager.GetCollection("sections").f_appendStudent(section["_id"], student["_id"])
-                if not success:
-                    raise Exception
-            except Exception as e:
-                print(f"\nError in {self.collectionName}: {str(e)}")
-                print("Failed to enroll in section\n")
+            result = self.enroll_many([(student["_id"], section["_id"], enrollment)])[0]
+            if result["status"] == "enrolled":
+                print("Student enrolled successfully!")
+            else:
+                print(f"Failed to enroll in section: {result['message']}\n")
 
             print("Add another Enrollment? [y/n]")
             y_n_input = input("> ")
@@ -289,6 +311,171 @@ class Student(Base):
             if y_n_input == 'n':
                 break
 
+    def enroll_many(self, pairs, enrollment=None, batch_size: int = 1000) -> List[dict]:
+        # Pairs are (student_id, section_id) or (student_id, section_id, enrollment). Returns one result per
+        # pair, in order, with a status of "enrolled", "conflict", "full", "not_found" or "error".
+        if enrollment is None:
+            enrollment = {"type": "LetterGrade", "min_satisfactory": "C"}
+
+        results = []
+        pairs = list(pairs)
+        for start in range(0, len(pairs), batch_size):
+            results.extend(self._enrollBatch(pairs[start:start + batch_size], enrollment))
+        return results
+
+    def _enrollBatch(self, pairs, default_enrollment) -> List[dict]:
+        sections = CollectionManager.GetCollection("sections").collection
+        results = self.enrollmentResults(pairs, default_enrollment)
+
+        students = {stu["_id"]: stu for stu in self.collection.find(
+            {"_id": {"$in": list({res["student_id"] for res in results})}}, {"sections": 1})}
+        section_docs = {sect["_id"]: sect for sect in sections.find(
+            {"_id": {"$in": self.sectionIdsInvolved(results, students)}}, Timetable.SECTION_FIELDS)}
+
+        accepted = self.checkEnrollments(results, students, section_docs)
+        if not accepted:
+            return results
+
+        # Seats are claimed first with updates that only match while the section has room, so concurrent
+        # registrations can't overbook; which claims landed is read back with one aggregation. Removals still
+        # waiting in the write-behind queue are sent first, or the claims would count seats already given up
+        WriteBehind.flush("sections", list({res["section_id"] for res in accepted}))
+        claim_events = self.sectionEvents(accepted, "enroll")
+        try:
+            sections.bulk_write(self.seatClaims(accepted, claim_events), ordered=False)
+        except PyMongoError:
+            # Claims that did land are found by the read-back below like any other
+            pass
+        seated = {sect["_id"]: set(sect["students"]) for sect in sections.aggregate(self.seatedPipeline(accepted))}
+        landed = self.landedEvents(accepted, claim_events, seated)
+
+        # Student side in an ordered batch, which stops at the first failure so everything after it is untouched
+        student_groups = self.studentGroups(self.markClaimed(accepted, seated))
+        failed_from = self._orderedBulk(self.collection, self.studentPushes(student_groups))
+
+        # Give back the seats of anything the student side didn't take so both sides stay in sync
+        undo = [res for group in student_groups[failed_from:] for res in group]
+        release_events = self.sectionEvents(undo, "unenroll")
+        if undo:
+            sections.bulk_write(self.seatReleases(undo, release_events), ordered=False)
+            for res in undo:
+                res["status"], res["message"] = "error", "Failed to add the section to the student"
+
+        self.flushEvents(landed + release_events)
+        return results
+
+    # The steps below hold the enrollment rules without doing any I/O, so the async service layer runs
+    # exactly the same checks
+
+    @staticmethod
+    def enrollmentResults(pairs, default_enrollment) -> List[dict]:
+        return [{"student_id": pair[0], "section_id": pair[1],
+                 "enrollment": pair[2] if len(pair) > 2 else default_enrollment,
+                 "status": "enrolled", "message": ""} for pair in pairs]
+
+    @staticmethod
+    def sectionIdsInvolved(results, students) -> List:
+        section_ids = {res["section_id"] for res in results}
+        section_ids.update(enr["section_id"] for stu in students.values() for enr in stu.get("sections", []))
+        return list(section_ids)
+
+    @staticmethod
+    def checkEnrollments(results, students, section_docs) -> List[dict]:
+        def term_key(stu_id, sect):
+            return stu_id, sect["course"], sect["semester"], sect["section_year"]
+
+        taken = set()
+        for stu in students.values():
+            for enr in stu.get("sections", []):
+                if enr["section_id"] in section_docs:
+                    taken.add(term_key(stu["_id"], section_docs[enr["section_id"]]))
+        timetables = Timetable.TimetableIndex(section_docs)
+
+        accepted = []
+        for res in results:
+            sect = section_docs.get(res["section_id"])
+            if res["student_id"] not in students:
+                res["status"], res["message"] = "not_found", "student does not exist"
+            elif sect is None:
+                res["status"], res["message"] = "not_found", "section does not exist"
+            elif term_key(res["student_id"], sect) in taken:
+                res["status"] = "conflict"
+                res["message"] = "You cannot enroll in multiple sections of the same course during the same semester!"
+            elif timetables.conflicts(students[res["student_id"]], sect):
+                res["status"] = "conflict"
+                res["message"] = "This section meets at the same time as another section in the student's schedule!"
+            else:
+                taken.add(term_key(res["student_id"], sect))
+                timetables.add(students[res["student_id"]], sect)
+                accepted.append(res)
+        return accepted
+
+    @staticmethod
+    def sectionEvents(results, event_name: str) -> List[Event]:
+        return [Base.emit("sections", event_name, res["section_id"], student_id=res["student_id"])
+                for res in results]
+
+    @staticmethod
+    def seatClaims(accepted, events) -> List[UpdateOne]:
+        return [UpdateOne(Section.seatFilter(res["section_id"], res["student_id"]),
+                          event.apply({"$push": {"students": res["student_id"]}}))
+                for res, event in zip(accepted, events)]
+
+    @staticmethod
+    def seatedPipeline(accepted) -> List[dict]:
+        student_ids = list({res["student_id"] for res in accepted})
+        return [{"$match": {"_id": {"$in": list({res["section_id"] for res in accepted})}}},
+                {"$project": {"students": {"$filter": {"input": {"$ifNull": ["$students", []]}, "as": "stu",
+                                                       "cond": {"$in": ["$$stu", student_ids]}}}}}]
+
+    @staticmethod
+    def markClaimed(accepted, seated) -> List[dict]:
+        claimed = []
+        for res in accepted:
+            if res["student_id"] in seated.get(res["section_id"], ()):
+                claimed.append(res)
+            else:
+                res["status"], res["message"] = "full", "This section has no seats left!"
+        return claimed
+
+    @staticmethod
+    def landedEvents(accepted, events, seated) -> List[Event]:
+        return [event for res, event in zip(accepted, events)
+                if res["student_id"] in seated.get(res["section_id"], ())]
+
+    @staticmethod
+    def studentGroups(claimed) -> List[List[dict]]:
+        by_student = {}
+        for res in claimed:
+            by_student.setdefault(res["student_id"], []).append(res)
+        return list(by_student.values())
+
+    @staticmethod
+    def studentPushes(student_groups) -> List[UpdateOne]:
+        return [UpdateOne({"_id": group[0]["student_id"]}, {"$push": {"sections": {"$each": [
+            {"section_id": res["section_id"], "enrollment": res["enrollment"]} for res in group]}}})
+            for group in student_groups]
+
+    @staticmethod
+    def seatReleases(undo, events) -> List[UpdateOne]:
+        return [UpdateOne(Section.removeFilter(res["section_id"], res["student_id"]),
+                          event.apply({"$pull": {"students": res["student_id"]}}))
+                for res, event in zip(undo, events)]
+
+    @staticmethod
+    def _orderedBulk(collection, operations) -> int:
+        # Returns how many operations were applied before the first failure
+        if not operations:
+            return 0
+        try:
+            collection.bulk_write(operations, ordered=True)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            return errors[0]["index"] if errors else 0
+        except PyMongoError:
+            return 0
+        return len(operations)
+
     def deleteEnrollment(self):
         while True:
             print("Select the student to unenroll")
@@ -311,26 +498,31 @@ class Student(Base):
 
             if user_input == 'y':
                 try:
-                    update_result = self.collection.update_one(
-                        {"_id": student["_id"]},
-                        {"$pull": {"sections": {"section_id": section["_id"]}}}
-                    )
-                    if update_result.modified_count == 0:
+                    if not self.unenroll(student["_id"], section["_id"]):
                         print("No updates made, possibly the student was not enrolled in the section.")
                         return
 
-                    success = CollectionManager.GetCollection("sections").f_removeStudent(section["_id"],
-                                                                                          student["_id"])
-                    if not success:
-                        raise Exception("Failed to remove student from section in section collection.")
-
                     print("Student unenrolled successfully!")
                 except Exception as e:
                     print(f"\nError in {self.collectionName}: {str(e)}")
                     print("Failed to un-enroll in section.")
 
+    def unenroll(self, student_id, section_id) -> bool:
+        update_result = self.collection.update_one(
+            {"_id": student_id},
+            {"$pull": {"sections": {"section_id": section_id}}}
+        )
+        if update_result.modified_count == 0:
+            return False
+
+        success = CollectionManager.GetCollection("sections").f_removeStudent(section_id, student_id)
+        if not success:
+            raise Exception("Failed to remove student from section in section collection.")
+        return True
+
     def listEnrollments(self):
-        for stu in self.collection.find({}):
-            print("Student:", stu["first_name"], stu["last_name"], "has enrollments:")
-            for enr in stu["sections"]:
-                pprint(enr)
+        # Same rows as the enrollments export, so sections show up as courses and terms instead of ObjectIds
+        for row in Export.rows("enrollments"):
+            print(f"{row['first_name']} {row['last_name']}: {row.get('department')} {row.get('course_number')} "
+                  f"section {row.get('section_number')}, {row.get('semester')} {row.get('section_year')} "
+                  f"({row['enrollment_type']})")
@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from typing import List, Tuple, Dict
+from CollectionManager import CollectionManager
+
+DAY_OFFSETS = {"M": 0, "Tu": 1, "W": 2, "Th": 3, "F": 4, "S": 5}
+SCHEDULE_DAYS = {"MW": ["M", "W"], "TuTh": ["Tu", "Th"], "MWF": ["M", "W", "F"], "F": ["F"], "S": ["S"]}
+
+# Sections only store when they start, so each schedule gets the usual block length for its meeting pattern
+MEETING_MINUTES = {"MW": 75, "TuTh": 75, "MWF": 50, "F": 165, "S": 165}
+
+SECTION_FIELDS = {"course": 1, "semester": 1, "section_year": 1, "schedule": 1, "start_time": 1}
+
+
+def meetings(section) -> List[Tuple[int, int]]:
+    # Each meeting as [start, end) in minutes from Monday 00:00, so one sorted list covers the whole week
+    schedule = section.get("schedule")
+    start_time = section.get("start_time")
+    if schedule not in SCHEDULE_DAYS or start_time is None:
+        return []
+
+    start = (int(start_time) // 100) * 60 + int(start_time) % 100
+    return [(DAY_OFFSETS[day] * 1440 + start, DAY_OFFSETS[day] * 1440 + start + MEETING_MINUTES[schedule])
+            for day in SCHEDULE_DAYS[schedule]]
+
+
+def term(section) -> Tuple[str, int]:
+    return section.get("semester"), section.get("section_year")
+
+
+class Timetable:
+    # One student's meetings in one term, sorted by start, with the latest end time seen up to each position.
+    # Timetables built from enrollments made before overlaps were refused may already overlap, so a new meeting
+    # is checked against every earlier meeting still running at its start (found by walking back until the
+    # running maximum end is no later than the start) and every later one starting before its end. On a
+    # non-overlapping timetable both walks stop at the neighbours, so each check is still a binary search.
+    def __init__(self):
+        self._starts = []
+        self._meetings = []
+        self._maxEnds = []
+
+    def conflicts(self, section) -> set:
+        clashes = set()
+        for start, end in meetings(section):
+            idx = bisect_left(self._starts, start)
+            before = idx - 1
+            while before >= 0 and self._maxEnds[before] > start:
+                if self._meetings[before][1] > start:
+                    clashes.add(self._meetings[before][2])
+                before -= 1
+            after = idx
+            while after < len(self._starts) and self._starts[after] < end:
+                clashes.add(self._meetings[after][2])
+                after += 1
+        return clashes
+
+    def add(self, section):
+        for start, end in meetings(section):
+            idx = bisect_left(self._starts, start)
+            self._starts.insert(idx, start)
+            self._meetings.insert(idx, (start, end, section["_id"]))
+            self._maxEnds.insert(idx, 0)
+            running = self._maxEnds[idx - 1] if idx > 0 else 0
+            for pos in range(idx, len(self._meetings)):
+                running = max(running, self._meetings[pos][1])
+                self._maxEnds[pos] = running
+
+
+class TimetableIndex:
+    # Timetables per (student, term), built lazily from the section documents an enrollment batch already read
+    def __init__(self, section_docs: Dict):
+        self.sectionDocs = section_docs
+        self._timetables = {}
+
+    def timetable(self, student) -> Dict:
+        if student["_id"] not in self._timetables:
+            by_term = {}
+            for enr in student.get("sections", []):
+                sect = self.sectionDocs.get(enr["section_id"])
+                if sect is not None:
+                    by_term.setdefault(term(sect), Timetable()).add(sect)
+            self._timetables[student["_id"]] = by_term
+        return self._timetables[student["_id"]]
+
+    def conflicts(self, student, section) -> set:
+        timetable = self.timetable(student).get(term(section))
+        return timetable.conflicts(section) if timetable is not None else set()
+
+    def add(self, student, section):
+        self.timetable(student).setdefault(term(section), Timetable()).add(section)
+
+
+def conflictReport(batch_size: int = 1000) -> List[dict]:
+    # Sections are small and read once; students are streamed, so memory is bounded by the section catalog
+    sections = CollectionManager.GetCollection("sections").collection
+    students = CollectionManager.GetCollection("students").collection
+    section_docs = {sect["_id"]: sect for sect in sections.find({}, SECTION_FIELDS, batch_size=batch_size)}
+
+    report = []
+    for student in students.find({"sections.1": {"$exists": True}},
+                                 {"first_name": 1, "last_name": 1, "sections.section_id": 1},
+                                 batch_size=batch_size):
+        by_term = {}
+        for enr in student["sections"]:
+            sect = section_docs.get(enr["section_id"])
+            if sect is not None:
+                by_term.setdefault(term(sect), []).extend(
+                    (start, end, sect["_id"]) for start, end in meetings(sect))
+
+        for (semester, year), week in by_term.items():
+            # Sweep in start order, keeping the meetings still running; each new meeting overlaps all of them
+            week.sort()
+            reported = set()
+            running = []
+            for start, end, sect_id in week:
+                running = [(run_end, run_id) for run_end, run_id in running if run_end > start]
+                for _, run_id in running:
+                    pair = tuple(sorted([run_id, sect_id]))
+                    if run_id != sect_id and pair not in reported:
+                        reported.add(pair)
+                        report.append({"student_id": student["_id"],
+                                       "student": f"{student['last_name']}, {student['first_name']}",
+                                       "semester": semester, "section_year": year, "sections": list(pair)})
+                running.append((end, sect_id))
+    return report
+
+
+def printConflictReport():
+    report = conflictReport()
+    for conflict in report:
+        print(f"{conflict['student']} ({conflict['semester']} {conflict['section_year']}): "
+              f"sections {conflict['sections'][0]} and {conflict['sections'][1]} overlap")
+    print(f"\n{len(report)} timetable conflict(s) found.")
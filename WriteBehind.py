@@ -0,0 +1,297 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from CollectionManager import CollectionManager
+
+# Follow-up updates (back-references and their counters) wait here and go out as unordered bulk_writes, one per
+# collection, instead of a round trip each. A flush happens once BATCH_SIZE updates are waiting, every INTERVAL
+# seconds, or when asked for.
+BATCH_SIZE = 500
+INTERVAL = 0.2
+FAILURE_LOG = "write_behind_failures.jsonl"
+# What an update sent as a recount pipeline can hold
+RECOUNTED_OPERATORS = {"$pull", "$set"}
+
+
+def conflicting(left: str, right: str) -> bool:
+    return left == right or left.startswith(right + ".") or right.startswith(left + ".")
+
+
+def eachValues(value) -> Optional[list]:
+    # The values a $push/$addToSet adds, or None when it has modifiers ($position, $slice, ...) that don't add up
+    if isinstance(value, dict) and "$each" in value:
+        return list(value["$each"]) if len(value) == 1 else None
+    return [value]
+
+
+def pullValues(value) -> Optional[list]:
+    # The values a $pull removes, or None when it is a condition ({"$gt": ...}, a subdocument match) rather than
+    # a list of values
+    if isinstance(value, dict):
+        return list(value["$in"]) if list(value) == ["$in"] else None
+    return [value]
+
+
+def mergeUpdates(first: dict, second: dict) -> Optional[dict]:
+    # One update with the effect of first then second, or None when a single update can't express that (the
+    # same field under two operators, or a repeated operator that doesn't combine)
+    merged = {operator: dict(fields) for operator, fields in first.items()}
+    touched = {field: operator for operator, fields in first.items() for field in fields}
+    for operator, fields in second.items():
+        target = merged.setdefault(operator, {})
+        for field, value in fields.items():
+            if any(conflicting(field, other) and touched[other] != operator for other in touched):
+                return None
+            touched[field] = operator
+            if field not in target:
+                target[field] = value
+                continue
+            match operator:
+                case "$inc":
+                    target[field] += value
+                case "$set":
+                    target[field] = value
+                case "$push" | "$addToSet":
+                    current, added = eachValues(target[field]), eachValues(value)
+                    if current is None or added is None:
+                        return None
+                    target[field] = {"$each": current + added}
+                case "$pull":
+                    current, added = pullValues(target[field]), pullValues(value)
+                    if current is None or added is None:
+                        return None
+                    target[field] = {"$in": current + added}
+                case _:
+                    return None
+    return merged
+
+
+def recountPipeline(update: dict, recount: dict) -> List[dict]:
+    # A queued removal as a pipeline update: the $pull as a $filter, then each counter set to the size of its
+    # array, so however many removals were merged (and whether or not each value was there) the count is exact
+    stages = []
+    if "$set" in update:
+        stages.append({"$set": {field: {"$literal": value} for field, value in update["$set"].items()}})
+    if "$pull" in update:
+        stages.append({"$set": {field: {"$filter": {"input": {"$ifNull": [f"${field}", []]},
+                                                    "cond": {"$not": [{"$in": ["$$this", pullValues(value)]}]}}}
+                                for field, value in update["$pull"].items()}})
+    counts = {counter: {"$size": {"$ifNull": [f"${field}", []]}} for counter, field in recount.items()}
+    return stages + [{"$set": counts}]
+
+
+class PendingWrite:
+    def __init__(self, collection_name: str, doc_id, doc_filter: dict, update: dict, event=None,
+                 recount: Optional[dict] = None):
+        self.collectionName = collection_name
+        self.docId = doc_id
+        self.filter = doc_filter
+        self.update = update
+        # counter -> array it counts, recomputed on the server instead of adjusted with $inc
+        self.recount = dict(recount or {})
+        self.events = [event] if event is not None else []
+
+    def merge(self, doc_filter: dict, update: dict, event=None, recount: Optional[dict] = None) -> bool:
+        # Only plain {_id} updates merge: a conditional filter is a check that has to run on its own
+        if self.filter != {"_id": self.docId} or doc_filter != self.filter:
+            return False
+        merged = mergeUpdates(self.update, update)
+        if merged is None or (recount or self.recount) and not set(merged) <= RECOUNTED_OPERATORS:
+            return False
+        self.update = merged
+        self.recount.update(recount or {})
+        if event is not None:
+            self.events.append(event)
+        return True
+
+    def operation(self) -> UpdateOne:
+        return UpdateOne(self.filter, recountPipeline(self.update, self.recount) if self.recount else self.update)
+
+
+class WriteBehindQueue:
+    # Waiting writes are kept in rounds. A document's next write merges into its pending one when it can and
+    # otherwise goes into the round after it, so each round is a set of independent writes that can be sent
+    # unordered while every document still sees its own writes in order.
+    def __init__(self, batch_size: int = BATCH_SIZE, interval: float = INTERVAL, failure_log: str = FAILURE_LOG):
+        self.batchSize = batch_size
+        self.interval = interval
+        self.failureLog = failure_log
+        self.counts = {"queued": 0, "merged": 0, "sent": 0, "batches": 0, "failed": 0}
+        self._rounds = []
+        self._latest = {}
+        self._waiting = 0
+        self._lock = threading.Lock()
+        # Held for a whole flush, so batches land in the order they were queued
+        self._flushLock = threading.RLock()
+        self._stopped = threading.Event()
+        self._timer = threading.Thread(target=self._flushPeriodically, name="write-behind", daemon=True)
+        self._timer.start()
+
+    def add(self, collection_name: str, doc_filter: dict, update: dict, event=None, recount: Optional[dict] = None):
+        # recount ({counter: array}) is for $pull removals whose counter is recomputed rather than decremented,
+        # so the event's $inc of it is left out
+        if recount:
+            incs = {field: amount for field, amount in update.get("$inc", {}).items() if field not in recount}
+            update = {operator: fields for operator, fields in update.items() if operator != "$inc"}
+            if incs or not set(update) <= RECOUNTED_OPERATORS:
+                raise ValueError("only $pull and $set updates can be queued with a recount")
+        key = (collection_name, doc_filter["_id"])
+        with self._lock:
+            self.counts["queued"] += 1
+            idx = self._latest.get(key)
+            if idx is not None and self._rounds[idx][key].merge(doc_filter, update, event, recount):
+                self.counts["merged"] += 1
+                return
+            idx = 0 if idx is None else idx + 1
+            if idx == len(self._rounds):
+                self._rounds.append({})
+            self._rounds[idx][key] = PendingWrite(collection_name, doc_filter["_id"], doc_filter, update, event,
+                                                  recount)
+            self._latest[key] = idx
+            self._waiting += 1
+            full = self._waiting >= self.batchSize
+        if full:
+            self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._waiting
+
+    def flush(self) -> dict:
+        with self._flushLock:
+            with self._lock:
+                rounds, self._rounds, self._latest, self._waiting = self._rounds, [], {}, 0
+            self._sendRounds(rounds)
+        return dict(self.counts)
+
+    def flushDocuments(self, collection_name: str, doc_ids) -> dict:
+        # Sends only what is waiting for these documents, in order, for a caller about to read them
+        with self._flushLock:
+            with self._lock:
+                rounds = []
+                for doc_id in doc_ids:
+                    key = (collection_name, doc_id)
+                    if self._latest.pop(key, None) is None:
+                        continue
+                    for idx, writes in enumerate(self._rounds):
+                        if key in writes:
+                            while len(rounds) <= idx:
+                                rounds.append({})
+                            rounds[idx][key] = writes.pop(key)
+                            self._waiting -= 1
+            self._sendRounds(rounds)
+        return dict(self.counts)
+
+    def _sendRounds(self, rounds: List[dict]):
+        for writes in rounds:
+            by_collection = {}
+            for write in writes.values():
+                by_collection.setdefault(write.collectionName, []).append(write)
+            for collection_name, batch in by_collection.items():
+                self._send(collection_name, batch)
+
+    def _send(self, collection_name: str, batch: List[PendingWrite]):
+        target = CollectionManager.GetCollection(collection_name)
+        failed = {}
+        try:
+            target.collection.bulk_write([write.operation() for write in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error.get("errmsg", "write error") for error in e.details["writeErrors"]}
+        except PyMongoError as e:
+            failed = {idx: str(e) for idx in range(len(batch))}
+        self.counts["batches"] += 1
+        self.counts["sent"] += len(batch) - len(failed)
+
+        for write in batch:
+            target.invalidate(write.docId)
+        for idx, error in failed.items():
+            self._recordFailure(batch[idx], error)
+        # Side writes can carry counters of other documents (a student's major update adds to the major's
+        # student_count), so they only go out for writes that found their document. Every queued filter is a
+        # plain {_id}, so that is the documents that still exist; bulk_write doesn't say which updates matched
+        sent = [write for idx, write in enumerate(batch) if idx not in failed and write.events]
+        existing = set(target.collection.distinct("_id", {"_id": {"$in": [write.docId for write in sent]}})
+                       if sent else [])
+        for write in sent:
+            if write.docId not in existing:
+                self._recordFailure(write, "matched no document, its events were dropped")
+        events = [event for write in sent if write.docId in existing for event in write.events]
+        if events:
+            try:
+                target.flushEvents(events)
+            except PyMongoError as e:
+                for idx, write in enumerate(batch):
+                    if idx not in failed:
+                        self._recordFailure(write, f"side writes: {e}")
+
+    def _recordFailure(self, write: PendingWrite, error: str):
+        # Appended to a JSON lines file, one line per lost write, with enough to replay it by hand
+        self.counts["failed"] += 1
+        line = json_util.dumps({"failed": datetime.now(), "collection": write.collectionName,
+                                "filter": write.filter, "update": write.update, "error": error})
+        with open(self.failureLog, "a", encoding="utf-8") as log:
+            log.write(line + "\n")
+
+    def _flushPeriodically(self):
+        while not self._stopped.wait(self.interval):
+            if self.pending():
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Write-behind flush failed: {e}")
+
+    def close(self) -> dict:
+        self._stopped.set()
+        self._timer.join()
+        return self.flush()
+
+
+_queue = None
+_local = threading.local()
+
+
+def start(batch_size: int = BATCH_SIZE, interval: float = INTERVAL, failure_log: str = FAILURE_LOG) -> WriteBehindQueue:
+    global _queue
+    if _queue is None:
+        _queue = WriteBehindQueue(batch_size, interval, failure_log)
+    return _queue
+
+
+def stop() -> dict:
+    global _queue
+    if _queue is None:
+        return {}
+    queue, _queue = _queue, None
+    return queue.close()
+
+
+def active() -> Optional[WriteBehindQueue]:
+    # The queue writes should go through, or None when they should go straight to the database
+    if getattr(_local, "synchronous", 0):
+        return None
+    return _queue
+
+
+def flush(collection_name: Optional[str] = None, doc_ids=None) -> dict:
+    # Everything waiting, or only what is waiting for doc_ids of collection_name
+    if _queue is None:
+        return {}
+    if collection_name is None:
+        return _queue.flush()
+    return _queue.flushDocuments(collection_name, doc_ids)
+
+
+@contextmanager
+def synchronous():
+    # For callers that need to read their own writes: whatever is queued is flushed first, and writes made
+    # inside the block on this thread bypass the queue
+    flush()
+    _local.synchronous = getattr(_local, "synchronous", 0) + 1
+    try:
+        yield
+    finally:
+        _local.synchronous -= 1
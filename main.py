@@ -1,29 +1,82 @@
 from Connect import Connect
-from menu_definitions import menu_main, menu_add, menu_select, menu_list, menu_delete
+from Menu import Menu
+from menu_definitions import menu_main
 from CollectionManager import CollectionManager
 from Department import Department
 from Student import Student
 from Course import Course
 from Section import Section
-from pprint import pprint
+from IndexAdvisor import printAdvice
+import Commands
+import Reporting
+import IntegrityChecker
+import Instrumentation
+import WriteBehind
+import argparse
+import atexit
+import sys
 
 
 def exec_menu(menu):
-    user_action: str = ""
+    user_action = ""
     while user_action != menu.last_action():
         user_action = menu.menu_prompt()
         print("")
-        exec(user_action)
+        if isinstance(user_action, Menu):
+            exec_menu(user_action)
+        elif user_action is not None:
+            Commands.prompt(user_action)
         print("")
 
 
+def run_batch(args) -> bool:
+    parser = argparse.ArgumentParser(prog="main.py batch",
+                                     description="Run JSONL operations ({\"command\": ..., \"args\": {...}}) "
+                                                 "without prompts, printing one JSON result per line")
+    parser.add_argument("file", nargs="?", default="-", help="command file, or - for stdin")
+    parser.add_argument("--workers", type=int, default=1)
+    options = parser.parse_args(args)
+
+    if options.file == "-":
+        return Commands.runBatch(sys.stdin, options.workers)
+    with open(options.file, encoding="utf-8") as lines:
+        return Commands.runBatch(lines, options.workers)
+
+
 if __name__ == "__main__":
     clientMgr = Connect()
-    clientMgr.connectClient()
-    db = clientMgr.client["Enrollment"]
-    CollectionManager.AddCollection("departments", Department(db))
-    CollectionManager.AddCollection("students", Student(db))
-    CollectionManager.AddCollection("courses", Course(db))
-    CollectionManager.AddCollection("sections", Section(db))
+    db = clientMgr.database()
+    # Built on first use, so a one-off command only sets up the collections it touches
+    CollectionManager.RegisterCollection("departments", lambda: Department(db))
+    CollectionManager.RegisterCollection("students", lambda: Student(db))
+    CollectionManager.RegisterCollection("courses", lambda: Course(db), ["departments"])
+    CollectionManager.RegisterCollection("sections", lambda: Section(db), ["courses"])
+    if clientMgr.instrumented:
+        Instrumentation.instrument(Department, Student, Course, Section)
+        # Written however the run ends, so a batch job leaves its numbers behind for the scraper
+        atexit.register(Instrumentation.writeMetrics, clientMgr.settings.get("metrics_file", "enrollment_metrics.prom"))
+    if clientMgr.writeBehind:
+        WriteBehind.start(int(clientMgr.settings.get("write_behind_batch", WriteBehind.BATCH_SIZE)),
+                          int(clientMgr.settings.get("write_behind_interval_ms", WriteBehind.INTERVAL * 1000)) / 1000,
+                          clientMgr.settings.get("write_behind_failures", WriteBehind.FAILURE_LOG))
+        # Registered after the metrics writer, so it runs first and the final flush is counted
+        atexit.register(WriteBehind.stop)
+
+    if sys.argv[1:] == ["migrate"]:
+        for name in ["departments", "students", "courses", "sections"]:
+            CollectionManager.GetCollection(name).migrate()
+        sys.exit(0)
+    if sys.argv[1:] == ["advise"]:
+        printAdvice()
+        sys.exit(0)
+    if sys.argv[1:2] == ["reports"]:
+        counts = Reporting.refresh(full="--full" in sys.argv[2:])
+        print(f"Refreshed {counts['terms']} term(s) and {counts['departments']} department(s).")
+        sys.exit(0)
+    if sys.argv[1:2] == ["check"]:
+        print(IntegrityChecker.IntegrityChecker(repair="--repair" in sys.argv[2:]).run())
+        sys.exit(0)
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(0 if run_batch(sys.argv[2:]) else 1)
 
     exec_menu(menu_main)
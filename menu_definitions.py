@@ -1,50 +1,71 @@
 from Menu import Menu, Option
 
-menu_main = Menu('main', 'Select Option:', [
-    Option("Add", "exec_menu(menu_add)"),
-    Option("Select", "exec_menu(menu_select)"),
-    Option("List", "exec_menu(menu_list)"),
-    Option("Delete", "exec_menu(menu_delete)"),
-    Option("Exit this application", "pass")
-])
+# Actions are command names from Commands.COMMANDS, a submenu, or None to leave the menu
 
 menu_add = Menu('add', 'Select Collection To Add:', [
-    Option("Departments", "CollectionManager.GetCollection('departments').addDoc()"),
-    Option("Majors", "CollectionManager.GetCollection('departments').addMajor()"),
-    Option("Students", "CollectionManager.GetCollection('students').addDoc()"),
-    Option("Courses", "CollectionManager.GetCollection('courses').addDoc()"),
-    Option("Sections", "CollectionManager.GetCollection('sections').addDoc()"),
-    Option("StudentMajors", "CollectionManager.GetCollection('students').addMajor()"),
-    Option("Enrollments", "CollectionManager.GetCollection('students').addEnrollment()"),
-    Option("Exit", "pass")
+    Option("Departments", "departments.add"),
+    Option("Majors", "majors.add"),
+    Option("Students", "students.add"),
+    Option("Courses", "courses.add"),
+    Option("Sections", "sections.add"),
+    Option("StudentMajors", "studentMajors.add"),
+    Option("Enrollments", "enrollments.add"),
+    Option("Bulk Import", "import"),
+    Option("Exit", None)
 ])
 
 menu_select = Menu('select', 'Select Collection To Select:', [
-    Option("Departments", "pprint(CollectionManager.GetCollection('departments').selectDoc())"),
-    Option("Students", "pprint(CollectionManager.GetCollection('students').selectDoc())"),
-    Option("Courses", "pprint(CollectionManager.GetCollection('courses').selectDoc())"),
-    Option("Sections", "pprint(CollectionManager.GetCollection('sections').selectDoc())"),
-    Option("Exit", "pass")
+    Option("Departments", "departments.get"),
+    Option("Students", "students.get"),
+    Option("Courses", "courses.get"),
+    Option("Sections", "sections.get"),
+    Option("Search Students", "students.search"),
+    Option("Search Courses", "courses.search"),
+    Option("Exit", None)
 ])
 
 menu_list = Menu('list', 'Select Collection To List:', [
-    Option("Departments", "CollectionManager.GetCollection('departments').listAll()"),
-    Option("Majors", "CollectionManager.GetCollection('departments').listMajors()"),
-    Option("Students", "CollectionManager.GetCollection('students').listAll()"),
-    Option("Courses", "CollectionManager.GetCollection('courses').listAll()"),
-    Option("Sections", "CollectionManager.GetCollection('sections').listAll()"),
-    Option("StudentMajors", "CollectionManager.GetCollection('students').listStudentMajors()"),
-    Option("Enrollments", "CollectionManager.GetCollection('students').listEnrollments()"),
-    Option("Exit", "pass")
+    Option("Departments", "departments.list"),
+    Option("Majors", "majors.list"),
+    Option("Students", "students.list"),
+    Option("Courses", "courses.list"),
+    Option("Sections", "sections.list"),
+    Option("StudentMajors", "studentMajors.list"),
+    Option("Enrollments", "enrollments.list"),
+    Option("Timetable Conflicts", "timetable.conflicts"),
+    Option("Reports", "reports.show"),
+    Option("Integrity Check", "check"),
+    Option("Export", "export"),
+    Option("Exit", None)
 ])
 
 menu_delete = Menu('delete', 'Select Collection to Delete:', [
-    Option("Departments", "CollectionManager.GetCollection('departments').deleteDoc()"),
-    Option("Majors", "CollectionManager.GetCollection('departments').deleteMajor()"),
-    Option("Students", "CollectionManager.GetCollection('students').deleteDoc()"),
-    Option("Courses", "CollectionManager.GetCollection('courses').deleteDoc()"),
-    Option("Sections", "CollectionManager.GetCollection('sections').deleteDoc()"),
-    Option("StudentMajors", "CollectionManager.GetCollection('students').deleteMajor()"),
-    Option("Enrollments", "CollectionManager.GetCollection('students').deleteEnrollment()"),
-    Option("Exit", "pass")
+    Option("Departments", "departments.delete"),
+    Option("Majors", "majors.delete"),
+    Option("Students", "students.delete"),
+    Option("Courses", "courses.delete"),
+    Option("Sections", "sections.delete"),
+    Option("StudentMajors", "studentMajors.delete"),
+    Option("Enrollments", "enrollments.delete"),
+    Option("By Filter", "deleteByFilter"),
+    Option("Exit", None)
+])
+
+menu_analytics = Menu('analytics', 'Select Analytics Option:', [
+    Option("Units Per Student", "analytics.units"),
+    Option("Fill Rate By Department", "analytics.fill"),
+    Option("Instructor Load", "analytics.instructors"),
+    Option("Build Snapshot", "snapshot"),
+    Option("Exit", None)
+])
+
+menu_main = Menu('main', 'Select Option:', [
+    Option("Add", menu_add),
+    Option("Select", menu_select),
+    Option("List", menu_list),
+    Option("Delete", menu_delete),
+    Option("Analytics", menu_analytics),
+    Option("Stats", "stats"),
+    Option("Write Metrics File", "stats.dump"),
+    Option("Exit this application", None)
 ])
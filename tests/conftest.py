@@ -0,0 +1,77 @@
+import itertools
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Search
+import WriteBehind
+from Base import Base
+from CollectionManager import CollectionManager
+from Connect import Connect
+from Department import Department
+from Student import Student
+from Course import Course
+from Section import Section
+
+_databases = itertools.count()
+
+
+@pytest.fixture
+def db():
+    # Every test gets a database of its own, set up the way main.py does it in mode = memory
+    WriteBehind.stop()
+    connect = Connect({"mode": "memory", "database": f"Test{next(_databases)}"})
+    database = connect.database()
+    CollectionManager._collections.clear()
+    CollectionManager.RegisterCollection("departments", lambda: Department(database))
+    CollectionManager.RegisterCollection("students", lambda: Student(database))
+    CollectionManager.RegisterCollection("courses", lambda: Course(database), ["departments"])
+    CollectionManager.RegisterCollection("sections", lambda: Section(database), ["courses"])
+    for cache in Base._caches.values():
+        cache.invalidate()
+    for index in Search.INDEXES.values():
+        index.invalidate()
+    yield database
+    WriteBehind.stop()
+
+
+@pytest.fixture
+def collections(db):
+    return {name: CollectionManager.GetCollection(name) for name in ["departments", "students", "courses", "sections"]}
+
+
+def addDepartment(db, abbreviation: str = "CECS", **fields) -> dict:
+    doc = {"name": f"Department of {abbreviation}", "abbreviation": abbreviation,
+           "chair_name": f"Chair {abbreviation}", "building": "ECS", "office": 100,
+           "description": "Test department", "majors": [], "courses": []}
+    doc.update(fields)
+    doc["_id"] = db.departments.insert_one(doc).inserted_id
+    return doc
+
+
+def addCourse(db, department: dict, course_number: int = 100, **fields) -> dict:
+    doc = {"department": department["_id"], "course_number": course_number,
+           "course_name": f"Course {course_number}", "description": "Test course", "units": 3}
+    doc.update(fields)
+    doc["_id"] = db.courses.insert_one(doc).inserted_id
+    db.departments.update_one({"_id": department["_id"]},
+                              {"$push": {"courses": doc["_id"]}, "$inc": {"course_count": 1}})
+    return doc
+
+
+def addSection(db, course: dict, section_number: int = 1, **fields) -> dict:
+    doc = {"course": course["_id"], "section_number": section_number, "semester": "Fall", "section_year": 2024,
+           "building": "ECS", "room": section_number, "schedule": "MW", "start_time": 800,
+           "instructor": f"Instructor {section_number}", "students": [], "enrolled_count": 0}
+    doc.update(fields)
+    doc["_id"] = db.sections.insert_one(doc).inserted_id
+    return doc
+
+
+def addStudent(db, idx: int = 0) -> dict:
+    doc = {"last_name": f"Student{idx}", "first_name": "Test", "email": f"student{idx}@example.edu",
+           "majors": [], "sections": []}
+    doc["_id"] = db.students.insert_one(doc).inserted_id
+    return doc
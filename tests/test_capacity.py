@@ -0,0 +1,47 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+def assertConsistent(db, section_ids):
+    section_side = set()
+    for sect in db.sections.find({"_id": {"$in": section_ids}}):
+        assert len(sect["students"]) <= sect["capacity"]
+        assert sect["enrolled_count"] == len(sect["students"])
+        section_side.update((stu_id, sect["_id"]) for stu_id in sect["students"])
+    student_side = {(stu["_id"], enr["section_id"]) for stu in db.students.find() for enr in stu["sections"]}
+    assert student_side == section_side
+    return section_side
+
+
+def test_concurrent_enroll_many_never_overbooks(db, collections):
+    # Registration rush as in StressTest.py: many workers claim seats in a few small sections at once
+    dept = addDepartment(db)
+    section_ids = [addSection(db, addCourse(db, dept, 100 + idx), 1, capacity=5, room=idx + 1,
+                              start_time=800 + 200 * idx, instructor=f"Instructor {idx}")["_id"]
+                   for idx in range(4)]
+    student_ids = [addStudent(db, idx)["_id"] for idx in range(200)]
+    rng = random.Random(7)
+    requests = [[(rng.choice(student_ids), rng.choice(section_ids)) for _ in range(3)] for _ in range(400)]
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = [res for batch in pool.map(collections["students"].enroll_many, requests) for res in batch]
+
+    seated = assertConsistent(db, section_ids)
+    assert len(seated) == 4 * 5
+    assert sum(res["status"] == "enrolled" for res in results) == len(seated)
+    assert {res["status"] for res in results} <= {"enrolled", "conflict", "full"}
+
+
+def test_enroll_many_into_a_full_section(db, collections):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=3)
+    students = [addStudent(db, idx)["_id"] for idx in range(3)]
+    collections["students"].enroll_many([(stu_id, sect["_id"]) for stu_id in students])
+    latecomers = [addStudent(db, idx)["_id"] for idx in range(3, 43)]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda stu_id: collections["students"].enroll_many([(stu_id, sect["_id"])])[0],
+                                latecomers))
+
+    assert {res["status"] for res in results} == {"full"}
+    assert assertConsistent(db, [sect["_id"]]) == {(stu_id, sect["_id"]) for stu_id in students}
@@ -0,0 +1,28 @@
+import io
+from datetime import datetime
+from bson import json_util
+import Commands
+from conftest import addDepartment, addStudent
+
+
+def runLines(*operations) -> list:
+    out = io.StringIO()
+    Commands.runBatch([json_util.dumps(operation) for operation in operations], out=out)
+    return [json_util.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_student_major_declaration_date_is_stored_as_a_date(db, collections):
+    addDepartment(db)
+    stu = addStudent(db)
+    results = runLines(
+        {"command": "majors.add", "args": {"department": {"abbreviation": "CECS"}, "name": "Computer Science",
+                                           "description": "Computing"}},
+        {"command": "studentMajors.add", "args": {"student": {"_id": stu["_id"]}, "major": "Computer Science",
+                                                  "declaration_date": "2024-01-15"}},
+        {"command": "studentMajors.add", "args": {"student": {"_id": stu["_id"]}, "major": "Computer Science",
+                                                  "declaration_date": "15/01/2024"}},
+    )
+    assert [result["ok"] for result in results] == [True, True, False]
+    assert results[2]["error"].startswith("ValueError")
+    assert db.students.find_one({"_id": stu["_id"]})["majors"] == [
+        {"name": "Computer Science", "declaration_date": datetime(2024, 1, 15)}]
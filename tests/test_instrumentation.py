@@ -0,0 +1,52 @@
+import pytest
+import Instrumentation
+from Department import Department
+from Student import Student
+from Course import Course
+from Section import Section
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+@pytest.fixture
+def instrumented(db):
+    originals = {cls: {name: cls.__dict__[name] for name in Instrumentation.OPERATIONS if name in cls.__dict__}
+                 for cls in [Department, Student, Course, Section]}
+    Instrumentation.instrument(Department, Student, Course, Section)
+    Instrumentation.METRICS.reset()
+    yield
+    for cls, members in originals.items():
+        for name in Instrumentation.OPERATIONS:
+            if name in members:
+                setattr(cls, name, members[name])
+            elif name in cls.__dict__:
+                delattr(cls, name)
+    Instrumentation.METRICS.reset()
+
+
+def test_only_operations_are_timed_under_their_collection(db, instrumented, collections):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=1)
+    stu = addStudent(db)
+    collections["students"].enroll_many([(stu["_id"], sect["_id"])])
+    collections["sections"].resolve({"_id": sect["_id"]})
+    list(collections["courses"].listAll())
+
+    stats = Instrumentation.snapshot()
+    assert set(stats) == {"students.enroll_many", "sections.resolve", "courses.listAll"}
+    assert all(op["calls"] == 1 and op["errors"] == 0 for op in stats.values())
+
+
+def test_instrumenting_twice_does_not_double_count(db, instrumented, collections):
+    Instrumentation.instrument(Department, Student, Course, Section)
+    for cls in [Department, Student, Course, Section]:
+        for name in Instrumentation.OPERATIONS:
+            member = getattr(cls, name, None)
+            # One wrapper around the original method, not a wrapper around a wrapper
+            assert not hasattr(getattr(member, "__wrapped__", None), "__wrapped__"), f"{cls.__name__}.{name}"
+    addCourse(db, addDepartment(db))
+    list(collections["courses"].listAll())
+    collections["courses"].listPage()
+    collections["courses"].getAll()
+
+    stats = Instrumentation.snapshot()
+    assert {name: op["calls"] for name, op in stats.items()} == {
+        "courses.listAll": 1, "courses.listPage": 1, "courses.getAll": 1}
@@ -0,0 +1,41 @@
+from IntegrityChecker import IntegrityChecker
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+def test_course_without_a_department_is_reported(db, collections):
+    addCourse(db, addDepartment(db))
+    orphan = db.courses.insert_one({"course_number": 200, "course_name": "Unassigned", "description": "No department",
+                                    "units": 3}).inserted_id
+
+    report = IntegrityChecker(repair=True).run()
+    assert report.mismatches == {"course without a department": 1}
+    assert report.samples["course without a department"] == [f"course {orphan}"]
+    assert report.checked["course memberships"] == 2
+
+
+def test_one_sided_enrollments_are_repaired(db, collections):
+    sect = addSection(db, addCourse(db, addDepartment(db)))
+    stu = addStudent(db)
+    db.students.update_one({"_id": stu["_id"]}, {"$push": {"sections": {
+        "section_id": sect["_id"], "enrollment": {"type": "LetterGrade", "min_satisfactory": "C"}}}})
+
+    report = IntegrityChecker(repair=True).run()
+    assert report.mismatches == {"missing from section roster": 1}
+    assert report.repaired == {"missing from section roster": 1}
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert roster["students"] == [stu["_id"]] and roster["enrolled_count"] == 1
+    assert IntegrityChecker().run().mismatches == {}
+
+
+def test_roster_repair_respects_capacity(db, collections):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=1)
+    seated, unseated = addStudent(db, 0), addStudent(db, 1)
+    for stu in [seated, unseated]:
+        db.students.update_one({"_id": stu["_id"]}, {"$push": {"sections": {
+            "section_id": sect["_id"], "enrollment": {"type": "LetterGrade", "min_satisfactory": "C"}}}})
+
+    report = IntegrityChecker(repair=True).run()
+    assert report.mismatches == {"missing from section roster": 2, "roster full": 1}
+    assert report.repaired == {"missing from section roster": 1}
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert len(roster["students"]) == 1 and roster["enrolled_count"] == 1
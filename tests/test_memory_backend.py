@@ -0,0 +1,129 @@
+import pytest
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from MemoryBackend import MemoryDatabase
+from IndexAdvisor import planStages
+
+
+@pytest.fixture
+def mem():
+    return MemoryDatabase("BackendTest")
+
+
+@pytest.fixture
+def people(mem):
+    mem.create_collection("people")
+    mem.command("collMod", "people", validator={"$jsonSchema": {
+        "bsonType": "object",
+        "required": ["name"],
+        "properties": {"name": {"bsonType": "string", "maxLength": 10},
+                       "age": {"bsonType": "number", "minimum": 0},
+                       "tags": {"bsonType": "array", "items": {"bsonType": "string"}}}}})
+    mem.people.create_index([("name", 1)], unique=True)
+    return mem.people
+
+
+def test_schema_rejects_invalid_documents(people):
+    with pytest.raises(WriteError) as error:
+        people.insert_one({"name": "x" * 11})
+    assert error.value.code == 121
+    with pytest.raises(WriteError):
+        people.insert_one({"age": 3})
+    people.insert_one({"name": "ok", "age": 3})
+    with pytest.raises(WriteError):
+        people.update_one({"name": "ok"}, {"$set": {"age": -1}})
+    assert people.find_one({"name": "ok"})["age"] == 3
+
+
+def test_unique_index_rejects_duplicates(people):
+    people.insert_one({"name": "ann"})
+    with pytest.raises(DuplicateKeyError):
+        people.insert_one({"name": "ann"})
+    people.insert_one({"name": "bob"})
+    with pytest.raises(DuplicateKeyError):
+        people.update_one({"name": "bob"}, {"$set": {"name": "ann"}})
+    assert sorted(people.distinct("name")) == ["ann", "bob"]
+
+
+def test_unique_index_on_array_of_documents(mem):
+    mem.depts.create_index([("majors.name", 1)], unique=True)
+    mem.depts.insert_one({"majors": [{"name": "Math"}, {"name": "Physics"}]})
+    with pytest.raises(DuplicateKeyError):
+        mem.depts.insert_one({"majors": [{"name": "Physics"}]})
+    mem.depts.insert_one({"majors": [{"name": "Chemistry"}]})
+    assert mem.depts.count_documents({"majors.name": "Chemistry"}) == 1
+
+
+def test_array_queries_match_elements(mem):
+    mem.sections.insert_many([{"_id": 1, "students": ["a", "b"]}, {"_id": 2, "students": ["c"]}])
+    assert [doc["_id"] for doc in mem.sections.find({"students": "b"})] == [1]
+    assert [doc["_id"] for doc in mem.sections.find({"students": {"$in": ["c", "z"]}})] == [2]
+    assert [doc["_id"] for doc in mem.sections.find({"students": {"$ne": "a"}})] == [2]
+
+
+def test_positional_and_pipeline_updates(mem):
+    mem.students.insert_one({"_id": 1, "majors": [{"name": "Math", "count": 1}, {"name": "Art", "count": 5}]})
+    mem.students.update_one({"_id": 1, "majors.name": "Art"}, {"$inc": {"majors.$.count": 2}})
+    assert [major["count"] for major in mem.students.find_one({"_id": 1})["majors"]] == [1, 7]
+
+    mem.students.update_many({}, [{"$set": {"total": {"$sum": "$majors.count"}}}])
+    assert mem.students.find_one({"_id": 1})["total"] == 8
+
+    mem.students.update_one({"_id": 1}, {"$pull": {"majors": {"name": {"$in": ["Math"]}}}})
+    assert [major["name"] for major in mem.students.find_one({"_id": 1})["majors"]] == ["Art"]
+
+
+def test_conditional_update_matches_only_while_filter_holds(mem):
+    mem.sections.insert_one({"_id": 1, "capacity": 1, "students": []})
+    seat = {"_id": 1, "$expr": {"$lt": [{"$size": "$students"}, "$capacity"]}}
+    assert mem.sections.update_one(seat, {"$push": {"students": "a"}}).modified_count == 1
+    assert mem.sections.update_one(seat, {"$push": {"students": "b"}}).modified_count == 0
+    assert mem.sections.find_one({"_id": 1})["students"] == ["a"]
+
+
+def test_lookup_and_merge(mem):
+    mem.courses.insert_many([{"_id": 1, "name": "Algebra"}, {"_id": 2, "name": "Poetry"}])
+    mem.sections.insert_many([{"_id": 10, "course": 1, "n": 3}, {"_id": 11, "course": 1, "n": 4},
+                              {"_id": 12, "course": 2, "n": 5}])
+    joined = list(mem.sections.aggregate([
+        {"$lookup": {"from": "courses", "localField": "course", "foreignField": "_id", "as": "course"}},
+        {"$unwind": "$course"},
+        {"$group": {"_id": "$course.name", "n": {"$sum": "$n"}}},
+        {"$merge": {"into": "totals", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]))
+    assert joined == []
+    assert {doc["_id"]: doc["n"] for doc in mem.totals.find()} == {"Algebra": 7, "Poetry": 5}
+
+    mem.sections.delete_one({"_id": 12})
+    mem.sections.aggregate([{"$group": {"_id": "Algebra", "n": {"$sum": 1}}},
+                            {"$merge": {"into": "totals", "on": "_id", "whenMatched": "replace"}}])
+    assert {doc["_id"]: doc["n"] for doc in mem.totals.find()} == {"Algebra": 2, "Poetry": 5}
+
+
+def test_unordered_bulk_write_reports_failures_and_applies_the_rest(people):
+    people.insert_one({"name": "ann"})
+    with pytest.raises(BulkWriteError) as error:
+        people.bulk_write([InsertOne({"name": "ann"}), InsertOne({"name": "bob"}),
+                           UpdateOne({"name": "bob"}, {"$set": {"age": -5}}), DeleteOne({"name": "ann"})],
+                          ordered=False)
+    assert [failure["index"] for failure in error.value.details["writeErrors"]] == [0, 2]
+    assert error.value.details["nInserted"] == 1
+    assert people.distinct("name") == ["bob"]
+
+
+def test_ordered_bulk_write_stops_at_first_failure(people):
+    with pytest.raises(BulkWriteError) as error:
+        people.bulk_write([InsertOne({"name": "ann"}), InsertOne({"name": "ann"}), InsertOne({"name": "bob"})])
+    assert [failure["index"] for failure in error.value.details["writeErrors"]] == [1]
+    assert people.distinct("name") == ["ann"]
+
+
+def test_explain_reports_the_lookup_used(people):
+    people.insert_many([{"name": "ann", "age": 1}, {"name": "bob", "age": 2}])
+    indexed = people.find({"name": "ann"}).explain()
+    assert "IXSCAN" in planStages(indexed["queryPlanner"]["winningPlan"])
+    assert indexed["executionStats"]["totalDocsExamined"] == 1
+
+    scanned = people.find({"age": 2}).explain()
+    assert "COLLSCAN" in planStages(scanned["queryPlanner"]["winningPlan"])
+    assert scanned["executionStats"] == {"nReturned": 1, "totalDocsExamined": 2}
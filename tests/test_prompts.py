@@ -0,0 +1,24 @@
+import builtins
+from Course import Course
+from conftest import addDepartment, addCourse
+
+SECTION_ANSWERS = ["1", "Fall", "2024", "ECS", "101", "MW", "800", "Instructor"]
+
+
+def answer(monkeypatch, answers):
+    answers = iter(answers)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers))
+
+
+def test_section_capacity_is_optional(db, collections, monkeypatch):
+    course = addCourse(db, addDepartment(db))
+    monkeypatch.setattr(Course, "selectDoc", lambda self, resolveNames=True: course)
+
+    answer(monkeypatch, SECTION_ANSWERS + [""])
+    collections["sections"].addDoc()
+    answer(monkeypatch, ["2"] + SECTION_ANSWERS[1:4] + ["102", "TuTh", "900", "Instructor", "30"])
+    collections["sections"].addDoc()
+
+    capacities = {sect["room"]: sect.get("capacity") for sect in db.sections.find()}
+    assert capacities == {101: None, 102: 30}
+    assert "capacity" not in db.sections.find_one({"room": 101})
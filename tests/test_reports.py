@@ -0,0 +1,29 @@
+import Reporting
+import WriteBehind
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+def fillRow(db, sect) -> dict:
+    return db.report_section_fill.find_one({"_id": sect["_id"]})
+
+
+def test_roster_changes_mark_the_section_and_refresh_picks_it_up(db, collections, tmp_path):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=4)
+    first, second = addStudent(db, 0)["_id"], addStudent(db, 1)["_id"]
+    Reporting.refresh(full=True)
+    assert fillRow(db, sect)["enrolled"] == 0
+
+    collections["students"].enroll_many([(first, sect["_id"]), (second, sect["_id"])])
+    # The mark is part of the enrollment write itself, not a report_dirty write of its own
+    assert db[Reporting.DIRTY_COLLECTION].count_documents({}) == 0
+    assert Reporting.SECTION_MARK in db.sections.find_one({"_id": sect["_id"]})
+    assert Reporting.refresh() == {"terms": 1, "departments": 1}
+    assert fillRow(db, sect)["enrolled"] == 2 and fillRow(db, sect)["fill_rate"] == 0.5
+    assert Reporting.SECTION_MARK not in db.sections.find_one({"_id": sect["_id"]})
+    assert Reporting.refresh() == {"terms": 0, "departments": 0}
+
+    # Queued removals carry the mark through the write-behind queue
+    WriteBehind.start(interval=60, failure_log=str(tmp_path / "failures.jsonl"))
+    assert collections["students"].unenroll(first, sect["_id"])
+    assert Reporting.refresh() == {"terms": 1, "departments": 1}
+    assert fillRow(db, sect)["enrolled"] == 1
@@ -0,0 +1,84 @@
+from BulkImport import BulkImporter
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+def importRow(collection_name: str, row: dict):
+    return BulkImporter().importRows(collection_name, [(1, row)])
+
+
+def test_course_with_sections_is_not_deleted(db, collections):
+    dept = addDepartment(db)
+    course = addCourse(db, dept)
+    addSection(db, course)
+
+    assert not collections["courses"].deleteDoc(db.courses.find_one({"_id": course["_id"]}))
+    summary = collections["courses"].delete_many({"_id": course["_id"]})
+    assert summary["deleted"] == 0 and summary["refused"] == {"the course still has sections": 1}
+    assert db.courses.count_documents({}) == 1
+    assert db.departments.find_one({"_id": dept["_id"]})["courses"] == [course["_id"]]
+
+
+def test_deleting_a_course_unlists_it_from_its_department(db, collections):
+    dept = addDepartment(db)
+    kept, dropped = addCourse(db, dept, 100), addCourse(db, dept, 200)
+
+    assert collections["courses"].delete_many({"course_number": 200})["deleted"] == 1
+    assert db.departments.find_one({"_id": dept["_id"]})["courses"] == [kept["_id"]]
+    assert db.courses.find_one({"_id": dropped["_id"]}) is None
+
+
+def test_deleting_students_removes_them_from_rosters(db, collections):
+    course = addCourse(db, addDepartment(db))
+    sect = addSection(db, course)
+    stays, leaves = addStudent(db, 0), addStudent(db, 1)
+    collections["students"].enroll_many([(stays["_id"], sect["_id"]), (leaves["_id"], sect["_id"])])
+
+    assert collections["students"].delete_many({"_id": leaves["_id"]})["deleted"] == 1
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert roster["students"] == [stays["_id"]]
+    assert roster["enrolled_count"] == 1
+
+
+def test_same_course_same_term_is_rejected(db, collections):
+    course = addCourse(db, addDepartment(db))
+    first = addSection(db, course, 1)
+    second = addSection(db, course, 2, schedule="TuTh")
+    other_term = addSection(db, course, 3, semester="Spring")
+    stu = addStudent(db)
+
+    results = collections["students"].enroll_many([(stu["_id"], first["_id"]), (stu["_id"], second["_id"]),
+                                                   (stu["_id"], other_term["_id"])])
+    assert [res["status"] for res in results] == ["enrolled", "conflict", "enrolled"]
+    assert [enr["section_id"] for enr in db.students.find_one({"_id": stu["_id"]})["sections"]] == \
+        [first["_id"], other_term["_id"]]
+    assert db.sections.find_one({"_id": second["_id"]})["students"] == []
+
+
+def test_seat_claims_stop_at_capacity(db, collections):
+    course = addCourse(db, addDepartment(db))
+    sect = addSection(db, course, capacity=2)
+    students = [addStudent(db, idx) for idx in range(3)]
+
+    results = collections["students"].enroll_many([(stu["_id"], sect["_id"]) for stu in students])
+    assert [res["status"] for res in results] == ["enrolled", "enrolled", "full"]
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert roster["students"] == [students[0]["_id"], students[1]["_id"]]
+    assert roster["enrolled_count"] == 2
+    assert db.students.find_one({"_id": students[2]["_id"]})["sections"] == []
+
+
+def test_schema_violations_are_reported_per_row(db, collections):
+    report = importRow("departments", {"name": "Too short", "abbreviation": "SHRT", "chair_name": "Chair",
+                                       "building": "ECS", "office": 1, "description": "Name is under 10"})
+    assert report.inserted == 0 and len(report.failures) == 1
+    assert db.departments.count_documents({}) == 0
+
+
+def test_unique_combinations_are_enforced(db, collections):
+    row = {"name": "Computer Science", "abbreviation": "CECS", "chair_name": "Chair", "building": "ECS",
+           "office": 1, "description": "Computing"}
+    assert importRow("departments", row).inserted == 1
+    duplicate = importRow("departments", dict(row, name="Computer Engineering", chair_name="Other Chair"))
+    assert duplicate.inserted == 0
+    assert "duplicate key" in duplicate.failures[0][1]
+    assert db.departments.count_documents({}) == 1
@@ -0,0 +1,63 @@
+import threading
+import time
+import Search
+from Base import Base
+from conftest import addStudent
+
+
+def names(results) -> list:
+    return sorted(result["label"].split(",")[0] for result in results)
+
+
+def test_typo_and_prefix_matches(db, collections):
+    for idx, last_name in enumerate(["Hernandez", "Hernandes", "Smith"]):
+        db.students.insert_one({"last_name": last_name, "first_name": "Ana", "email": f"s{idx}@example.edu",
+                                "majors": [], "sections": []})
+    assert names(Search.search("students", "hernandez")) == ["Hernandes", "Hernandez"]
+    assert names(Search.search("students", "smi ana")) == ["Smith"]
+
+
+def test_a_shorter_term_at_the_same_cost_still_ranks(db, collections):
+    # Both are prefix matches (cost 1); the shorter term is the better key and must displace the longer one
+    db.students.insert_one({"last_name": "Marchetti", "first_name": "Ana", "email": "a@example.edu", "majors": [],
+                            "sections": []})
+    db.students.insert_one({"last_name": "Marco", "first_name": "Ana", "email": "b@example.edu", "majors": [],
+                            "sections": []})
+    assert names(Search.search("students", "mar", limit=1)) == ["Marco"]
+
+
+def test_stale_index_is_rebuilt_without_blocking_searches(db, collections, monkeypatch):
+    index = Search.INDEXES["students"]
+    monkeypatch.setattr(index, "ttl", 0.05)
+    addStudent(db, 0)
+    assert names(Search.search("students", "student0")) == ["Student0"]
+
+    # Written by "another process": no event, so only a rebuild picks it up
+    addStudent(db, 1)
+    reading, release = threading.Event(), threading.Event()
+    students = collections["students"].collection
+    find = students.find
+
+    def slowFind(*args, **kwargs):
+        reading.set()
+        release.wait(5)
+        return find(*args, **kwargs)
+    monkeypatch.setattr(students, "find", slowFind)
+
+    time.sleep(0.1)
+    started = time.perf_counter()
+    assert names(Search.search("students", "student")) == ["Student0"]
+    assert reading.wait(5)
+    assert names(Search.search("students", "student")) == ["Student0"]
+    assert time.perf_counter() - started < 1
+
+    # An insert during the read lands in both the current index and the one being built
+    added = addStudent(db, 2)
+    Base.emit("students", "insert", added["_id"], added)
+    assert names(Search.search("students", "student")) == ["Student0", "Student2"]
+
+    release.set()
+    with index._buildLock:
+        pass
+    monkeypatch.setattr(index, "ttl", 600.0)
+    assert names(Search.search("students", "student")) == ["Student0", "Student1", "Student2"]
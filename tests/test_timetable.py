@@ -0,0 +1,33 @@
+import random
+from Timetable import Timetable, meetings, SCHEDULE_DAYS
+
+
+def section(sect_id, schedule: str, start_time: int) -> dict:
+    return {"_id": sect_id, "schedule": schedule, "start_time": start_time}
+
+
+def test_clash_with_an_earlier_longer_meeting_behind_an_existing_overlap():
+    # Enrolled before overlaps were refused: a Friday block and a MWF class inside it
+    timetable = Timetable()
+    timetable.add(section("friday", "F", 800))
+    timetable.add(section("early", "MWF", 900))
+
+    # Friday 10:00 misses its neighbour (9:00-9:50) but still falls inside the 8:00-10:45 block
+    assert timetable.conflicts(section("late", "MWF", 1000)) == {"friday"}
+    assert timetable.conflicts(section("after", "MWF", 1100)) == set()
+
+
+def test_conflicts_match_a_pairwise_check():
+    rng = random.Random(3)
+    starts = [800 + 100 * hour + minute for hour in range(11) for minute in [0, 30]]
+    for _ in range(200):
+        timetable, added = Timetable(), []
+        for idx in range(rng.randint(0, 6)):
+            sect = section(idx, rng.choice(list(SCHEDULE_DAYS)), rng.choice(starts))
+            timetable.add(sect)
+            added.append(sect)
+        candidate = section("new", rng.choice(list(SCHEDULE_DAYS)), rng.choice(starts))
+        expected = {sect["_id"] for sect in added
+                    if any(start < other_end and other_start < end for start, end in meetings(candidate)
+                           for other_start, other_end in meetings(sect))}
+        assert timetable.conflicts(candidate) == expected
@@ -0,0 +1,58 @@
+from datetime import datetime
+from bson import ObjectId
+import WriteBehind
+from conftest import addDepartment, addCourse, addSection, addStudent
+
+
+def test_removals_from_one_section_merge_and_recount(db, collections, tmp_path):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=3)
+    students = [addStudent(db, idx)["_id"] for idx in range(3)]
+    collections["students"].enroll_many([(stu_id, sect["_id"]) for stu_id in students])
+
+    queue = WriteBehind.start(interval=60, failure_log=str(tmp_path / "failures.jsonl"))
+    for stu_id in students[:2]:
+        assert collections["students"].unenroll(stu_id, sect["_id"])
+    # Removing a student that isn't on the roster leaves the count alone instead of decrementing it
+    assert collections["sections"].f_removeStudent(sect["_id"], students[0])
+    assert queue.pending() == 1
+
+    counts = WriteBehind.flush()
+    assert counts["merged"] == 2 and counts["batches"] == 1 and counts["failed"] == 0
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert roster["students"] == students[2:] and roster["enrolled_count"] == 1
+
+
+def test_enroll_many_sees_queued_removals(db, collections, tmp_path):
+    sect = addSection(db, addCourse(db, addDepartment(db)), capacity=1)
+    first, second = addStudent(db, 0)["_id"], addStudent(db, 1)["_id"]
+    students = collections["students"]
+    students.enroll_many([(first, sect["_id"])])
+
+    queue = WriteBehind.start(interval=60, failure_log=str(tmp_path / "failures.jsonl"))
+    assert students.unenroll(first, sect["_id"])
+    assert [res["status"] for res in students.enroll_many([(second, sect["_id"])])] == ["enrolled"]
+    assert queue.pending() == 0
+    roster = db.sections.find_one({"_id": sect["_id"]})
+    assert roster["students"] == [second] and roster["enrolled_count"] == 1
+
+
+def majorCount(db) -> int:
+    return db.departments.find_one({})["majors"][0]["student_count"]
+
+
+def test_major_update_of_a_missing_student_counts_nothing(db, collections, tmp_path):
+    addDepartment(db)
+    collections["departments"].createMajor(db.departments.find_one({})["_id"], "Computer Science", "Computing")
+    students = collections["students"]
+    stu = addStudent(db)
+
+    assert not students.update_student_major(ObjectId(), "Computer Science", datetime(2024, 1, 15))
+    assert majorCount(db) == 0
+
+    queue = WriteBehind.start(interval=60, failure_log=str(tmp_path / "failures.jsonl"))
+    assert students.update_student_major(ObjectId(), "Computer Science", datetime(2024, 1, 15))
+    assert students.update_student_major(stu["_id"], "Computer Science", datetime(2024, 1, 15))
+    counts = WriteBehind.flush()
+    assert majorCount(db) == 1
+    assert counts["failed"] == 1 and "matched no document" in (tmp_path / "failures.jsonl").read_text()
+    assert queue.pending() == 0